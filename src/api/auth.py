@@ -1,10 +1,11 @@
+from contextlib import ExitStack
 from functools import wraps
 
 from flask import g, request
 from flask_restful import abort
 from werkzeug.local import LocalProxy
 
-from src.services.auth import AuthSvc
+from src.services.auth import AuthSvc, user_ctx
 
 
 # proxy to get username from g
@@ -33,3 +34,20 @@ def requires_auth(schemes=("basic",)):
         return decorated
 
     return wrapper
+
+
+def impersonate_request(func):
+    """Run the whole request under the privileges of the current user, so
+    that service calls do not switch credentials one by one. Users without
+    an account to run as are not authorized."""
+
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(user_ctx(getattr(g, "username", None)))
+            except KeyError:
+                abort(401, code=401, reason="Unauthorized")
+            return func(*args, **kwargs)
+
+    return decorated
@@ -1,21 +1,324 @@
+import functools
 import os
+import shutil
+import time
 
-from flask import Blueprint, request, send_file
+from flask import Blueprint, current_app, request, send_file
 from flask_restful import Api, Resource
 from marshmallow import EXCLUDE, ValidationError
 
 from src import utils
-from src.api.auth import current_username
+from src.api.auth import current_username, impersonate_request
+from src.api.filesystem import send_archive
 from src.schemas.deserializers import filemgr as dsl
 from src.schemas.serializers import filemgr as sl
+from src.services import archive, dircache, jobs
+from src.services.auth import thread_ctx
 from src.services.filemgr import FileManagerSvc
+from src.utils import du, paging, threads, upload
 
 blueprint = Blueprint("file_manager", __name__, url_prefix="/file-manager")
 api = Api(blueprint)
 
 
+def read_action(svc, req):
+    """List the files of a directory, or a page of them. The version of the
+    listing covers the stats of the files, while cursors only go stale as
+    files are added, removed or renamed (see 'page_files')."""
+    version = svc.version(req["path"], req["showHiddenItems"], children=True)
+    if req.get("version") == version and "cursor" not in req:
+        return sl.dump_stats(version=version, notModified=True)
+    if any(key in req for key in ("limit", "cursor", "sortBy", "order")):
+        files, cursor = svc.page_stats(
+            path=req["path"],
+            limit=req.get("limit"),
+            cursor=req.get("cursor"),
+            sort_by=req.get("sortBy", "name"),
+            order=req.get("order", "asc"),
+            show_hidden=req["showHiddenItems"],
+        )
+        return sl.dump_stats(
+            cwd=svc.stats(path=req["path"]),
+            files=files,
+            version=version,
+            cursor=cursor,
+        )
+    files = svc.list_stats(
+        path=req["path"],
+        show_hidden=req["showHiddenItems"],
+    )
+    return sl.dump_stats(cwd=svc.stats(path=req["path"]), files=files, version=version)
+
+
+def create_action(svc, req):
+    """Create a directory."""
+    svc.make_dir(path=req["path"], name=req["name"])
+    return sl.dump_stats(
+        files=[svc.stats(os.path.join(req["path"], req["name"]))],
+    )
+
+
+def delete_action(svc, req):
+    """Delete files."""
+    for name in req["names"]:
+        path = os.path.join(req["path"], name)
+        svc.remove_path(path=path)
+    return sl.dump_stats(
+        files=[{"path": os.path.join(req["path"], name)} for name in req["names"]],
+    )
+
+
+def rename_action(svc, req):
+    """Rename a file."""
+    src = os.path.join(req["path"], req["name"])
+    dst = os.path.join(req["path"], req["newName"])
+    if svc.exists_path(dst):
+        return sl.dump_error(
+            code=400,
+            message=f"Cannot rename {req['name']} to "
+            f"{req['newName']}: destination already exists.",
+        )
+    else:
+        svc.rename_path(src=src, dst=dst)
+        return sl.dump_stats(
+            files=[svc.stats(os.path.join(req["path"], req["newName"]))]
+        )
+
+
+def search_action(svc, req):
+    """Search the tree under a directory, streaming the files found."""
+    files = svc.search_stats(
+        path=req["path"],
+        pattern=req["searchString"],
+        case_sensitive=req.get("caseSensitive", False),
+        show_hidden=req["showHiddenItems"],
+        max_depth=req.get("maxDepth"),
+        max_results=req.get("maxResults"),
+    )
+    schema = sl.StatsSchema()
+    items = (schema.dump(file) for file in files)
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        return utils.stream_json(items, mimetype="application/x-ndjson")
+    cwd = schema.dump(svc.stats(path=req["path"]))
+    return utils.stream_json(items, envelope={"cwd": cwd}, key="files")
+
+
+def details_action(svc, req):
+    """Describe files, summing the content of directories."""
+    stats = []
+    computing = False  # whether sizes are still partial
+    deadline = time.monotonic() + svc.size_budget
+    paths = [os.path.join(req["path"], name) for name in req["names"]]
+    for path, file_stats in zip(paths, svc.bulk_stats(paths)):
+        if isinstance(file_stats, OSError):
+            raise file_stats
+        if not file_stats["isFile"]:
+            size, complete = svc.disk_usage(
+                path, budget=max(deadline - time.monotonic(), 0)
+            )
+            file_stats = {**file_stats, "size": size}
+            computing = computing or not complete
+        stats.append(file_stats)
+
+    if not stats:
+        raise ValueError("Missing data")
+    elif len(stats) == 1:
+        stats = stats[0]
+        return sl.dump_details(
+            name=stats["name"],
+            size=utils.convert_bytes(stats["size"]),
+            location=stats["path"],
+            created=stats["dateCreated"],
+            modified=stats["dateModified"],
+            isFile=stats["isFile"],
+            multipleFiles=False,
+            computing=computing,
+        )
+    elif len(stats) > 1:
+        size = sum(s["size"] for s in stats)
+        return sl.dump_details(
+            location=f"All in {os.path.dirname(stats[0]['path'])}",
+            name=", ".join(s["name"] for s in stats),
+            size=utils.convert_bytes(size),
+            isFile=False,
+            multipleFiles=True,
+            computing=computing,
+        )
+
+
+def copy_action(svc, req):
+    """Copy files into another directory."""
+    files = []
+    failures = []
+    for name in req["names"]:
+        src = req["path"]
+        dst = req["targetPath"]
+        try:
+            path = svc.copy_path(src=os.path.join(src, name), dst=dst)
+        except shutil.Error as ex:  # some files of a directory
+            failures.extend(error[0] for error in ex.args[0])
+            continue
+        stats = svc.stats(path)
+        files.append(stats)
+    if failures:
+        return sl.dump_error(
+            code=400,
+            message=f"Cannot copy {', '.join(failures)}",
+            files=files,
+        )
+    return sl.dump_stats(files=files)
+
+
+def move_action(svc, req):
+    """Move files into another directory."""
+    files = []
+    conflicts = []
+    for name in req["names"]:
+        src = req["path"]
+        dst = req["targetPath"]
+        if svc.exists_path(os.path.join(dst, name)) and name not in req["renameFiles"]:
+            conflicts.append(name)
+        else:
+            path = svc.move_path(src=os.path.join(src, name), dst=dst)
+            stats = svc.stats(path)
+            files.append(stats)
+    if conflicts:
+        return sl.dump_error(
+            code=400,
+            message="File Already Exists",
+            fileExists=conflicts,
+            files=files,
+        )
+    return sl.dump_stats(files=files)
+
+
+# the schema and handler of each action
+ACTIONS = {
+    "read": (dsl.ReadActionSchema, read_action),
+    "create": (dsl.CreateActionSchema, create_action),
+    "delete": (dsl.DeleteActionSchema, delete_action),
+    "rename": (dsl.RenameActionSchema, rename_action),
+    "search": (dsl.SearchActionSchema, search_action),
+    "details": (dsl.DetailsActionSchema, details_action),
+    "copy": (dsl.CopyActionSchema, copy_action),
+    "move": (dsl.MoveActionSchema, move_action),
+}
+
+
+# actions that may be batched, i.e. that change files
+BATCH_ACTIONS = {
+    name: ACTIONS[name] for name in ("create", "rename", "delete", "copy", "move")
+}
+
+
+def load_action(payload, actions=ACTIONS):
+    """The handler of an action, and its validated request."""
+    # throw error when invalid action
+    dsl.ReadActionSchema(only=("action",), unknown=EXCLUDE).load(payload)
+    if payload["action"] not in actions:
+        raise ValidationError("Unsupported action", field_name="action")
+    schema, handler = actions[payload["action"]]
+    return handler, schema().load(payload)
+
+
+def run_action(svc, payload, actions=ACTIONS):
+    """Run an action, responding with its error should it fail."""
+    try:
+        handler, req = load_action(payload, actions)
+        return handler(svc, req)
+    except PermissionError:
+        return sl.dump_error(code=403, message="Permission Denied")
+    except FileNotFoundError:
+        return sl.dump_error(code=404, message="File Not Found")
+    except paging.StaleCursorError:
+        return sl.dump_error(code=409, message="Listing Changed")
+    except (OSError, ValueError, ValidationError):
+        return sl.dump_error(code=400, message="Bad request")
+
+
+def touched_paths(req):
+    """The paths an action changes, or depends on."""
+    names = req.get("names", []) + [
+        req[key] for key in ("name", "newName") if key in req
+    ]
+    paths = [os.path.join(req.get("path", ""), name) for name in names]
+    if "targetPath" in req:
+        paths.append(req["targetPath"])
+    return [os.path.join(os.path.sep, os.path.normpath(path)) for path in paths]
+
+
+def overlap(path, other):
+    """Whether two paths are the same, or one is under the other."""
+    return (
+        path == other
+        or path.startswith(os.path.join(other, ""))
+        or other.startswith(os.path.join(path, ""))
+    )
+
+
+def batch_waves(touched):
+    """Group the items of a batch, given the paths each one touches, into
+    waves run one after the other. Items touching the paths of an earlier
+    item run in a later wave than it, so their order is kept, and the items
+    of a wave are independent of one another."""
+    waves = []
+    placed = []  # wave of each item
+    for i, paths in enumerate(touched):
+        wave = 1 + max(
+            (
+                placed[j]
+                for j in range(i)
+                if any(overlap(p, q) for p in paths for q in touched[j])
+            ),
+            default=-1,
+        )
+        placed.append(wave)
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(i)
+    return waves
+
+
+def run_batch(svc, payloads, mode="stop"):
+    """Run the actions of a batch, responding with the result of each one.
+
+    When stopping on errors, actions run in order and the ones that follow a
+    failed action are skipped. Otherwise, independent actions run at once
+    (see 'thread_ctx').
+    """
+    results = [None] * len(payloads)
+    if mode == "stop":
+        for i, payload in enumerate(payloads):
+            results[i] = run_action(svc, payload, BATCH_ACTIONS)
+            if "error" in results[i]:
+                break
+        return [
+            result or sl.dump_error(code=424, message="Skipped") for result in results
+        ]
+
+    touched = []
+    for payload in payloads:
+        try:
+            _, req = load_action(payload, BATCH_ACTIONS)
+        except ValidationError:
+            touched.append([])  # fails without touching anything
+        else:
+            touched.append(touched_paths(req))
+
+    def run(i):
+        with thread_ctx(svc.username):
+            results[i] = run_action(svc, payloads[i], BATCH_ACTIONS)
+
+    workers = min(svc.batch_workers, len(payloads))
+    with threads.executor(workers) as executor:
+        for wave in batch_waves(touched):
+            list(executor.map(run, wave))
+    return results
+
+
 @api.resource("/actions", endpoint="fm_actions")
 class FileManagerActions(Resource):
+    @impersonate_request
     def post(self):
         """
         Use request body to specify intended action on given path.
@@ -46,143 +349,98 @@ class FileManagerActions(Resource):
                                 - StatsResponseSchema
                                 - DetailsResponseSchema
                                 - ErrorResponseSchema
+                    application/x-ndjson:
+                        schema:
+                            type: string
+                            description: search results, one per line
+        """
+        return run_action(FileManagerSvc(username=current_username), request.json)
+
+
+@api.resource("/batch", endpoint="fm_batch")
+class FileManagerBatch(Resource):
+    @impersonate_request
+    def post(self):
+        """
+        Run many actions on files at once, each with a result of its own.
+        ---
+        tags:
+            - file manager
+        requestBody:
+            description: the actions, in order
+            required: true
+            content:
+                application/json:
+                    schema: BatchSchema
+        responses:
+            200:
+                content:
+                    application/json:
+                        schema: BatchResponseSchema
+            400:
+                $ref: "#/components/responses/BadRequest"
         """
         payload = request.json
         svc = FileManagerSvc(username=current_username)
         try:
-            # throw error when invalid action
-            dsl.ReadActionSchema(only=("action",), unknown=EXCLUDE).load(payload)
-            if payload["action"] == "read":
-                req = dsl.ReadActionSchema().load(payload)
-                files = svc.list_files(
-                    path=req["path"],
-                    show_hidden=req["showHiddenItems"],
-                )
-                return sl.dump_stats(
-                    cwd=svc.stats(path=req["path"]),
-                    files=[svc.stats(file.path) for file in files],
-                )
-            elif payload["action"] == "create":
-                req = dsl.CreateActionSchema().load(payload)
-                svc.make_dir(path=req["path"], name=req["name"])
-                return sl.dump_stats(
-                    files=[svc.stats(os.path.join(req["path"], req["name"]))],
-                )
-            elif payload["action"] == "delete":
-                req = dsl.DeleteActionSchema().load(payload)
-                for name in req["names"]:
-                    path = os.path.join(req["path"], name)
-                    svc.remove_path(path=path)
-                return sl.dump_stats(
-                    files=[
-                        {"path": os.path.join(payload["path"], name)}
-                        for name in payload["names"]
-                    ],
-                )
-            elif payload["action"] == "rename":
-                req = dsl.RenameActionSchema().load(payload)
-                src = os.path.join(req["path"], req["name"])
-                dst = os.path.join(req["path"], req["newName"])
-                if svc.exists_path(dst):
-                    return sl.dump_error(
-                        code=400,
-                        message=f"Cannot rename {req['name']} to "
-                        f"{req['newName']}: destination already exists.",
-                    )
-                else:
-                    svc.rename_path(src=src, dst=dst)
-                    return sl.dump_stats(
-                        files=[svc.stats(os.path.join(req["path"], req["newName"]))]
-                    )
-            elif payload["action"] == "search":
-                req = dsl.SearchActionSchema().load(payload)
-                files = svc.list_files(
-                    path=req["path"],
-                    substr=req["searchString"],
-                    show_hidden=req["showHiddenItems"],
-                )
-                return sl.dump_stats(
-                    cwd=svc.stats(path=req["path"]),
-                    files=[svc.stats(file.path) for file in files],
-                )
-            elif payload["action"] == "details":
-                req = dsl.DetailsActionSchema().load(payload)
-                stats = []
-                for name in req["names"]:
-                    path = os.path.join(req["path"], name)
-                    file_stats = svc.stats(path=path)
-                    stats.append(file_stats)
-
-                if not stats:
-                    raise ValueError("Missing data")
-                elif len(stats) == 1:
-                    stats = stats[0]
-                    return sl.dump_details(
-                        name=stats["name"],
-                        size=utils.convert_bytes(stats["size"]),
-                        location=stats["path"],
-                        created=stats["dateCreated"],
-                        modified=stats["dateModified"],
-                        isFile=stats["isFile"],
-                        multipleFiles=False,
-                    )
-                elif len(stats) > 1:
-                    size = sum(s["size"] for s in stats)
-                    return sl.dump_details(
-                        location=f"All in {os.path.dirname(stats[0]['path'])}",
-                        name=", ".join(s["name"] for s in stats),
-                        size=utils.convert_bytes(size),
-                        isFile=False,
-                        multipleFiles=True,
-                    )
-            elif payload["action"] == "copy":
-                req = dsl.CopyActionSchema().load(payload)
-                files = []
-                for name in req["names"]:
-                    src = req["path"]
-                    dst = req["targetPath"]
-                    path = svc.copy_path(src=os.path.join(src, name), dst=dst)
-                    stats = svc.stats(path)
-                    files.append(stats)
-                return sl.dump_stats(files=files)
-            elif payload["action"] == "move":
-                req = dsl.MoveActionSchema().load(payload)
-                files = []
-                conflicts = []
-                for name in req["names"]:
-                    src = req["path"]
-                    dst = req["targetPath"]
-                    if (
-                        svc.exists_path(os.path.join(dst, name))
-                        and name not in req["renameFiles"]
-                    ):
-                        conflicts.append(name)
-                    else:
-                        path = svc.move_path(src=os.path.join(src, name), dst=dst)
-                        stats = svc.stats(path)
-                        files.append(stats)
-                if conflicts:
-                    return sl.dump_error(
-                        code=400,
-                        message="File Already Exists",
-                        fileExists=conflicts,
-                        files=files,
-                    )
-                return sl.dump_stats(files=files)
+            req = dsl.BatchSchema().load(payload)
+        except ValidationError:
+            utils.abort_with(400)
+        results = run_batch(svc, req["actions"], mode=req.get("mode", "stop"))
+        return sl.dump_batch(results=results)
 
-        except PermissionError:
-            return sl.dump_error(code=403, message="Permission Denied")
-        except FileNotFoundError:
-            return sl.dump_error(code=404, message="File Not Found")
-        except (OSError, ValidationError):
-            return sl.dump_error(code=400, message="Bad request")
+
+@api.resource("/stats", endpoint="fm_stats")
+class FileManagerStats(Resource):
+    @impersonate_request
+    def post(self):
+        """
+        Get the stats of many paths at once.
+        ---
+        tags:
+            - file manager
+        requestBody:
+            description: the paths to stat
+            required: true
+            content:
+                application/json:
+                    schema: BulkStatsSchema
+        responses:
+            200:
+                content:
+                    application/json:
+                        schema: BulkStatsResponseSchema
+            400:
+                $ref: "#/components/responses/BadRequest"
+        """
+        payload = request.json
+        svc = FileManagerSvc(username=current_username)
+        try:
+            req = dsl.BulkStatsSchema().load(payload)
+        except ValidationError:
+            utils.abort_with(400)
+        results = []
+        for path, stats in zip(req["paths"], svc.bulk_stats(req["paths"])):
+            if isinstance(stats, PermissionError):
+                error = utils.http_response(403, message=str(stats))
+            elif isinstance(stats, FileNotFoundError):
+                error = utils.http_response(404, message=str(stats))
+            elif isinstance(stats, OSError):
+                error = utils.http_response(400, message=str(stats))
+            else:
+                results.append({"path": path, "stats": stats})
+                continue
+            results.append({"path": path, "error": error})
+        return sl.dump_bulk_stats(results=results)
 
 
 @api.resource("/download", endpoint="fm_download")
 class FileManagerDownload(Resource):
+    @impersonate_request
     def post(self):
         """
-        Download files. Multiple files are merged into a zipped file.
+        Download files. Multiple files are merged into an archive, whose format
+        is given by the form, by the 'Accept' header or else by the server.
         ---
         tags:
             - file manager
@@ -212,29 +470,35 @@ class FileManagerDownload(Resource):
             req = dsl.DownloadSchema().load(payload)
             names = req["downloadInput"]["names"]
             paths = [os.path.join(req["downloadInput"]["path"], name) for name in names]
-            if len(paths) == 1:
-                path = paths[0]
-                if svc.isfile(path):
-                    return send_file(path, as_attachment=True)
-
-            tarfile = svc.create_attachment(paths=paths)
-            filename = f"{'files' if len(names) > 1 else names[0]}.tar.gz"
-            return send_file(
-                tarfile,
-                as_attachment=True,
-                mimetype="application/gzip",
-                download_name=filename,
-            )
+            formats = archive.accepted_formats(request.accept_mimetypes)
+            if "format" in req:
+                fmt = req["format"]
+            else:
+                if len(paths) == 1 and not formats:
+                    path = paths[0]
+                    if svc.isfile(path):
+                        return send_file(path, as_attachment=True)
+                fmt = svc.archive_format(
+                    paths=paths,
+                    formats=formats,
+                    policy=current_app.config["ARCHIVE_FORMAT"],
+                )
+
+            filename = f"{'files' if len(names) > 1 else names[0]}.{fmt}"
+            return send_archive(svc, paths=paths, download_name=filename, fmt=fmt)
         except PermissionError:
             utils.abort_with(403)
         except FileNotFoundError:
             utils.abort_with(404)
+        except ValueError as ex:
+            utils.abort_with(400, message=str(ex))
         except (OSError, ValidationError):
             utils.abort_with(400)
 
 
 @api.resource("/upload", endpoint="fm_upload")
 class FileManagerUpload(Resource):
+    @impersonate_request
     def post(self):
         """
         Upload files.
@@ -254,6 +518,7 @@ class FileManagerUpload(Resource):
                         schema:
                             oneOf:
                                 - $ref: "#/components/schemas/HttpResponse"
+                                - UploadResponseSchema
                                 - ErrorResponseSchema
             400:
                 $ref: "#/components/responses/BadRequest"
@@ -268,22 +533,256 @@ class FileManagerUpload(Resource):
             req = dsl.UploadSchema().load(payload)
             if req["action"] == "save":
                 file = request.files["uploadFiles"]
-                svc.save_file(req["path"], file=file)
+                if "chunk_index" not in req:
+                    svc.save_file(req["path"], file=file)
+                    return utils.http_response(200), 200
+                offset = svc.save_chunk(
+                    req["path"],
+                    file=file,
+                    index=req["chunk_index"],
+                    total=req.get("total_chunk", 1),
+                    chunk_size=req.get("chunk_size"),
+                    key=req.get("upload_id"),
+                )
+                return sl.dump_upload(**utils.http_response(200), offset=offset), 200
+            elif req["action"] == "status":
+                offset = svc.upload_offset(
+                    req["path"], filename=req["filename"], key=req.get("upload_id")
+                )
+                return sl.dump_upload(**utils.http_response(200), offset=offset), 200
             elif req["action"] == "remove":
-                path = os.path.join(req["path"], req["cancel-uploading"])
-                if svc.exists_path(path):
-                    svc.remove_path(path)
+                name = req["cancel_uploading"]
+                key = req.get("upload_id")
+                for path in (
+                    os.path.join(req["path"], name),
+                    svc.partial_path(req["path"], name, key=key),
+                    svc.upload_state_path(req["path"], name, key=key),
+                ):
+                    if svc.exists_path(path):
+                        svc.remove_path(path)
             return utils.http_response(200), 200
         except PermissionError:
             utils.abort_with(403)
         except FileNotFoundError:
             utils.abort_with(404)
-        except (OSError, ValidationError):
+        except ValueError as ex:
+            utils.abort_with(400, message=str(ex))
+        except (OSError, KeyError, ValidationError):
             utils.abort_with(400)
 
 
+@api.resource("/jobs", endpoint="fm_jobs")
+class FileManagerJobs(Resource):
+    @impersonate_request
+    def post(self):
+        """
+        Run a long action in the background.
+        ---
+        tags:
+            - file manager
+        requestBody:
+            description: job properties
+            required: true
+            content:
+                application/json:
+                    schema: JobSchema
+        responses:
+            202:
+                content:
+                    application/json:
+                        schema: JobSchema
+            400:
+                $ref: "#/components/responses/BadRequest"
+            429:
+                $ref: "#/components/responses/TooManyRequests"
+            501:
+                $ref: "#/components/responses/NotImplemented"
+        """
+        payload = request.json
+        # jobs outlive the request, so they get the name rather than its proxy
+        username = current_username._get_current_object()
+        svc = FileManagerSvc(username=username)
+        try:
+            req = dsl.JobSchema().load(payload)
+            if req["action"] in ("copy", "move") and "targetPath" not in req:
+                raise ValueError("missing target path")
+            if req["action"] == "copy":
+                func = functools.partial(jobs.copy_job, dst=req["targetPath"])
+            elif req["action"] == "move":
+                func = functools.partial(jobs.move_job, dst=req["targetPath"])
+            elif req["action"] == "delete":
+                func = jobs.delete_job
+            else:
+                names = req["names"]
+                func = functools.partial(
+                    jobs.archive_job,
+                    paths=[os.path.join(req["path"], name) for name in names],
+                    filename=f"{'files' if len(names) > 1 else names[0]}.tar.gz",
+                    bufsize=current_app.config["ARCHIVE_BUFFER_SIZE"],
+                    spool=jobs.manager.spool,
+                )
+                job = jobs.manager.submit(username, req["action"], func, svc)
+                return sl.dump_job(job), 202
+            job = jobs.manager.submit(
+                username,
+                req["action"],
+                func,
+                svc,
+                path=req["path"],
+                names=req["names"],
+            )
+            return sl.dump_job(job), 202
+        except jobs.JobLimitError as ex:
+            utils.abort_with(429, message=str(ex))
+        except jobs.JobsUnavailableError as ex:
+            utils.abort_with(501, message=str(ex))
+        except ValueError as ex:
+            utils.abort_with(400, message=str(ex))
+        except ValidationError:
+            utils.abort_with(400)
+
+
+@api.resource("/jobs/<string:job_id>", endpoint="fm_job")
+class FileManagerJob(Resource):
+    @impersonate_request
+    def get(self, job_id):
+        """
+        Get the progress of a job.
+        ---
+        tags:
+            - file manager
+        parameters:
+            - in: path
+              name: job_id
+              schema:
+                type: string
+              required: true
+              description: the id of the job
+        responses:
+            200:
+                content:
+                    application/json:
+                        schema: JobSchema
+            404:
+                $ref: "#/components/responses/NotFound"
+        """
+        try:
+            return sl.dump_job(jobs.manager.get(job_id, current_username))
+        except KeyError:
+            utils.abort_with(404)
+
+    @impersonate_request
+    def delete(self, job_id):
+        """
+        Cancel a job.
+        ---
+        tags:
+            - file manager
+        parameters:
+            - in: path
+              name: job_id
+              schema:
+                type: string
+              required: true
+              description: the id of the job
+        responses:
+            202:
+                content:
+                    application/json:
+                        schema: JobSchema
+            404:
+                $ref: "#/components/responses/NotFound"
+        """
+        try:
+            return sl.dump_job(jobs.manager.cancel(job_id, current_username)), 202
+        except KeyError:
+            utils.abort_with(404)
+
+
+@api.resource("/jobs/<string:job_id>/result", endpoint="fm_job_result")
+class FileManagerJobResult(Resource):
+    @impersonate_request
+    def get(self, job_id):
+        """
+        Get the result of a job, which is an archive for archive jobs.
+        ---
+        tags:
+            - file manager
+        parameters:
+            - in: path
+              name: job_id
+              schema:
+                type: string
+              required: true
+              description: the id of the job
+        responses:
+            200:
+                content:
+                    application/json:
+                        schema:
+                            oneOf:
+                                - StatsResponseSchema
+                                - ErrorResponseSchema
+                    application/gzip:
+                        schema:
+                            type: string
+                            format: binary
+            404:
+                $ref: "#/components/responses/NotFound"
+            409:
+                $ref: "#/components/responses/Conflict"
+        """
+        svc = FileManagerSvc(username=current_username)
+        try:
+            job = jobs.manager.get(job_id, current_username)
+            if job.status == "failed":
+                return sl.dump_error(code=400, message=job.error)
+            if job.status != "done":
+                utils.abort_with(409, message=f"job is {job.status}")
+            if job.action == "archive":
+                return send_file(
+                    job.result["archive"],
+                    as_attachment=True,
+                    mimetype="application/gzip",
+                    download_name=job.result["filename"],
+                )
+            elif job.action == "delete":
+                files = [{"path": path} for path in job.result["paths"]]
+            else:
+                files = [svc.stats(path) for path in job.result["paths"]]
+            return sl.dump_stats(files=files)
+        except KeyError:
+            utils.abort_with(404)
+        except PermissionError:
+            return sl.dump_error(code=403, message="Permission Denied")
+        except FileNotFoundError:
+            return sl.dump_error(code=404, message="File Not Found")
+
+
+@api.resource("/metrics", endpoint="fm_metrics")
+class FileManagerMetrics(Resource):
+    def get(self):
+        """
+        Get the usage metrics of uploads and caches, of the worker serving
+        the request.
+        ---
+        tags:
+            - file manager
+        responses:
+            200:
+                content:
+                    application/json:
+                        schema: MetricsSchema
+        """
+        caches = {"users": utils.nss_cache.info(), "sizes": du.cache.info()}
+        if dircache.cache is not None:
+            caches["listings"] = dircache.cache.info()
+        return sl.dump_metrics(uploads=upload.metrics.info(), caches=caches)
+
+
 @api.resource("/images", endpoint="fm_images")
 class FileManagerImages(Resource):
+    @impersonate_request
     def get(self):
         """
         Get images.
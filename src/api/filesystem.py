@@ -1,20 +1,79 @@
+import contextlib
 import os
+from urllib.parse import urlencode
 
-from flask import Blueprint, request, send_file
+from flask import Blueprint, Response, current_app, request, send_file
 from flask_restful import Api, Resource
 from http.client import HTTPException
 
 from src import utils
+from src.services import archive
+from src.services.auth import user_ctx
 from src.services.filesystem import FilesystemSvc
-from src.api.auth import current_username, requires_auth
+from src.utils import paging
+from src.api.auth import current_username, impersonate_request, requires_auth
 
 blueprint = Blueprint("filesystem", __name__)
 api = Api(blueprint)
 
+# query arguments paginating listings
+PAGING_ARGS = ("limit", "cursor", "sortBy", "order")
+
+# media types of archives extracted as they are uploaded
+ARCHIVE_UPLOADS = {archive.FORMATS[fmt]: fmt for fmt in ("tar", "tar.gz", "tar.zst")}
+
+
+def send_archive(svc, paths, download_name, fmt):
+    """Send an archive of given paths, from the cache of archives if there."""
+    config = current_app.config
+    mimetype = archive.FORMATS[fmt]
+    key = None
+    if archive.cache is not None:
+        key = svc.archive_fingerprint(paths=paths, format=fmt)
+        path = archive.cache.lookup(key)
+        if path is not None:
+            # cached archives belong to the service, and may be evicted meanwhile
+            with contextlib.suppress(FileNotFoundError), user_ctx(None):
+                return send_file(
+                    path,
+                    as_attachment=True,
+                    mimetype=mimetype,
+                    download_name=download_name,
+                    etag=key,
+                )
+
+    if config["ARCHIVE_STREAMING"]:
+        chunks = svc.stream_attachment(
+            paths=paths, bufsize=config["ARCHIVE_BUFFER_SIZE"], format=fmt
+        )
+        if key is None:
+            return utils.stream_attachment(
+                chunks, download_name=download_name, mimetype=mimetype
+            )
+        response = utils.stream_attachment(
+            archive.cache.tee(key, chunks),
+            download_name=download_name,
+            mimetype=mimetype,
+        )
+        response.set_etag(key)
+        return response.make_conditional(request)
+
+    attachment = svc.create_attachment(paths=paths, format=fmt)
+    if key is not None:
+        archive.cache.store(key, attachment.getbuffer())
+    return send_file(
+        attachment,
+        as_attachment=True,
+        mimetype=mimetype,
+        download_name=download_name,
+        etag=key or False,
+    )
+
 
 @api.resource("/<path:path>", endpoint="fs")
 class Filesystem(Resource):
     @requires_auth(schemes=["basic"])
+    @impersonate_request
     def get(self, path):
         """
         List files in given path.
@@ -30,19 +89,73 @@ class Filesystem(Resource):
                 type: string
               required: true
               description: the path to list content from
+            - in: query
+              name: stat
+              schema:
+                type: boolean
+              description: list stat records rather than names
+            - in: query
+              name: limit
+              schema:
+                type: integer
+                minimum: 1
+              description: the number of files of a page
+            - in: query
+              name: cursor
+              schema:
+                type: string
+              description: the cursor of the page, as given by the previous one
+            - in: query
+              name: sortBy
+              schema:
+                type: string
+                enum: [name, size, mtime, ctime, type]
+              description: the key files are sorted by
+            - in: query
+              name: order
+              schema:
+                type: string
+                enum: [asc, desc]
+              description: the order files are sorted in
         responses:
             200:
                 description: Ok
+                headers:
+                    Link:
+                        schema:
+                            type: string
+                        description: the next page of the listing, if any
                 content:
                     application/json:
                         schema:
                             type: array
                             items:
                                 type: string
+                    application/x-ndjson:
+                        schema:
+                            type: string
                     application/octet-stream:
                         schema:
                             type: string
                             format: binary
+                    application/zip:
+                        schema:
+                            type: string
+                            format: binary
+                    application/gzip:
+                        schema:
+                            type: string
+                            format: binary
+                    application/zstd:
+                        schema:
+                            type: string
+                            format: binary
+                    application/x-tar:
+                        schema:
+                            type: string
+                            format: binary
+            304:
+                description: Not Modified
             400:
                 $ref: "#/components/responses/BadRequest"
             401:
@@ -51,37 +164,84 @@ class Filesystem(Resource):
                 $ref: "#/components/responses/Forbidden"
             404:
                 $ref: "#/components/responses/NotFound"
+            409:
+                $ref: "#/components/responses/Conflict"
         """
         path = utils.normpath(path)
         svc = FilesystemSvc(username=current_username)
         try:
             accept = request.headers.get("accept", "application/json")
-            if accept == "application/json":
-                return [file.name for file in svc.list_files(path=path)]
-            elif accept == "application/octet-stream":
-                if svc.isfile(path):  # check for regular file
-                    return send_file(path, as_attachment=True)
+            if accept in ("application/json", "application/x-ndjson"):
+                args = request.args
+                stat = args.get("stat", "false").lower() == "true"
+                page_args = {key: args[key] for key in PAGING_ARGS if key in args}
+                etag = svc.version(
+                    path, accept, stat, *sorted(page_args.items()), children=stat
+                )
+                if request.if_none_match.contains(etag):
+                    return Response(status=304, headers={"ETag": f'"{etag}"'})
+                cursor = None
+                if page_args:
+                    if "limit" in page_args and not page_args["limit"].isdigit():
+                        raise ValueError("limit must be positive")
+                    files, cursor = svc.page_files(
+                        path=path,
+                        limit=int(page_args["limit"]) if "limit" in page_args else None,
+                        cursor=page_args.get("cursor"),
+                        sort_by=page_args.get("sortBy", "name"),
+                        order=page_args.get("order", "asc"),
+                        stat=stat,
+                    )
                 else:
-                    tarfile = svc.create_attachment(paths=(path,))
-                    return send_file(
-                        tarfile,
-                        as_attachment=True,
-                        mimetype="application/gzip",
-                        download_name=f"{os.path.basename(path)}.tar.gz",
+                    files = svc.iter_files(path=path, stat=stat)
+                if stat:
+                    items = (
+                        {
+                            "name": file.name,
+                            "size": file.stat(follow_symlinks=False).st_size,
+                            "mtime": file.stat(follow_symlinks=False).st_mtime,
+                            "isDir": file.is_dir(),
+                        }
+                        for file in files
                     )
+                else:
+                    items = (file.name for file in files)
+                response = utils.stream_json(items, mimetype=accept)
+                response.set_etag(etag)
+                if cursor is not None:
+                    query = urlencode({**args.to_dict(), "cursor": cursor})
+                    response.headers[
+                        "Link"
+                    ] = f'<{request.base_url}?{query}>; rel="next"'
+                return response
+            formats = archive.accepted_formats(request.accept_mimetypes)
+            if accept == "application/octet-stream" or formats:
+                if not formats and svc.isfile(path):  # check for regular file
+                    return send_file(path, as_attachment=True)
+                fmt = svc.archive_format(
+                    paths=(path,),
+                    formats=formats,
+                    policy=current_app.config["ARCHIVE_FORMAT"],
+                )
+                filename = f"{os.path.basename(path)}.{fmt}"
+                return send_archive(svc, paths=(path,), download_name=filename, fmt=fmt)
             raise HTTPException("unsupported 'accept' HTTP header")
 
         except PermissionError as ex:
             utils.abort_with(code=403, message=str(ex))
         except FileNotFoundError as ex:
             utils.abort_with(code=404, message=str(ex))
-        except HTTPException as ex:
+        except paging.StaleCursorError as ex:
+            utils.abort_with(code=409, message=str(ex))
+        except (HTTPException, ValueError) as ex:
             utils.abort_with(code=400, message=str(ex))
 
     @requires_auth(schemes=["basic"])
+    @impersonate_request
     def post(self, path):
         """
-        Create files in given path.
+        Create files in given path. A tar archive, optionally compressed, is
+        extracted into the path as it is uploaded.
         ---
         tags:
             - filesystem
@@ -106,6 +266,18 @@ class Filesystem(Resource):
                                 items:
                                     type: file
                                     description: file to create
+                application/x-tar:
+                    schema:
+                        type: string
+                        format: binary
+                application/gzip:
+                    schema:
+                        type: string
+                        format: binary
+                application/zstd:
+                    schema:
+                        type: string
+                        format: binary
         responses:
             201:
                 content:
@@ -123,16 +295,21 @@ class Filesystem(Resource):
         path = utils.normpath(path)
         username = current_username
         svc = FilesystemSvc(username=username)
+        if request.mimetype in ARCHIVE_UPLOADS:
+            try:
+                svc.extract_archive(
+                    path, fileobj=request.stream, fmt=ARCHIVE_UPLOADS[request.mimetype]
+                )
+                return utils.http_response(201), 201
+            except PermissionError as ex:
+                utils.abort_with(code=403, message=str(ex))
+            except (OSError, ValueError) as ex:
+                utils.abort_with(code=400, message=str(ex))
         files = request.files.to_dict(flat=False).get("files", [])
         if not files:
             utils.abort_with(code=400, message="missing files")
         try:
-            if any(
-                svc.exists_path(os.path.join(path, file.filename)) for file in files
-            ):
-                raise FileExistsError("a file already exists in given path")
-            for file in files:
-                svc.save_file(path, file=file)
+            svc.save_files(path, files=files)
             return utils.http_response(201), 201
         except PermissionError as ex:
             utils.abort_with(code=403, message=str(ex))
@@ -140,6 +317,7 @@ class Filesystem(Resource):
             utils.abort_with(code=400, message=str(ex))
 
     @requires_auth(schemes=["basic"])
+    @impersonate_request
     def put(self, path):
         """
         Update files in given path.
@@ -188,12 +366,7 @@ class Filesystem(Resource):
         if not files:
             utils.abort_with(code=400, message="missing files")
         try:
-            if not all(
-                svc.exists_path(os.path.join(path, file.filename)) for file in files
-            ):
-                raise FileNotFoundError("a file does not exist in given path")
-            for file in files:
-                svc.save_file(path, file=file)
+            svc.save_files(path, files=files, overwrite=True)
             return utils.http_response(204), 204
         except PermissionError as ex:
             utils.abort_with(code=403, message=str(ex))
@@ -201,6 +374,7 @@ class Filesystem(Resource):
             utils.abort_with(code=400, message=str(ex))
 
     @requires_auth(schemes=["basic"])
+    @impersonate_request
     def delete(self, path):
         """
         Delete file in given path.
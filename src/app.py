@@ -1,3 +1,4 @@
+import click
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_plugins.webframeworks.flask import FlaskPlugin
@@ -9,6 +10,16 @@ from werkzeug.exceptions import HTTPException
 from src import __meta__, __version__, utils
 from src.api.filemgr import blueprint as fm
 from src.api.filesystem import blueprint as fs
+from src.services import (
+    archive,
+    auth,
+    dircache,
+    fileindex,
+    filemgr,
+    filesystem,
+    jobs,
+    workers,
+)
 from src.settings import oas
 from src.settings.env import config_class, load_dotenv
 
@@ -42,6 +53,16 @@ def setup_app(app):
     index.register_blueprint(fm)
     app.register_blueprint(index, url_prefix=url_prefix)
 
+    # service wide settings
+    filesystem.configure(app)
+    filemgr.configure(app)
+    archive.configure(app)
+    fileindex.configure(app)
+    dircache.configure(app)
+    auth.configure(app)
+    workers.configure(app)
+    jobs.configure(app)
+
     # base template for OpenAPI specs
     oas.converter = oas.create_spec_converter(openapi_version)
 
@@ -69,6 +90,9 @@ def setup_app(app):
             utils.http_response(code=401, serialize=False),
             utils.http_response(code=403, serialize=False),
             utils.http_response(code=404, serialize=False),
+            utils.http_response(code=409, serialize=False),
+            utils.http_response(code=429, serialize=False),
+            utils.http_response(code=501, serialize=False),
         ],
     )
 
@@ -95,3 +119,13 @@ def setup_app(app):
         HTTPException,
         lambda ex: (utils.http_response(ex.code, exclude=("message",)), ex.code),
     )
+
+    # keep the index of files up to date, in a process of its own
+    @app.cli.command("index")
+    def index_files():
+        """Index the files under the configured roots, forever."""
+        if not app.config["INDEX_DATABASE"] or not app.config["INDEX_ROOTS"]:
+            raise click.UsageError("INDEX_DATABASE and INDEX_ROOTS must be set")
+        fileindex.FileIndex(app.config["INDEX_DATABASE"]).run(
+            app.config["INDEX_ROOTS"], rescan=app.config["INDEX_RESCAN"]
+        )
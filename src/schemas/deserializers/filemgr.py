@@ -1,7 +1,7 @@
 import json
 
 from marshmallow import EXCLUDE, fields, pre_load, Schema
-from marshmallow.validate import OneOf
+from marshmallow.validate import Length, OneOf, Range
 
 from src.schemas.serializers.filemgr import StatsSchema
 
@@ -20,6 +20,15 @@ class BaseActionSchema(Schema):
 
 class ReadActionSchema(BaseActionSchema):
     showHiddenItems = fields.Boolean()
+    version = fields.String()  # of a listing the client already has
+
+    # pagination
+    limit = fields.Integer(validate=Range(min=1))
+    cursor = fields.String()
+    sortBy = fields.String(
+        validate=OneOf(("name", "size", "dateModified", "dateCreated", "type"))
+    )
+    order = fields.String(validate=OneOf(("asc", "desc")))
 
 
 class CreateActionSchema(BaseActionSchema):
@@ -39,6 +48,8 @@ class SearchActionSchema(BaseActionSchema):
     showHiddenItems = fields.Boolean()
     caseSensitive = fields.Boolean()
     searchString = fields.String()
+    maxDepth = fields.Integer(validate=Range(min=1))
+    maxResults = fields.Integer(validate=Range(min=1))
 
 
 class DetailsActionSchema(BaseActionSchema):
@@ -59,15 +70,46 @@ class MoveActionSchema(BaseActionSchema):
     targetData = fields.Nested(StatsSchema(unknown=EXCLUDE), allow_none=True)
 
 
+class JobSchema(Schema):
+    action = fields.String(
+        validate=OneOf(("copy", "move", "delete", "archive")),
+        allow_none=False,
+        required=True,
+    )
+    path = fields.String(required=True)
+    names = fields.List(fields.String(), required=True)
+    targetPath = fields.String()
+
+
+class BulkStatsSchema(Schema):
+    paths = fields.List(
+        fields.String(), required=True, validate=Length(min=1, max=10_000)
+    )
+
+
+class BatchSchema(Schema):
+    actions = fields.List(
+        fields.Dict(), required=True, validate=Length(min=1, max=1000)
+    )
+    mode = fields.String(validate=OneOf(("stop", "continue")))
+
+
 class UploadSchema(Schema):
     action = fields.String(
-        validate=OneOf(("save", "remove")),
+        validate=OneOf(("save", "remove", "status")),
         allow_none=False,
         required=True,
     )
     path = fields.String()
     cancel_uploading = fields.String(data_key="cancel-uploading")
 
+    # chunked uploads
+    chunk_index = fields.Integer(data_key="chunk-index", validate=Range(min=0))
+    total_chunk = fields.Integer(data_key="total-chunk", validate=Range(min=1))
+    chunk_size = fields.Integer(data_key="chunk-size", validate=Range(min=1))
+    upload_id = fields.String(data_key="upload-id")
+    filename = fields.String()
+
 
 class DownloadSchema(Schema):
     class DownloadInputSchema(BaseActionSchema):
@@ -81,6 +123,7 @@ class DownloadSchema(Schema):
         names = fields.List(fields.String())
 
     downloadInput = fields.Nested(DownloadInputSchema())
+    format = fields.String(validate=OneOf(("tar.gz", "tar.zst", "tar", "zip")))
 
     @pre_load
     def parser(self, data, **_):
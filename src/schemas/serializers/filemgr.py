@@ -23,6 +23,7 @@ class DetailsSchema(Schema):
     isFile = fields.Boolean()
     size = fields.String()
     multipleFiles = fields.Boolean()
+    computing = fields.Boolean()  # whether the size is still partial
 
 
 class BaseResponseSchema(Schema):
@@ -31,7 +32,9 @@ class BaseResponseSchema(Schema):
 
 
 class StatsResponseSchema(BaseResponseSchema):
-    pass
+    version = fields.String()
+    notModified = fields.Boolean()
+    cursor = fields.String(allow_none=True)  # of the next page, if any
 
 
 class ErrorResponseSchema(BaseResponseSchema):
@@ -45,6 +48,38 @@ class DetailsResponseSchema(BaseResponseSchema):
     details = fields.Nested(DetailsSchema())
 
 
+class BulkStatsResponseSchema(Schema):
+    class ResultSchema(Schema):
+        path = fields.String()
+        stats = fields.Nested(StatsSchema())
+        error = fields.Nested(HttpResponseSchema())
+
+    results = fields.List(fields.Nested(ResultSchema()))
+
+
+class BatchResponseSchema(Schema):
+    results = fields.List(fields.Dict())
+
+
+class UploadResponseSchema(HttpResponseSchema):
+    offset = fields.Integer()
+
+
+class JobSchema(Schema):
+    id = fields.String()
+    action = fields.String()
+    status = fields.String()
+    filesDone = fields.Integer(attribute="files")
+    bytesDone = fields.Integer(attribute="bytes")
+    error = fields.String(allow_none=True)
+    created = fields.DateTime()
+
+
+class MetricsSchema(Schema):
+    uploads = fields.Dict()
+    caches = fields.Dict(keys=fields.String(), values=fields.Dict())
+
+
 def dump_stats(**kwargs):
     return StatsResponseSchema().dump(kwargs)
 
@@ -55,3 +90,23 @@ def dump_error(**kwargs):
 
 def dump_details(**kwargs):
     return DetailsResponseSchema().dump({**{"details": kwargs}, **kwargs})
+
+
+def dump_bulk_stats(**kwargs):
+    return BulkStatsResponseSchema().dump(kwargs)
+
+
+def dump_batch(**kwargs):
+    return BatchResponseSchema().dump(kwargs)
+
+
+def dump_upload(**kwargs):
+    return UploadResponseSchema().dump(kwargs)
+
+
+def dump_job(job):
+    return JobSchema().dump(job)
+
+
+def dump_metrics(**kwargs):
+    return MetricsSchema().dump(kwargs)
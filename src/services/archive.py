@@ -0,0 +1,483 @@
+import contextlib
+import hashlib
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from src.services.auth import user_ctx
+from src.utils import threads
+from src.utils.pgzip import ParallelGzipWriter
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# errors of archives that cannot be read, e.g. cut short
+READ_ERRORS = (tarfile.TarError, EOFError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+__all__ = (
+    "FORMATS",
+    "ArchiveCache",
+    "accepted_formats",
+    "choose_format",
+    "chunks",
+    "extract",
+    "fingerprint",
+)
+
+# archive formats and their media types
+FORMATS = {
+    "tar.gz": "application/gzip",
+    "tar.zst": "application/zstd",
+    "tar": "application/x-tar",
+    "zip": "application/zip",
+}
+
+# extensions of files not worth compressing again
+COMPRESSED_EXTENSIONS = frozenset(
+    ".7z .avi .bz2 .docx .flac .gif .gz .jpeg .jpg .mkv .mov .mp3 .mp4 .ogg .png "
+    ".pptx .rar .tgz .webm .webp .xlsx .xz .zip .zst".split()
+)
+
+# members extracted in memory and written by the pool, larger ones as they come
+SMALL_MEMBER = 1024 * 1024
+
+# share of bytes already compressed above which compressing is not worth it
+COMPRESSED_SHARE = 0.8
+
+# entries looked at to estimate the content of an archive
+SAMPLE_SIZE = 1000
+
+
+class ChunkBuffer:
+    """Write-only file object whose content is consumed in chunks."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    @property
+    def size(self):
+        return len(self.buffer)
+
+    def tell(self):
+        return self.offset
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != "tar.zst" or zstandard is not None]
+
+
+def accepted_formats(accept):
+    """Formats named by an 'Accept' header, in order of preference."""
+    formats = {mimetype: fmt for fmt, mimetype in FORMATS.items()}
+    return [formats[value] for value, _ in accept if value in formats]
+
+
+def choose_format(paths, formats=(), policy="tar.gz"):
+    """Pick the archive format of given paths: the one the client prefers or,
+    when it leaves it to the server, the one of the policy.
+
+    The 'auto' policy rather picks among the formats the client takes (or any
+    when none), skipping compression when most of the content is compressed
+    already and otherwise preferring the format that is cheapest to compress.
+    """
+    available = available_formats()
+    formats = [fmt for fmt in formats if fmt in available]
+    if len(formats) == 1:
+        return formats[0]
+    if policy != "auto":
+        return formats[0] if formats else policy
+    candidates = formats or available
+
+    if compressed_share(paths) >= COMPRESSED_SHARE:
+        preferences = ("zip", "tar", "tar.zst", "tar.gz")
+    else:
+        preferences = ("tar.zst", "tar.gz", "zip", "tar")
+    return next(fmt for fmt in preferences if fmt in candidates)
+
+
+def compressed_share(paths):
+    """Estimate the share of bytes of files in compressed formats, from the
+    first entries found under given paths."""
+    total = compressed = 0
+    stack = list(paths)
+    seen = 0
+    while stack and seen < SAMPLE_SIZE:
+        path = stack.pop()
+        seen += 1
+        try:
+            st = os.lstat(path)
+            if stat.S_ISDIR(st.st_mode):
+                with os.scandir(path) as it:
+                    stack.extend(entry.path for entry in it)
+                continue
+        except OSError:
+            continue
+        total += st.st_size
+        if is_compressed(path):
+            compressed += st.st_size
+    return compressed / total if total else 0.0
+
+
+class TarArchive:
+    """Tar archive, optionally compressed with gzip or zstd."""
+
+    def __init__(self, fileobj, compression=None, level=6, threads=None):
+        self.level = level
+        self.compressor = None
+        if compression == "gz":
+            fileobj = self.compressor = ParallelGzipWriter(
+                fileobj, level=level, threads=threads
+            )
+        elif compression == "zst":
+            if zstandard is None:
+                raise ValueError("zstd compression is not available")
+            fileobj = self.compressor = zstandard.ZstdCompressor(
+                threads=threads or -1
+            ).stream_writer(fileobj, closefd=False)
+        self.tar = tarfile.open(fileobj=fileobj, mode="w")
+
+    def add(self, path, arcname, bufsize):
+        """Add a path to the archive, one read of bufsize at a time."""
+        tar = self.tar
+        tarinfo = tar.gettarinfo(path, arcname=arcname)
+        if tarinfo is None:
+            return  # sockets and alike cannot be archived
+        if not tarinfo.isreg():
+            tar.addfile(tarinfo)
+        else:
+            # same as 'TarFile.addfile' but without copying the whole file at once
+            buf = tarinfo.tobuf(tar.format, tar.encoding, tar.errors)
+            tar.fileobj.write(buf)
+            tar.offset += len(buf)
+            if is_compressed(path):
+                self.set_level(0)  # store what is compressed already
+            remaining = tarinfo.size
+            with open(path, "rb") as file:
+                while remaining > 0:
+                    chunk = file.read(min(bufsize, remaining))
+                    if not chunk:
+                        raise OSError("unexpected end of data")
+                    tar.fileobj.write(chunk)
+                    remaining -= len(chunk)
+                    yield
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            tar.offset += blocks * tarfile.BLOCKSIZE
+            tar.members.append(tarinfo)
+            self.set_level(self.level)
+        yield
+        if tarinfo.isdir():
+            for name in sorted(os.listdir(path)):
+                yield from self.add(
+                    path=os.path.join(path, name),
+                    arcname=os.path.join(arcname, name),
+                    bufsize=bufsize,
+                )
+
+    def set_level(self, level):
+        if isinstance(self.compressor, ParallelGzipWriter):
+            self.compressor.set_level(level)
+
+    def close(self):
+        self.tar.close()
+        if self.compressor is not None:
+            self.compressor.close()
+
+
+class ZipArchive:
+    """Zip archive written as a stream, deflating only what is not compressed
+    already."""
+
+    def __init__(self, fileobj, level=6):
+        self.level = level
+        self.zip = zipfile.ZipFile(fileobj, mode="w", allowZip64=True)
+
+    def add(self, path, arcname, bufsize):
+        """Add a path to the archive, one read of bufsize at a time."""
+        try:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname=arcname)
+        except FileNotFoundError:
+            if os.path.islink(path):
+                return  # dangling symbolic link
+            raise
+        if zinfo.is_dir():
+            self.zip.writestr(zinfo, b"")
+        elif stat.S_ISREG(zinfo.external_attr >> 16):
+            if is_compressed(path):
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                zinfo._compresslevel = self.level
+            with open(path, "rb") as src, self.zip.open(zinfo, mode="w") as dst:
+                while True:
+                    chunk = src.read(bufsize)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield
+        else:
+            return  # sockets and alike cannot be archived
+        yield
+        if zinfo.is_dir() and not os.path.islink(path):
+            for name in sorted(os.listdir(path)):
+                yield from self.add(
+                    path=os.path.join(path, name),
+                    arcname=os.path.join(arcname, name),
+                    bufsize=bufsize,
+                )
+
+    def close(self):
+        self.zip.close()
+
+
+def open_archive(fileobj, fmt, level=6, threads=None):
+    if fmt == "zip":
+        return ZipArchive(fileobj, level=level)
+    elif fmt in ("tar", "tar.gz", "tar.zst"):
+        compression = fmt.partition(".")[2] or None
+        return TarArchive(
+            fileobj, compression=compression, level=level, threads=threads
+        )
+    raise ValueError(f"unsupported archive format '{fmt}'")
+
+
+def chunks(paths, fmt="tar.gz", bufsize=1024 * 1024, level=6, threads=None):
+    """Archive given paths as a stream of chunks of about bufsize."""
+    buffer = ChunkBuffer()
+    archive = open_archive(buffer, fmt, level=level, threads=threads)
+    for path in paths:
+        arcname = os.path.basename(path)  # keep path relative
+        for _ in archive.add(path, arcname, bufsize):
+            if buffer.size >= bufsize:
+                yield buffer.drain()
+    archive.close()
+    yield buffer.drain()
+
+
+def open_tar_stream(fileobj, fmt):
+    """Open a tar archive to be read once, from start to end."""
+    if fmt == "tar.zst":
+        if zstandard is None:
+            raise ValueError("zstd compression is not available")
+        fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        return tarfile.open(fileobj=fileobj, mode="r|")
+    elif fmt in ("tar", "tar.gz"):
+        return tarfile.open(fileobj=fileobj, mode="r|*")
+    raise ValueError(f"unsupported archive format '{fmt}'")
+
+
+def member_path(dst, name):
+    """Where a member of an archive goes under dst, refusing names that would
+    go anywhere else (absolute, or up from dst)."""
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if name.startswith("/") or ".." in parts or not parts:
+        raise ValueError(f"unsafe path in archive: {name}")
+    return os.path.join(dst, *parts)
+
+
+def extract(fileobj, dst, write, fmt="tar", workers=4, context=contextlib.nullcontext):
+    """Extract a tar archive read from a stream into dst, as it is read.
+
+    Files are written with the write function, given their path and a file
+    object of their content: small files are read in memory and written by a
+    pool of threads (by the calling thread without workers), each write within
+    a new context from the given factory (see 'fastcopy.copytree'), and larger
+    files are written as they are read. At most two small files per thread are
+    held at once. Directories are
+    created as needed, but no member may end up outside dst, including
+    through symbolic links already in dst. Links and special files are
+    skipped, and permissions and owners are not kept. Extraction stops at the
+    first error, keeping what was extracted so far. Return the number of
+    files written.
+    """
+    root = os.path.realpath(dst)
+    made = {root}  # directories known to be under dst
+    errors = []
+    slots = threading.BoundedSemaphore(2 * max(workers, 1))
+
+    def makedirs(path):
+        if path in made:
+            return
+        makedirs(os.path.dirname(path))
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(path)
+        real = os.path.realpath(path)
+        if real != root and not real.startswith(os.path.join(root, "")):
+            raise ValueError(f"unsafe path in archive: {path}")
+        made.add(path)
+
+    def write_member(path, data):
+        try:
+            with context():
+                write(path, io.BytesIO(data))
+        except Exception as ex:  # raised by the reading thread
+            errors.append(ex)
+        finally:
+            slots.release()
+
+    count = 0
+    executor = threads.executor(workers)
+    try:
+        with open_tar_stream(fileobj, fmt) as tar:
+            while not errors and (member := tar.next()) is not None:
+                tar.members.clear()  # members are not looked up again
+                path = member_path(root, member.name)
+                if member.isdir():
+                    makedirs(path)
+                    continue
+                if not member.isreg():
+                    continue
+                makedirs(os.path.dirname(path))
+                if member.size > SMALL_MEMBER:
+                    write(path, tar.extractfile(member))
+                else:
+                    data = tar.extractfile(member).read()
+                    slots.acquire()
+                    executor.submit(write_member, path, data)
+                count += 1
+    except READ_ERRORS as ex:
+        raise ValueError(f"invalid archive: {ex}") from None
+    finally:
+        executor.shutdown(wait=True)
+    if errors:
+        raise errors[0]
+    return count
+
+
+def fingerprint(paths, *extra):
+    """Digest of the names, sizes, times, inodes and modes of every entry
+    under given paths, which changes with any change of their content."""
+    digest = hashlib.sha256(repr(extra).encode())
+    for top in paths:
+        stack = [(top, os.path.basename(top))]
+        while stack:
+            path, arcname = stack.pop()
+            st = os.lstat(path)
+            digest.update(
+                f"{arcname}\0{st.st_ino}\0{st.st_size}\0{st.st_mtime_ns}\0"
+                f"{st.st_mode}\n".encode(errors="surrogateescape")
+            )
+            if stat.S_ISDIR(st.st_mode):
+                for name in sorted(os.listdir(path), reverse=True):
+                    stack.append((os.path.join(path, name), f"{arcname}/{name}"))
+    return digest.hexdigest()
+
+
+class ArchiveCache:
+    """On-disk cache of archives keyed by the fingerprint of their content.
+
+    Archives are cached as they are streamed to a client for the first time,
+    and the least recently used ones are evicted once the cache is over
+    ``maxsize`` bytes. Archives belong to the service, never to users, so the
+    directory may be shared by several workers but not by users.
+    """
+
+    def __init__(self, directory, maxsize=10 * 1024**3):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        with user_ctx(None):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key):
+        """Path of a cached archive, or None when not cached."""
+        with user_ctx(None):
+            try:
+                os.utime(self.path(key))  # mark as recently used
+            except FileNotFoundError:
+                return None
+        return self.path(key)
+
+    def tee(self, key, chunks):
+        """Cache the archive given in chunks while passing them through. An
+        archive not streamed to its end is not cached."""
+        with user_ctx(None):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            with open(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+            with user_ctx(None):
+                os.replace(tmp, self.path(key))
+        except BaseException:
+            with user_ctx(None):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def store(self, key, data):
+        """Cache an archive given in full."""
+        for _ in self.tee(key, (data,)):
+            pass
+
+    def evict(self):
+        """Remove the least recently used archives beyond the size limit, and
+        the leftovers of archives that were never completed."""
+        now = time.time()
+        with self.lock, user_ctx(None):
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # removed by another worker
+                    if entry.name.startswith("."):
+                        if now - st.st_mtime > 24 * 3600:
+                            with contextlib.suppress(FileNotFoundError):
+                                os.remove(entry.path)
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.maxsize:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+
+
+def configure(app):
+    """Enable the cache of archives, if the app says so."""
+    global cache
+    if app.config["ARCHIVE_CACHE_DIR"]:
+        cache = ArchiveCache(
+            app.config["ARCHIVE_CACHE_DIR"], maxsize=app.config["ARCHIVE_CACHE_SIZE"]
+        )
+
+
+# the cache of archives, when enabled (see 'ArchiveCache')
+cache = None
@@ -1,10 +1,24 @@
+import ctypes
+import ctypes.util
+import errno
 import os
 import functools
+import importlib
 import inspect
+import platform
+import threading
 
 from src import utils
+from src.utils.cache import TTLCache
 
-__all__ = ("AuthSvc", "impersonate")
+__all__ = (
+    "AuthSvc",
+    "configure",
+    "impersonate",
+    "max_threads",
+    "thread_ctx",
+    "user_ctx",
+)
 
 
 class AuthSvc:
@@ -13,45 +27,253 @@ class AuthSvc:
         return True
 
 
-def impersonate(username=None):
-    """Run a routing under user privileges."""
+class ProcessCredentials:
+    """Impersonate with the effective ids of the whole process.
 
-    def wrapper(func):
-        class user_ctx:
-            def __init__(self, usrname):
-                self.username = usrname
-                self.uid = os.getuid()
-                self.gid = os.getuid()
-                self.ctx_uid = self.uid
-                self.ctx_gid = self.gid
-
-            def __enter__(self):
-                try:
-                    self.ctx_uid = utils.user_uid(self.username)
-                    self.ctx_gid = utils.user_gid(self.username)
-                    os.setuid(self.ctx_uid)
-                    os.setgid(self.ctx_gid)
-                except (KeyError, TypeError):
-                    pass  # suppress missing username
-                except PermissionError:
-                    pass  # suppress missing privileges
-
-            def __exit__(self, exc_type, exc_value, exc_traceback):
-                if self.uid != self.ctx_uid or self.gid != self.ctx_gid:
-                    os.setuid(self.uid)
-                    os.setgid(self.gid)
+    Only one user can be impersonated at a time, so workers must serve a
+    single request at a time (e.g. gunicorn sync workers), and a request must
+    not impersonate from threads of its own (see 'max_threads').
+    """
 
-        @functools.wraps(func)
-        def decorated(*args, **kwargs):
+    per_thread = False
+
+    def restore(self):
+        if os.geteuid() != os.getuid():
+            os.seteuid(os.getuid())
+        if os.getegid() != os.getgid():
+            os.setegid(os.getgid())
+
+    def assume(self, username):
+        uid = utils.user_uid(username)
+        gid = utils.user_gid(username)
+        os.setegid(gid)
+        os.seteuid(uid)
+
+
+class ThreadCredentials:
+    """Impersonate with the filesystem ids of the calling thread (Linux only).
+
+    The kernel checks file access against the filesystem ids, which, unlike
+    the effective ids, are set per thread. Threaded workers can then serve
+    several users at once. Supplementary groups are set with the raw system
+    call, as the libc wrapper applies them to every thread of the process.
+    """
+
+    per_thread = True
+
+    SYS_setgroups = {"x86_64": 116, "aarch64": 159, "ppc64le": 81, "s390x": 206}
+
+    def __init__(self):
+        machine = platform.machine()
+        if machine not in self.SYS_setgroups:
+            raise OSError(errno.ENOSYS, f"no setgroups system call known for {machine}")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.setgroups_nr = self.SYS_setgroups[machine]
+        self.groups = os.getgroups()
+
+    def restore(self):
+        self.set_ids(os.getuid(), os.getgid(), self.groups)
+
+    def assume(self, username):
+        uid = utils.user_uid(username)
+        gid = utils.user_gid(username)
+        self.set_ids(uid, gid, utils.user_groups(username))
+
+    def set_ids(self, uid, gid, groups):
+        array = (ctypes.c_uint * len(groups))(*groups)
+        if self.libc.syscall(self.setgroups_nr, len(groups), array) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.libc.setfsgid(gid)
+        self.libc.setfsuid(uid)
+        # both calls return the previous id and cannot fail otherwise
+        if self.libc.setfsgid(-1) != gid or self.libc.setfsuid(-1) != uid:
+            raise PermissionError("cannot set filesystem ids")
+
+
+class FixedCredentials:
+    """The credentials of a process that runs as a user for good (see
+    'workers.serve'). There is nothing to switch, so any thread may run as
+    the user, and as that user only."""
+
+    per_thread = True
+
+    def __init__(self, username):
+        self.username = username
+
+    def restore(self):
+        pass
+
+    def assume(self, username):
+        if username != self.username:
+            raise PermissionError(f"cannot run as {username}")
+
+
+# the impersonation backends, one of which is in use
+backends = {"process": ProcessCredentials, "thread": ThreadCredentials}
+backend = ProcessCredentials()
+
+# the user currently impersonated by each thread
+_local = threading.local()
+
+# optional pool of helper processes running as users (see 'UserPool')
+pool = None
+
+
+def switch_user(username=None):
+    """Take up the identity of given user, or the original one when missing.
+
+    Failures are raised, as going on would run with the wrong identity: an
+    unknown user raises 'KeyError' and missing privileges 'PermissionError'.
+    """
+    # regain privileges before taking up another identity
+    backend.restore()
+    if username is not None:
+        backend.assume(username)
+
+
+def max_threads(workers):
+    """How many threads may run as users while their caller is not waiting
+    for them, e.g. for a generator resumed step by step, given the wanted
+    workers.
+
+    With the process backend, the credentials of such threads change as the
+    caller switches them in between steps, so none may: work is to run in
+    the calling thread instead (see 'threads.executor').
+    """
+    return workers if backend.per_thread else 0
+
+
+class thread_ctx:
+    """Run a thread doing the work of a caller that impersonates given user,
+    and waits for the thread to be done, as that user (see 'user_ctx').
+
+    With credentials per thread, the thread takes them up. Otherwise those of
+    the process already are the user's, held by the caller, and the thread
+    only records them: switching them would switch them for every thread.
+    """
+
+    def __init__(self, username):
+        self.username = username
+        self.context = user_ctx(username) if backend.per_thread else None
+        self.previous = None
+
+    def __enter__(self):
+        if self.context is not None:
+            self.context.__enter__()
+        else:
+            self.previous = getattr(_local, "username", None)
+            _local.username = self.username
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.context is not None:
+            self.context.__exit__(exc_type, exc_value, exc_traceback)
+        else:
+            _local.username = self.previous
+
+
+class user_ctx:
+    """Run under user privileges for the duration of the context.
+
+    The context is reentrant: entering it for the user that is already being
+    impersonated costs neither lookups nor system calls, which allows a whole
+    request to run under a single switch of credentials.
+    """
+
+    def __init__(self, username):
+        self.username = username
+        self.previous = None
+        self.switched = False
+
+    def __enter__(self):
+        self.previous = getattr(_local, "username", None)
+        self.switched = self.username != self.previous
+        if self.switched:
+            try:
+                switch_user(self.username)
+            except BaseException:
+                switch_user(self.previous)
+                raise
+            _local.username = self.username
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self.switched:
+            _local.username = self.previous
+            switch_user(self.previous)
+
+
+def call_routine(module, qualname, *args, **kwargs):
+    """Call a routine by its module and qualified name, as the routines sent
+    to helper processes are: decorators may hide them from pickle, and
+    methods must not dispatch to overrides of subclasses."""
+    routine = importlib.import_module(module)
+    for name in qualname.split("."):
+        routine = getattr(routine, name)
+    return routine(*args, **kwargs)
+
+
+def impersonate(username=None, remote=False):
+    """Run a routing under user privileges.
+
+    Routines marked as remote, whose arguments and results can be pickled,
+    run in a helper process of the user when a pool of them is configured.
+    They are sent by name (see 'call_routine').
+    """
+
+    def wrapper(func):
+        def resolve_username(args):
             self = next(iter(args), None)
-            name = (
+            return (
                 getattr(self, "username", None)
-                if not username and inspect.isclass(self)
+                if not username and not inspect.isclass(self)
                 else username
             )
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def decorated(*args, **kwargs):
+                # generators run lazily, so each step is impersonated on its own
+                name = resolve_username(args)
+                gen = func(*args, **kwargs)
+                try:
+                    while True:
+                        with user_ctx(name):
+                            try:
+                                item = next(gen)
+                            except StopIteration:
+                                return
+                        yield item
+                finally:
+                    with user_ctx(name):
+                        gen.close()
+
+            return decorated
+
+        @functools.wraps(func)
+        def decorated(*args, **kwargs):
+            name = resolve_username(args)
+            if remote and pool is not None and name is not None:
+                routine = (func.__module__, func.__qualname__)
+                return pool.call(name, call_routine, (*routine, *args), kwargs)
             with user_ctx(name):
                 return func(*args, **kwargs)
 
         return decorated
 
     return wrapper
+
+
+def configure(app):
+    """Choose the impersonation backend, and size the cache of users."""
+    global backend
+    backend = backends[app.config["IMPERSONATION_BACKEND"]]()
+    utils.nss_cache = TTLCache(
+        maxsize=app.config["NSS_CACHE_SIZE"],
+        ttl=app.config["NSS_CACHE_TTL"],
+        negative_ttl=app.config["NSS_CACHE_NEGATIVE_TTL"],
+        negative=(KeyError,),
+    )
+    utils.warm_nss_cache(app.config["NSS_CACHE_WARM"])
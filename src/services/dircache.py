@@ -0,0 +1,239 @@
+import collections
+import itertools
+import os
+import threading
+import time
+
+from src.utils import inotify
+
+__all__ = ("DirectoryCache", "configure", "invalidate")
+
+# filesystems whose changes made by other hosts are not notified
+REMOTE_FILESYSTEMS = frozenset(
+    "nfs nfs4 cifs smb3 smbfs ceph glusterfs lustre gpfs beegfs afs 9p "
+    "fuse.sshfs fuse.s3fs fuse.gcsfuse".split()
+)
+
+
+def remote_mounts(mounts="/proc/self/mounts"):
+    """Mount points of remote filesystems."""
+    try:
+        with open(mounts) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return []
+    points = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 2 and fields[2] in REMOTE_FILESYSTEMS:
+            # spaces and alike are escaped in octal
+            points.append(fields[1].encode().decode("unicode_escape"))
+    return points
+
+
+class DirectoryCache:
+    """Cache of directory listings, bounded by the number of entries listed.
+
+    Listings are dropped as soon as inotify reports a change in their
+    directory. Inotify does not report changes made by other hosts on network
+    filesystems, whose listings rather expire after ``fallback_ttl`` seconds.
+    Every listing also expires after ``ttl`` seconds, since changes deeper in
+    the tree (which affect e.g. 'hasChild') are not reported either.
+    """
+
+    def __init__(self, max_entries=100_000, ttl=60, fallback_ttl=5, watch=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.listings = collections.OrderedDict()  # key -> (expires, path, value)
+        self.keys = collections.defaultdict(set)  # path -> keys
+        self.size = 0  # entries of every listing
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+        self.remote = remote_mounts()
+        self.watches = {}  # path -> watch descriptor
+        self.paths = {}  # watch descriptor -> path
+        self.generations = {}  # path -> time of the last change, in ticks
+        self.clock = itertools.count(1)
+        self.epoch = 0  # count of changes of every directory at once
+        self.inotify = None
+        if watch:
+            try:
+                self.inotify = inotify.Inotify()
+            except OSError:
+                pass  # fall back to expiration only
+            else:
+                thread = threading.Thread(target=self.listen, daemon=True)
+                thread.start()
+
+    def get(self, key):
+        """Get a cached listing, or None."""
+        with self.lock:
+            entry = self.listings.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                self.listings.move_to_end(key)
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Get a cached listing, or None, leaving the metrics and the order
+        of eviction as they are."""
+        with self.lock:
+            entry = self.listings.get(key)
+            return entry[2] if entry and entry[0] > time.monotonic() else None
+
+    def get_or_set(self, key, path, func):
+        """Get the cached listing of a directory, or list it with func()."""
+        value = self.get(key)
+        if value is None:
+            path = os.path.normpath(path)
+            watched = self.watch(path)  # before listing, not to miss changes
+            with self.lock:
+                generation = (self.epoch, self.generations.get(path, 0))
+            try:
+                value = func()
+            except BaseException:
+                with self.lock:
+                    if not self.keys.get(path):
+                        self.unwatch(path)
+                raise
+            self.set(key, path, value, watched=watched, generation=generation)
+        return value
+
+    def set(self, key, path, value, watched=False, generation=None):
+        ttl = self.ttl if watched else min(self.ttl, self.fallback_ttl)
+        with self.lock:
+            if generation and generation != (
+                self.epoch,
+                self.generations.get(path, 0),
+            ):
+                if not self.keys.get(path):
+                    self.unwatch(path)
+                return  # changed while being listed
+            self.discard(key)
+            self.listings[key] = (time.monotonic() + ttl, path, value)
+            self.keys[path].add(key)
+            self.size += len(value)
+            while self.size > self.max_entries and self.listings:
+                self.discard(next(iter(self.listings)))
+
+    def discard(self, key):
+        """Drop a listing (with the lock held)."""
+        entry = self.listings.pop(key, None)
+        if entry is None:
+            return
+        _, path, value = entry
+        self.size -= len(value)
+        keys = self.keys[path]
+        keys.discard(key)
+        if not keys:
+            del self.keys[path]
+            self.unwatch(path)
+
+    def invalidate(self, path=None):
+        """Drop the listings of a directory or, when none given, every listing."""
+        with self.lock:
+            if path is None:
+                keys = list(self.listings)
+                self.epoch += 1
+            else:
+                path = os.path.normpath(path)
+                keys = list(self.keys.get(path, ()))
+                self.generations[path] = next(self.clock)
+                if len(self.generations) > max(self.max_entries, 1024):
+                    self.prune()
+            for key in keys:
+                self.discard(key)
+
+    def prune(self):
+        """Forget the changes of directories neither cached nor watched."""
+        self.generations = {
+            path: tick
+            for path, tick in self.generations.items()
+            if path in self.keys or path in self.watches
+        }
+
+    def is_remote(self, path):
+        return any(
+            os.path.join(path, "").startswith(os.path.join(mount, ""))
+            for mount in self.remote
+        )
+
+    def watch(self, path):
+        """Watch a directory for changes, telling whether it could be."""
+        if self.inotify is None or self.is_remote(path):
+            return False
+        with self.lock:
+            if path in self.watches:
+                return True
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError:  # e.g. too many watches
+                return False
+            self.watches[path] = wd
+            self.paths[wd] = path
+            return True
+
+    def unwatch(self, path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def listen(self):
+        """Drop listings as their directories change."""
+        while True:
+            try:
+                events = self.inotify.read()
+            except OSError:
+                break
+            for wd, mask, _, _ in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    self.invalidate()
+                    continue
+                with self.lock:
+                    path = self.paths.get(wd)
+                    if mask & inotify.IN_IGNORED:  # watch removed
+                        self.paths.pop(wd, None)
+                        if self.watches.get(path) == wd:
+                            del self.watches[path]
+                if path is not None:
+                    self.invalidate(path)
+
+    def info(self):
+        """Usage metrics of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "listings": len(self.listings),
+                "entries": self.size,
+                "watches": len(self.watches),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# the cache of directory listings, when enabled (see 'DirectoryCache')
+cache = None
+
+
+def configure(app):
+    """Enable the cache of listings, if the app says so."""
+    global cache
+    if app.config["DIR_CACHE"]:
+        cache = DirectoryCache(
+            max_entries=app.config["DIR_CACHE_ENTRIES"],
+            ttl=app.config["DIR_CACHE_TTL"],
+            fallback_ttl=app.config["DIR_CACHE_FALLBACK_TTL"],
+        )
+
+
+def invalidate(*paths):
+    """Drop the cached listings of given directories, if any."""
+    if cache is not None:
+        for path in paths:
+            cache.invalidate(path)
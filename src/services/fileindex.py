@@ -0,0 +1,301 @@
+import contextlib
+import logging
+import os
+import re
+import select
+import sqlite3
+import stat
+import threading
+import time
+
+from src.services.auth import user_ctx
+from src.utils import inotify
+
+__all__ = ("FileIndex", "configure")
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    gid INTEGER NOT NULL,
+    scan INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT INTO names(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    INSERT INTO names(names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY,
+    scan INTEGER NOT NULL DEFAULT 0,
+    scanned REAL
+);
+"""
+
+UPSERT = """
+INSERT INTO files (path, name, size, mtime, mode, uid, gid, scan)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET
+    size = excluded.size,
+    mtime = excluded.mtime,
+    mode = excluded.mode,
+    uid = excluded.uid,
+    gid = excluded.gid,
+    scan = excluded.scan
+"""
+
+# the longest run of characters of a glob pattern that are not wildcards
+LITERAL = re.compile(r"\[[^]]*]|[*?]")
+
+
+def subtree(path):
+    """Bounds of the paths under given path, in the order of the index."""
+    prefix = os.path.join(path, "")
+    return prefix, prefix[:-1] + chr(ord(os.path.sep) + 1)
+
+
+def like(text):
+    """A LIKE pattern of the names that contain text."""
+    escaped = re.sub(r"([\\%_])", r"\\\1", text)
+    return f"%{escaped}%"
+
+
+class FileIndex:
+    """Index of the names, sizes, times and owners of the files under given
+    roots, kept in SQLite with a trigram index of names (FTS5).
+
+    The index is built and kept up to date by a single process (see 'run'):
+    roots are scanned in full periodically and changes in between are picked
+    up with inotify. Workers only read it, so it belongs to the service and
+    is never opened as a user. What a user may see is checked against the
+    filesystem, under the identity of the user, before anything is returned.
+    """
+
+    def __init__(self, database, batch=10_000):
+        self.database = database
+        self.batch = batch
+        self.local = threading.local()  # connection of each thread
+        self.inotify = None
+        self.watches = {}  # watch descriptor -> directory
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            with user_ctx(None):
+                conn = sqlite3.connect(self.database, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def cursor(self):
+        with user_ctx(None):
+            yield self.connect().cursor()
+
+    def root(self, path):
+        """The root of the index given path is under, once it was scanned."""
+        with self.cursor() as cursor:
+            roots = cursor.execute(
+                "SELECT path FROM roots WHERE scanned IS NOT NULL"
+            ).fetchall()
+        path = os.path.join(path, "")
+        return next(
+            (root for root, in roots if path.startswith(os.path.join(root, ""))),
+            None,
+        )
+
+    def candidates(self, path, pattern):
+        """Paths under given path whose name may match a search pattern, read
+        in batches. Names still have to be matched (see 'search.matcher')."""
+        lower, upper = subtree(path)
+        literal = max(LITERAL.split(pattern), key=len)
+        if literal:
+            query = (
+                "SELECT files.path FROM names JOIN files ON files.id = names.rowid "
+                "WHERE names.name LIKE ? ESCAPE '\\' AND files.path > ? "
+                "AND files.path < ?"
+            )
+            params = (like(literal), lower, upper)
+        else:
+            query = "SELECT path FROM files WHERE path > ? AND path < ?"
+            params = (lower, upper)
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+        while True:
+            with user_ctx(None):
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            yield [path for path, in rows]
+
+    def directories(self, path):
+        """Directories under given path, read in batches."""
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT path FROM files WHERE path > ? AND path < ? AND mode & ? = ?",
+                (*subtree(path), stat.S_IFMT(0o177777), stat.S_IFDIR),
+            )
+        while True:
+            with user_ctx(None):
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            yield [path for path, in rows]
+
+    def usage(self, path):
+        """Total size and count of the files under given path, directories
+        aside."""
+        with self.cursor() as cursor:
+            return cursor.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files "
+                "WHERE path > ? AND path < ? AND mode & ? != ?",
+                (*subtree(path), stat.S_IFMT(0o177777), stat.S_IFDIR),
+            ).fetchone()
+
+    # building the index, in a process of its own
+
+    def run(self, roots, rescan=3600):
+        """Index given roots, and keep the index up to date forever."""
+        try:
+            self.inotify = inotify.Inotify()
+        except OSError:
+            logger.warning("inotify not available, relying on rescans only")
+        while True:
+            for root in roots:
+                self.scan(os.path.normpath(root))
+            self.listen(timeout=rescan)
+
+    def scan(self, root):
+        """Index every file under a root, dropping the files no longer there."""
+        conn = self.connect()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)", (root,))
+            conn.execute("UPDATE roots SET scan = scan + 1 WHERE path = ?", (root,))
+            (generation,) = conn.execute(
+                "SELECT scan FROM roots WHERE path = ?", (root,)
+            ).fetchone()
+        self.index_tree(root, generation)
+        with conn:
+            conn.execute(
+                "DELETE FROM files WHERE path > ? AND path < ? AND scan < ?",
+                (*subtree(root), generation),
+            )
+            conn.execute(
+                "UPDATE roots SET scanned = ? WHERE path = ?", (time.time(), root)
+            )
+
+    def index_tree(self, top, generation):
+        conn = self.connect()
+        rows = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            self.watch(path)
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                rows.append(self.row(entry.path, st, generation))
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(entry.path)
+            if len(rows) >= self.batch:
+                with conn:
+                    conn.executemany(UPSERT, rows)
+                rows.clear()
+        with conn:
+            conn.executemany(UPSERT, rows)
+
+    @staticmethod
+    def row(path, st, generation):
+        return (
+            path,
+            os.path.basename(path),
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_mode,
+            st.st_uid,
+            st.st_gid,
+            generation,
+        )
+
+    def update(self, path):
+        """Index the current state of a path, whether created, changed or
+        removed."""
+        conn = self.connect()
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            with conn:
+                conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                conn.execute(
+                    "DELETE FROM files WHERE path > ? AND path < ?", subtree(path)
+                )
+            return
+        (generation,) = conn.execute(
+            "SELECT COALESCE(MAX(scan), 0) FROM roots"
+        ).fetchone()
+        known = conn.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone()
+        with conn:
+            conn.execute(UPSERT, self.row(path, st, generation))
+        if stat.S_ISDIR(st.st_mode) and not known:
+            self.index_tree(path, generation)  # e.g. moved in with its content
+
+    def watch(self, path):
+        if self.inotify is None:
+            return
+        try:
+            wd = self.inotify.add_watch(path)
+        except OSError as ex:
+            logger.warning(f"cannot watch {path} ({ex}), relying on rescans")
+            self.inotify = None  # e.g. too many watches, stop trying
+            return
+        self.watches[wd] = path
+
+    def listen(self, timeout):
+        """Apply the changes notified until the timeout, or until events were
+        lost (then the roots are to be rescanned)."""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            if self.inotify is None:
+                time.sleep(remaining)
+                return
+            ready, _, _ = select.select([self.inotify.fd], [], [], remaining)
+            if not ready:
+                continue
+            for wd, mask, _, name in self.inotify.read():
+                if mask & inotify.IN_Q_OVERFLOW:
+                    return
+                directory = self.watches.get(wd)
+                if mask & inotify.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif directory is not None and name:
+                    self.update(os.path.join(directory, name))
+
+
+def configure(app):
+    """Open the index of files, if the app says so."""
+    global index
+    if app.config["INDEX_DATABASE"]:
+        index = FileIndex(app.config["INDEX_DATABASE"])
+
+
+# the index of files, when enabled (see 'FileIndex')
+index = None
@@ -1,31 +1,268 @@
 from datetime import datetime
+import functools
 import os
 import pathlib
-import re
+import stat
 
-from services.filesystem import FilesystemSvc
+from src.services import dircache, fileindex
+from src.services.filesystem import FilesystemSvc
+from src.services.auth import impersonate, max_threads, thread_ctx, user_ctx
+from src.utils import du, search, threads
+from src.utils.cache import TTLCache
 
-__all__ = ("FileManagerSvc",)
+__all__ = ("FileManagerSvc", "configure")
+
+
+def _lowest(*limits):
+    """The lowest of given limits, any of them may be unset."""
+    return min((limit for limit in limits if limit is not None), default=None)
+
+
+def _listable(directory, known):
+    """Whether the current user can list a directory and the directories it
+    is in, down from the ones already known."""
+    if directory not in known:
+        parent = os.path.dirname(directory)
+        try:
+            os.close(os.open(directory, os.O_RDONLY | os.O_DIRECTORY))
+        except OSError:
+            known[directory] = False
+        else:
+            known[directory] = parent == directory or _listable(parent, known)
+    return known[directory]
 
 
 class FileManagerSvc(FilesystemSvc):
+    # sort keys named after the stats they sort by (see 'SORT_KEYS')
+    sort_fields = {
+        "name": "name",
+        "size": "size",
+        "dateModified": "mtime",
+        "dateCreated": "ctime",
+        "type": "type",
+    }
+
+    search_workers = 8  # threads scanning directories when searching
+    search_max_depth = None  # levels of subdirectories searched, all if unset
+    search_max_results = 1000  # files found by a search at most
+
+    stat_workers = 16  # threads stat'ing paths at once, for network filesystems
+    size_workers = 8  # threads scanning directories for their size
+    size_budget = 2.0  # seconds spent summing the size of directories at most
+    batch_workers = 8  # threads running the independent actions of a batch
+
+    # how 'hasChild' is computed: 'scan', 'nlink' or 'lazy'
+    has_child_strategy = "scan"
+    has_child_mounts = {}  # per mount overrides of the strategy
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
     def list_files(self, path, show_hidden=False, substr=None):
         """Override"""
-        regex = rf".*{(substr or '').strip('*')}.*"
+        match = search.matcher(substr or "", case_sensitive=True)
         files = super().list_files(path, show_hidden=show_hidden)
-        return [file for file in files if re.match(regex, file.name)]
+        return [file for file in files if match(file.name)]
+
+    def list_stats(self, path, show_hidden=False, substr=None):
+        """List the stats of files, from the cache of listings if there."""
+        if dircache.cache is None:
+            return self.scan_stats(path, show_hidden=show_hidden, substr=substr)
+        files = dircache.cache.get_or_set(
+            (self.username, os.path.normpath(path)),
+            path,
+            lambda: self.scan_stats(path, show_hidden=True),
+        )
+        match = search.matcher(substr or "", case_sensitive=True)
+        return [
+            self.resolve_has_child(file)
+            for file in files
+            if (show_hidden or not file["name"].startswith(".")) and match(file["name"])
+        ]
+
+    def resolve_has_child(self, file):
+        """The stats of a file, with 'hasChild' of a directory left to the
+        client (see 'has_child') taken from its cached listing if there."""
+        if (
+            file["isFile"]
+            or dircache.cache is None
+            or self.has_child_strategy_for(file["path"]) != "lazy"
+        ):
+            return file
+        files = dircache.cache.peek((self.username, os.path.normpath(file["path"])))
+        if files is None:
+            return file
+        return {**file, "hasChild": any(not child["isFile"] for child in files)}
+
+    @impersonate(remote=True)
+    def scan_stats(self, path, show_hidden=False, substr=None):
+        """List the stats of files in a single directory scan."""
+        return [
+            self.stats_mapper(
+                file.path, stats=file.stat(follow_symlinks=False), isdir=file.is_dir()
+            )
+            for file in self.list_files(path, show_hidden=show_hidden, substr=substr)
+        ]
+
+    @impersonate(remote=True)
+    def page_stats(
+        self,
+        path,
+        limit=None,
+        cursor=None,
+        sort_by="name",
+        order="asc",
+        show_hidden=False,
+        version=None,
+    ):
+        """A page of the stats of files, and the cursor of the next page if any.
+        Only the files of the page are mapped into stats."""
+        if sort_by not in self.sort_fields:
+            raise ValueError(f"unsupported sort key '{sort_by}'")
+        files, cursor = self.page_files(
+            path,
+            limit=limit,
+            cursor=cursor,
+            sort_by=self.sort_fields[sort_by],
+            order=order,
+            show_hidden=show_hidden,
+            stat=True,
+            version=version,
+        )
+        stats = [
+            self.stats_mapper(
+                file.path, stats=file.stat(follow_symlinks=False), isdir=file.is_dir()
+            )
+            for file in files
+        ]
+        return stats, cursor
+
+    @impersonate()
+    def search_stats(
+        self,
+        path,
+        pattern,
+        case_sensitive=False,
+        show_hidden=False,
+        max_depth=None,
+        max_results=None,
+    ):
+        """Search the tree under given path for names matching a pattern (see
+        'search.matcher'), yielding the stats of files as they are found."""
+        if not os.path.isdir(path):  # fail before the results start streaming
+            raise FileNotFoundError(f"no directory at '{path}'")
+        os.listdir(path)  # and check the directory can be read
+        match = search.matcher(pattern, case_sensitive=case_sensitive)
+        max_depth = _lowest(max_depth, self.search_max_depth)
+        max_results = _lowest(max_results, self.search_max_results)
+        if fileindex.index is not None and fileindex.index.root(path):
+            files = self._search_index(
+                path, pattern, match, show_hidden, max_depth, max_results
+            )
+        else:
+            entries = search.walk(
+                path,
+                match,
+                workers=max_threads(self.search_workers),
+                max_depth=max_depth,
+                max_results=max_results,
+                show_hidden=show_hidden,
+                context=functools.partial(user_ctx, self.username),
+            )
+            files = ((file.path, file.stat(follow_symlinks=False)) for file in entries)
+        return self._search_stats(files)
+
+    @impersonate()
+    def _search_index(self, path, pattern, match, show_hidden, max_depth, max_results):
+        """Search the index of files, keeping the files the user would find by
+        walking the tree, with their current stats."""
+        listable = {path: True}  # checked already
+        count = 0
+        for candidates in fileindex.index.candidates(path, pattern):
+            for candidate in candidates:
+                parts = os.path.relpath(candidate, path).split(os.path.sep)
+                if (
+                    not match(parts[-1])
+                    or (max_depth is not None and len(parts) > max_depth)
+                    or (not show_hidden and any(p.startswith(".") for p in parts))
+                    or not _listable(os.path.dirname(candidate), listable)
+                ):
+                    continue
+                try:
+                    stats = os.lstat(candidate)
+                except OSError:
+                    continue  # removed since indexed
+                yield candidate, stats
+                count += 1
+                if max_results is not None and count >= max_results:
+                    return
+
+    @impersonate()
+    def _search_stats(self, files):
+        for path, stats in files:
+            yield self.stats_mapper(
+                path, stats=stats, isdir=stat.S_ISDIR(stats.st_mode)
+            )
+
+    @impersonate()
+    def disk_usage(self, path, budget=None):
+        """Total size of the files under a directory, and whether it is
+        complete: from the index of files when indexed and every directory
+        under it can be read by the user, or else summed within the budget of
+        seconds (see 'du.disk_usage'), which skips those that cannot."""
+        if fileindex.index is not None and fileindex.index.root(path):
+            listable = {os.path.dirname(path): True}
+            if not _listable(path, listable):
+                raise PermissionError(f"cannot read '{path}'")
+            if all(
+                _listable(directory, listable)
+                for directories in fileindex.index.directories(path)
+                for directory in directories
+            ):
+                size, _ = fileindex.index.usage(path)
+                return size, True
+        return du.disk_usage(
+            path,
+            workers=self.size_workers,
+            budget=self.size_budget if budget is None else budget,
+            user=self.username,
+            context=functools.partial(thread_ctx, self.username),
+        )
+
+    @impersonate(remote=True)
+    def bulk_stats(self, paths):
+        """The stats of many paths at once, in their order, with the error of
+        each path that cannot be stat'ed in place of its stats. Paths are
+        stat'ed by a pool of threads (see 'thread_ctx')."""
+
+        def stat_path(path):
+            with thread_ctx(self.username):
+                try:
+                    return self.stats(path)
+                except OSError as ex:
+                    return ex
+
+        workers = min(self.stat_workers, len(paths))
+        with threads.executor(workers) as executor:
+            return list(executor.map(stat_path, paths))
 
     def stats(self, path):
         """Override"""
-        return self.stats_mapper(path, stats=super().stats(path))
+        if dircache.cache is None:
+            return self.stats_mapper(path, stats=super().stats(path))
+        # the stats of a file may be in the cached listing of its directory
+        parent, name = os.path.split(os.path.normpath(path))
+        files = dircache.cache.get((self.username, parent)) or ()
+        file = next((file for file in files if file["name"] == name), None)
+        if file is None:
+            file = self.stats_mapper(path, stats=super().stats(path))
+        return self.resolve_has_child(file)
 
-    @staticmethod
-    def stats_mapper(path: str, stats: os.stat_result) -> dict:
+    @classmethod
+    def stats_mapper(cls, path: str, stats: os.stat_result, isdir=None) -> dict:
         path = os.path.join(os.path.sep, path.strip(os.path.sep))
-        isdir = os.path.isdir(path)
+        if isdir is None:
+            isdir = os.path.isdir(path)
         return {
             "name": os.path.basename(path),
             "path": path,
@@ -35,6 +272,54 @@ class FileManagerSvc(FilesystemSvc):
             "dateModified": datetime.fromtimestamp(stats.st_mtime),
             "dateCreated": datetime.fromtimestamp(stats.st_ctime),
             "type": pathlib.Path(path).suffix,
-            "hasChild": bool(next(os.walk(path), ((), ()))[1]) if isdir else False,
+            "hasChild": cls.has_child(path, stats=stats) if isdir else False,
             "mode": stats.st_mode,
         }
+
+    @classmethod
+    def has_child_strategy_for(cls, path):
+        """The strategy of the longest mount prefix containing the path."""
+        mounts = (
+            mount
+            for mount in cls.has_child_mounts
+            if os.path.join(path, "").startswith(os.path.join(mount, ""))
+        )
+        mount = max(mounts, key=len, default=None)
+        return cls.has_child_mounts[mount] if mount else cls.has_child_strategy
+
+    @classmethod
+    def has_child(cls, path, stats=None):
+        """Whether a directory contains at least one subdirectory."""
+        strategy = cls.has_child_strategy_for(path)
+        if strategy == "lazy":
+            # until the listing of the directory is cached, if ever (see
+            # 'resolve_has_child'), or the client reads the directory itself
+            return True
+        # each subdirectory links back to its parent with '..', although some
+        # filesystems (btrfs, some NFS servers) always report a single link
+        if (
+            strategy == "nlink"
+            and stats
+            and stat.S_ISDIR(stats.st_mode)
+            and stats.st_nlink >= 2
+        ):
+            return stats.st_nlink > 2
+        try:
+            with os.scandir(path) as it:
+                return any(entry.is_dir() for entry in it)
+        except OSError:
+            return False
+
+
+def configure(app):
+    """Apply the settings of an app to the service."""
+    FileManagerSvc.search_workers = app.config["SEARCH_WORKERS"]
+    FileManagerSvc.search_max_depth = app.config["SEARCH_MAX_DEPTH"]
+    FileManagerSvc.search_max_results = app.config["SEARCH_MAX_RESULTS"]
+    FileManagerSvc.stat_workers = app.config["STAT_WORKERS"]
+    FileManagerSvc.size_workers = app.config["DIR_SIZE_WORKERS"]
+    FileManagerSvc.size_budget = app.config["DIR_SIZE_BUDGET"]
+    FileManagerSvc.batch_workers = app.config["BATCH_WORKERS"]
+    FileManagerSvc.has_child_strategy = app.config["HAS_CHILD_STRATEGY"]
+    FileManagerSvc.has_child_mounts = app.config["HAS_CHILD_MOUNTS"]
+    du.cache = TTLCache(maxsize=app.config["DIR_SIZE_CACHE_ENTRIES"], ttl=24 * 3600)
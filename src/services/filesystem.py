@@ -1,18 +1,67 @@
+from datetime import datetime
+import contextlib
+import functools
+import hashlib
+import inspect
 import io
-import tarfile
+import json
 import os
 import re
 import shutil
+import time
 
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 
-from src.services.auth import impersonate
+from src.services import archive, dircache
+from src.services.auth import impersonate, thread_ctx
+from src.utils import fastcopy, paging, threads, upload
 
-__all__ = ("FilesystemSvc",)
+__all__ = ("FilesystemSvc", "configure")
+
+# keys by which listings are sorted, ending with the name for them to be unique
+SORT_KEYS = {
+    "name": lambda entry: (entry.name,),
+    "size": lambda entry: (entry.stat(follow_symlinks=False).st_size, entry.name),
+    "mtime": lambda entry: (entry.stat(follow_symlinks=False).st_mtime_ns, entry.name),
+    "ctime": lambda entry: (entry.stat(follow_symlinks=False).st_ctime_ns, entry.name),
+    "type": lambda entry: (os.path.splitext(entry.name)[1], entry.name),
+}
+
+
+def invalidates(*names):
+    """Drop the cached listings of the paths given by the named arguments, and
+    of their directories, once the routine is done."""
+
+    def wrapper(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def decorated(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if dircache.cache is not None:
+                    arguments = signature.bind(*args, **kwargs).arguments
+                    for name in names:
+                        path = os.path.normpath(arguments[name])
+                        dircache.invalidate(path, os.path.dirname(path))
+
+        return decorated
+
+    return wrapper
 
 
 class FilesystemSvc:
+    copy_workers = 8  # threads copying the files of a directory
+    upload_workers = 8  # threads writing the files of an upload
+    upload_durability = "none"  # how uploads are synced (see 'upload.DURABILITY')
+    upload_buffer_size = 1024 * 1024  # bytes copied at once into uploaded files
+    upload_ttl = 24 * 3600  # seconds the state of chunked uploads is kept
+    extract_workers = 4  # threads writing the files of an uploaded archive
+    compression_level = 6  # gzip level of archives
+    compression_threads = None  # threads compressing archives, one per cpu
+
     def __init__(self, username=None):
         self.username = str(username) if username else None
 
@@ -26,49 +75,311 @@ class FilesystemSvc:
         ]
 
     @impersonate()
+    def iter_files(self, path, show_hidden=False, stat=False):
+        """Iterate over the files in given path, one entry at a time. With stat,
+        entries come with their stats (cached by 'os.DirEntry')."""
+        it = os.scandir(path)  # fail before the iteration starts
+        return self._iter_files(it, show_hidden=show_hidden, stat=stat)
+
+    @impersonate()
+    def _iter_files(self, it, show_hidden, stat):
+        with it:
+            for entry in it:
+                if not show_hidden and entry.name.startswith("."):
+                    continue
+                if stat:
+                    entry.stat(follow_symlinks=False)
+                    entry.is_dir()
+                yield entry
+
+    @impersonate()
+    def page_files(
+        self,
+        path,
+        limit=None,
+        cursor=None,
+        sort_by="name",
+        order="asc",
+        show_hidden=False,
+        stat=False,
+        version=None,
+    ):
+        """A page of the files in given path sorted by one of 'SORT_KEYS', and
+        the cursor of the next page if any (see 'paging.paginate')."""
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"unsupported sort key '{sort_by}'")
+        version = version or self.version(path, show_hidden)
+        files = self.iter_files(
+            path, show_hidden=show_hidden, stat=stat or sort_by != "name"
+        )
+        return paging.paginate(
+            files,
+            SORT_KEYS[sort_by],
+            version,
+            sort_by,
+            order=order,
+            limit=limit,
+            cursor=cursor,
+        )
+
+    @impersonate(remote=True)
     def stats(self, path) -> os.stat_result:
         return os.stat(os.path.normpath(path), follow_symlinks=False)
 
+    @impersonate()
+    def version(self, path, *params, children=False):
+        """Token of the state of a directory, which changes as entries are added,
+        removed or renamed in it, as well as with given parameters. With
+        children, it also changes as entries change size or time, as listings
+        with stats do: entries are taken from the cached listing of the
+        directory if there, or else scanned one at a time, in any order."""
+        stats = FilesystemSvc.stats(self, path)
+        state = (stats.st_ino, stats.st_mtime_ns, stats.st_ctime_ns, *params)
+        digest = hashlib.sha1(repr(state).encode())
+        if children:
+            total = 0  # of the hashes of the entries, whatever their order
+            for entry in self._entry_states(path):
+                entry_digest = hashlib.sha1(repr(entry).encode()).digest()
+                total += int.from_bytes(entry_digest[:8], "big")
+            digest.update(str(total % (1 << 64)).encode())
+        return digest.hexdigest()
+
+    def _entry_states(self, path):
+        """The name, size and modification time of the entries of a directory."""
+        files = None
+        if dircache.cache is not None:
+            files = dircache.cache.peek((self.username, os.path.normpath(path)))
+        if files is not None:
+            for file in files:
+                yield file["name"], file["size"], file["dateModified"]
+            return
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue  # removed meanwhile
+                yield entry.name, st.st_size, datetime.fromtimestamp(st.st_mtime)
+
+    @invalidates("dst")
     @impersonate()
     def save_file(self, dst, file: FileStorage):
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(dst, filename))
+        path = os.path.join(dst, secure_filename(file.filename))
+        self.write_file(path, file, overwrite=os.path.exists(path))
+
+    @invalidates("dst")
+    @impersonate()
+    def save_files(self, dst, files: list[FileStorage], overwrite=False):
+        """Save many files at once into a directory, either new files or, with
+        overwrite, files that exist already.
+
+        Which files exist is read with a single scan of the directory, then
+        files are written by a pool of threads (see 'thread_ctx'). Files only
+        show once written in full, and new files do not replace files created
+        meanwhile.
+        """
+        names = [secure_filename(file.filename) for file in files]
+        try:
+            with os.scandir(dst) as it:
+                existing = {entry.name for entry in it}
+        except (FileNotFoundError, NotADirectoryError):
+            existing = set()  # writes fail below, if any
+        if overwrite and not existing.issuperset(names):
+            raise FileNotFoundError("a file does not exist in given path")
+        if not overwrite and not existing.isdisjoint(names):
+            raise FileExistsError("a file already exists in given path")
+
+        def write(file, name):
+            with thread_ctx(self.username):
+                self.write_file(os.path.join(dst, name), file, overwrite=overwrite)
+
+        workers = min(self.upload_workers, len(files))
+        with threads.executor(workers) as executor:
+            for future in [executor.submit(write, *args) for args in zip(files, names)]:
+                future.result()  # raise the first error, once every write is done
+
+    @invalidates("dst")
+    @impersonate()
+    def extract_archive(self, dst, fileobj, fmt="tar"):
+        """Extract a tar archive, read from a stream as it is uploaded, into a
+        directory (see 'archive.extract'). Files are written as uploads are,
+        and do not replace existing files. Return the number of files."""
+        return archive.extract(
+            fileobj,
+            dst,
+            write=functools.partial(
+                upload.write_file,
+                durability=self.upload_durability,
+                bufsize=self.upload_buffer_size,
+            ),
+            fmt=fmt,
+            workers=self.extract_workers,
+            context=functools.partial(thread_ctx, self.username),
+        )
+
+    def write_file(self, path, file: FileStorage, overwrite=False):
+        """Write an uploaded file atomically (see 'upload.write_file')."""
+        return upload.write_file(
+            path,
+            file.stream,
+            overwrite=overwrite,
+            durability=self.upload_durability,
+            bufsize=self.upload_buffer_size,
+        )
 
+    @invalidates("dst")
     @impersonate()
+    def save_chunk(
+        self, dst, file: FileStorage, index, total, chunk_size=None, key=None
+    ):
+        """Write a chunk of an upload at its offset in a partial file, which is
+        renamed into place with the last chunk. Return the committed offset.
+
+        All chunks but the last have the same size, recorded with the first
+        chunk in the state of the upload, along with the size of the file once
+        the upload is done. Chunks must come at the offset the upload is at: a
+        chunk sent again is not written twice, and chunks sent again once the
+        upload is done, until it expires, are not written at all. The file
+        gets the permissions of the file it replaces, or else the default ones.
+        """
+        if not 0 <= index < total:
+            raise ValueError(f"chunk index {index} out of {total} chunks")
+        filename = secure_filename(file.filename)
+        partial = self.partial_path(dst, filename, key=key)
+        state_path = self.upload_state_path(dst, filename, key=key)
+        path = os.path.join(dst, filename)
+        file.stream.seek(0, os.SEEK_END)
+        length = file.stream.tell()
+        file.stream.seek(0)
+
+        if index == 0:  # a new upload
+            state = {"chunkSize": chunk_size or length}
+            self.write_upload_state(state_path, state)
+            flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC
+        else:
+            state = self.read_upload_state(state_path) or {}
+            if "size" in state:
+                return state["size"]  # done already, the reply to it lost
+            chunk_size = chunk_size or state.get("chunkSize")
+            if chunk_size is None:
+                raise ValueError("missing chunks before this one")
+            flags = os.O_RDWR
+
+        offset = index * (chunk_size or 0)
+        try:
+            fileno = os.open(partial, flags, 0o600)
+        except FileNotFoundError:
+            raise ValueError(f"missing chunks before offset {offset}") from None
+        with open(fileno, "r+b") as fd:
+            fd.seek(0, os.SEEK_END)
+            size = fd.tell()
+            if offset == size:
+                shutil.copyfileobj(file.stream, fd, self.upload_buffer_size)
+                size = fd.tell()
+            elif offset > size:
+                raise ValueError(f"missing chunks before offset {offset}")
+            elif offset + length != size:  # unless written already
+                raise ValueError(f"chunk at offset {offset}, upload at {size}")
+            if index == total - 1:
+                fd.flush()
+                upload.sync(fd.fileno(), self.upload_durability)
+
+        if index == total - 1:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~upload.umask()
+            os.chmod(partial, mode)
+            os.replace(partial, path)
+            upload.sync_dir(dst, self.upload_durability)
+            self.write_upload_state(state_path, {**state, "size": size})
+        return size
+
+    @impersonate(remote=True)
+    def upload_offset(self, dst, filename, key=None):
+        """The number of bytes of an upload committed so far, which is the size
+        of the file once the upload is done, until it expires."""
+        partial = self.partial_path(dst, secure_filename(filename), key=key)
+        try:
+            return os.stat(partial).st_size
+        except FileNotFoundError:
+            state_path = self.upload_state_path(dst, filename, key=key)
+            return (self.read_upload_state(state_path) or {}).get("size", 0)
+
+    @staticmethod
+    def partial_path(dst, filename, key=None):
+        return os.path.join(dst, f".{secure_filename(key or filename)}.part")
+
+    @staticmethod
+    def upload_state_path(dst, filename, key=None):
+        return os.path.join(dst, f".{secure_filename(key or filename)}.upload")
+
+    @staticmethod
+    def write_upload_state(path, state):
+        with open(
+            os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as fd:
+            json.dump(state, fd)
+
+    def read_upload_state(self, path):
+        """The state of an upload, or None when missing or expired, in which
+        case it is removed."""
+        try:
+            with open(path) as fd:
+                expired = time.time() - os.fstat(fd.fileno()).st_mtime > self.upload_ttl
+                state = None if expired else json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if state is None:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        return state
+
+    @invalidates("path")
+    @impersonate(remote=True)
     def make_dir(self, path, name):
         os.mkdir(os.path.join(path, name))
 
-    @impersonate()
+    @impersonate(remote=True)
     def exists_path(self, path):
         return os.path.exists(path)
 
-    @impersonate()
+    @invalidates("path")
+    @impersonate(remote=True)
     def remove_path(self, path):
         if os.path.isdir(path):
             shutil.rmtree(path)
         else:
             os.remove(path)
 
-    @impersonate()
+    @invalidates("src", "dst")
+    @impersonate(remote=True)
     def move_path(self, src, dst):
         dst = self.rename_duplicates(dst=dst, filename=os.path.basename(src))
         shutil.move(src, dst)
         return dst
 
-    @impersonate()
+    @invalidates("src", "dst")
+    @impersonate(remote=True)
     def rename_path(self, src, dst):
         os.rename(src, dst)
 
-    @impersonate()
+    @invalidates("dst")
+    @impersonate(remote=True)
     def copy_path(self, src, dst):
         dst = self.rename_duplicates(dst=dst, filename=os.path.basename(src))
         if os.path.isdir(src):
-            shutil.copytree(src, dst)
+            fastcopy.copytree(
+                src,
+                dst,
+                workers=self.copy_workers,
+                context=functools.partial(thread_ctx, self.username),
+            )
         else:
-            shutil.copy2(src, dst)
+            fastcopy.copy2(src, dst)
         return dst
 
-    @impersonate()
+    @impersonate(remote=True)
     def rename_duplicates(self, dst, filename, count=0):
         if count > 0:
             base, extension = os.path.splitext(filename)
@@ -82,15 +393,56 @@ class FilesystemSvc:
             return path
 
     @impersonate()
-    def create_attachment(self, paths=()):
+    def create_attachment(self, paths=(), format="tar.gz"):
         obj = io.BytesIO()
-        with tarfile.open(fileobj=obj, mode="w|gz") as tar:
-            for path in paths:
-                arcname = os.path.basename(path)  # keep path relative
-                tar.add(path, arcname=arcname)
+        for chunk in self.stream_attachment(paths=paths, format=format):
+            obj.write(chunk)
         obj.seek(0)
         return obj
 
     @impersonate()
+    def stream_attachment(
+        self, paths=(), bufsize=io.DEFAULT_BUFFER_SIZE, format="tar.gz"
+    ):
+        """Archive given paths as a stream of chunks of about bufsize."""
+        for path in paths:
+            os.lstat(path)  # fail before the response starts streaming
+        if format not in archive.available_formats():
+            raise ValueError(f"unsupported archive format '{format}'")
+        return self._archive_chunks(paths, bufsize=bufsize, format=format)
+
+    @impersonate()
+    def _archive_chunks(self, paths, bufsize, format):
+        yield from archive.chunks(
+            paths,
+            format,
+            bufsize=bufsize,
+            level=self.compression_level,
+            threads=self.compression_threads,
+        )
+
+    @impersonate(remote=True)
+    def archive_fingerprint(self, paths, format="tar.gz"):
+        """Key of the archive of given paths in the cache of archives."""
+        return archive.fingerprint(paths, self.username, format, self.compression_level)
+
+    @impersonate(remote=True)
+    def archive_format(self, paths, formats=(), policy="tar.gz"):
+        """Pick the archive format of given paths (see 'choose_format')."""
+        return archive.choose_format(paths, formats=formats, policy=policy)
+
+    @impersonate(remote=True)
     def isfile(self, path):
         return os.path.isfile(path)
+
+
+def configure(app):
+    """Apply the settings of an app to the service."""
+    FilesystemSvc.copy_workers = app.config["COPY_WORKERS"]
+    FilesystemSvc.upload_workers = app.config["UPLOAD_WORKERS"]
+    FilesystemSvc.upload_durability = app.config["UPLOAD_DURABILITY"]
+    FilesystemSvc.upload_buffer_size = app.config["UPLOAD_BUFFER_SIZE"]
+    FilesystemSvc.upload_ttl = app.config["UPLOAD_TTL"]
+    FilesystemSvc.extract_workers = app.config["EXTRACT_WORKERS"]
+    FilesystemSvc.compression_level = app.config["ARCHIVE_COMPRESSION_LEVEL"]
+    FilesystemSvc.compression_threads = app.config["ARCHIVE_COMPRESSION_THREADS"]
@@ -0,0 +1,269 @@
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import datetime
+import functools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing
+import uuid
+
+from src.services import auth, dircache
+from src.services.auth import thread_ctx, user_ctx
+from src.utils import fastcopy
+
+__all__ = (
+    "Job",
+    "JobCancelled",
+    "JobLimitError",
+    "JobManager",
+    "JobsUnavailableError",
+    "configure",
+)
+
+
+class JobCancelled(Exception):
+    """Raised within a job once it is cancelled."""
+
+
+class JobLimitError(Exception):
+    """Raised when a user already has too many jobs running."""
+
+
+class JobsUnavailableError(Exception):
+    """Raised when jobs cannot run as their users, i.e. unless credentials are
+    per thread (see 'ProcessCredentials')."""
+
+
+@dataclasses.dataclass
+class Job:
+    """A long running action, whose progress is counted in files and bytes."""
+
+    action: str
+    username: typing.Optional[str] = None
+    id: str = dataclasses.field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "pending"  # pending, running, done, failed or cancelled
+    files: int = 0
+    bytes: int = 0
+    result: typing.Any = None
+    error: typing.Optional[str] = None
+    created: datetime.datetime = dataclasses.field(
+        default_factory=datetime.datetime.now
+    )
+    finished: typing.Optional[float] = None
+    cancel_event: threading.Event = dataclasses.field(
+        default_factory=threading.Event, repr=False
+    )
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def active(self):
+        return self.status in ("pending", "running")
+
+    def advance(self, size=0, files=1):
+        """Account for done work, which is called from several threads."""
+        with self.lock:
+            self.files += files
+            self.bytes += size
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        """Stop the job when it is cancelled."""
+        if self.cancel_event.is_set():
+            raise JobCancelled
+
+
+class JobManager:
+    """Run jobs in a bounded pool of threads, each job under the credentials
+    of the user who submitted it.
+
+    Users cannot have more than ``per_user`` jobs pending or running at once.
+    Finished jobs are kept for ``retention`` seconds for their results to be
+    fetched. Jobs live in the memory of the process that runs them, so they
+    are unknown (404) to requests served by other worker processes.
+
+    Jobs run on once the request that submitted them is done, while other
+    requests are served, so they need credentials per thread: with the
+    process backend, any request switching users would switch the user of
+    running jobs too.
+    """
+
+    def __init__(self, workers=4, per_user=2, retention=3600, spool=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self.per_user = per_user
+        self.retention = retention
+        self.spool = spool or tempfile.gettempdir()
+        self.jobs = collections.OrderedDict()  # job id -> job
+        self.lock = threading.Lock()
+
+    def submit(self, username, action, func, *args, **kwargs) -> Job:
+        """Run func(job, *args, **kwargs) in the background."""
+        if not auth.backend.per_thread:
+            raise JobsUnavailableError("jobs need the 'thread' impersonation backend")
+        with self.lock:
+            self.purge()
+            running = sum(
+                job.active and job.username == username for job in self.jobs.values()
+            )
+            if running >= self.per_user:
+                raise JobLimitError(f"no more than {self.per_user} jobs at once")
+            job = Job(action=action, username=username)
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, func, args, kwargs)
+        return job
+
+    def run(self, job, func, args, kwargs):
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished = time.monotonic()
+            return
+        job.status = "running"
+        try:
+            with user_ctx(job.username):
+                job.result = func(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as ex:
+            job.status = "failed"
+            job.error = str(ex) or type(ex).__name__
+        finally:
+            job.finished = time.monotonic()
+
+    def get(self, job_id, username) -> Job:
+        """Get a job of given user, or raise 'KeyError'."""
+        with self.lock:
+            job = self.jobs[job_id]
+        if job.username != username:
+            raise KeyError(job_id)  # jobs of other users are not to be known
+        return job
+
+    def cancel(self, job_id, username) -> Job:
+        job = self.get(job_id, username)
+        job.cancel()
+        return job
+
+    def purge(self):
+        """Drop the jobs that finished longer than the retention ago, of any
+        user, and their archives as the user of the process."""
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished is not None and now - job.finished > self.retention:
+                del self.jobs[job_id]
+                if isinstance(job.result, dict) and "archive" in job.result:
+                    with contextlib.suppress(OSError), user_ctx(None):
+                        os.remove(job.result["archive"])
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            job.cancel()
+        self.executor.shutdown(wait=True)
+
+
+def configure(app):
+    """Start the manager of background jobs."""
+    global manager
+    manager = JobManager(
+        workers=app.config["JOB_WORKERS"],
+        per_user=app.config["JOB_USER_LIMIT"],
+        retention=app.config["JOB_RETENTION"],
+        spool=app.config["JOB_SPOOL_DIR"],
+    )
+
+
+# the manager of background jobs (see 'JobManager')
+manager = None
+
+
+def copy_job(job, svc, path, names, dst):
+    """Copy names in path into dst, the same as the 'copy' action does."""
+    paths = []
+    errors = []
+    for name in names:
+        job.check()
+        src = os.path.join(path, name)
+        target = svc.rename_duplicates(dst=dst, filename=name)
+        try:
+            if os.path.isdir(src):
+                fastcopy.copytree(
+                    src,
+                    target,
+                    workers=svc.copy_workers,
+                    context=functools.partial(thread_ctx, svc.username),
+                    progress=job.advance,
+                    cancel=job.cancel_event,
+                )
+            else:
+                fastcopy.copy2(src, target)
+                job.advance(os.stat(target).st_size)
+        except shutil.Error as ex:  # some files of a directory
+            errors.extend(error[0] for error in ex.args[0])
+        job.check()
+        paths.append(target)
+    dircache.invalidate(dst)
+    if errors:
+        raise OSError(f"Cannot copy {', '.join(errors)}")
+    return {"paths": paths}
+
+
+def move_job(job, svc, path, names, dst):
+    """Move names in path into dst, the same as the 'move' action does."""
+    paths = []
+    for name in names:
+        job.check()
+        src = os.path.join(path, name)
+        size = os.lstat(src).st_size
+        paths.append(svc.move_path(src=src, dst=dst))
+        job.advance(size)
+    return {"paths": paths}
+
+
+def _raise(ex):
+    raise ex
+
+
+def delete_job(job, svc, path, names):
+    """Delete names in path, a file at a time so that progress shows."""
+    for name in names:
+        job.check()
+        top = os.path.join(path, name)
+        if not os.path.isdir(top) or os.path.islink(top):
+            size = os.lstat(top).st_size
+            os.remove(top)
+            job.advance(size)
+            continue
+        for root, dirs, files in os.walk(top, topdown=False, onerror=_raise):
+            links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+            for filename in files + links:
+                job.check()
+                filepath = os.path.join(root, filename)
+                size = os.lstat(filepath).st_size
+                os.remove(filepath)
+                job.advance(size)
+            os.rmdir(root)
+    dircache.invalidate(path)
+    return {"paths": [os.path.join(path, name) for name in names]}
+
+
+def archive_job(job, svc, paths, filename, bufsize, spool=None):
+    """Archive paths into a file of the spool, to be downloaded later."""
+    chunks = svc.stream_attachment(paths=paths, bufsize=bufsize)
+    fd, archive = tempfile.mkstemp(prefix="job-", suffix=".tar.gz", dir=spool)
+    try:
+        with open(fd, "wb") as file:
+            for chunk in chunks:
+                job.check()
+                file.write(chunk)
+                job.advance(len(chunk), files=0)
+    except BaseException:
+        os.remove(archive)
+        raise
+    return {"archive": archive, "filename": filename}
@@ -0,0 +1,174 @@
+import atexit
+import collections
+import multiprocessing
+import os
+import threading
+import time
+import types
+
+from src import utils
+from src.services import auth, filemgr, filesystem
+
+__all__ = ("UserPool", "configure")
+
+
+def serve(username, conn, config=None):
+    """Main loop of a helper process, which runs as given user for good.
+
+    The services are set up with the settings of the app, if given, as the
+    process does not inherit them. When the process cannot become the user,
+    every call is answered with the error rather than run with the
+    credentials of the pool.
+    """
+    if config is not None:
+        app = types.SimpleNamespace(config=config)  # the settings, with no app
+        filesystem.configure(app)
+        filemgr.configure(app)
+    failure = None
+    try:
+        if utils.user_uid(username) != os.getuid():
+            os.setgroups(utils.user_groups(username))
+            os.setgid(utils.user_gid(username))
+            os.setuid(utils.user_uid(username))
+    except (KeyError, TypeError, OSError) as ex:
+        failure = PermissionError(f"cannot run as '{username}': {ex}")
+
+    # calls are to run right here, as the process already is the user
+    auth.pool = None
+    auth.backend = auth.FixedCredentials(username)
+    auth._local.username = username
+
+    while True:
+        try:
+            func, args, kwargs = conn.recv()
+        except EOFError:
+            break  # the pool went away
+        if failure is not None:
+            conn.send((None, failure))
+            continue
+        try:
+            result = (func(*args, **kwargs), None)
+        except Exception as ex:
+            result = (None, ex)
+        try:
+            conn.send(result)
+        except Exception as ex:  # e.g. not picklable
+            conn.send((None, OSError(str(ex))))
+
+
+class UserWorker:
+    """A long-lived helper process running as a given user."""
+
+    def __init__(self, username, context, config=None):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=serve, args=(username, child, config), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.lock = threading.Lock()
+
+    def call(self, func, args, kwargs):
+        """Run func(*args, **kwargs) in the helper process."""
+        try:
+            self.conn.send((func, args, kwargs))
+            result, error = self.conn.recv()
+        except (EOFError, OSError) as ex:
+            self.stop()
+            raise OSError("helper process is gone") from ex
+        if error:
+            raise error
+        return result
+
+    def stop(self):
+        self.conn.close()
+        self.process.terminate()
+        self.process.join()
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+
+class UserPool:
+    """Pool of helper processes, each already running as one user.
+
+    Calls made on behalf of a user go through a pipe to one of that user's
+    helper processes, so credentials are switched once per process rather than
+    per call. Up to ``processes`` helpers are started per user, letting a busy
+    user use several cores. The least recently used users are evicted once
+    there are more than ``max_users`` of them, or once they idle too long.
+    Helpers are set up with the settings in ``config`` (see 'serve').
+    """
+
+    def __init__(
+        self, max_users=32, processes=None, idle=600, method="forkserver", config=None
+    ):
+        self.max_users = max_users
+        self.config = config
+        self.processes = processes or os.cpu_count()
+        self.idle = idle
+        self.context = multiprocessing.get_context(method)
+        self.users = collections.OrderedDict()  # username -> (workers, last used)
+        self.lock = threading.Lock()
+
+    def call(self, username, func, args=(), kwargs=None):
+        worker = self.acquire(username)
+        try:
+            return worker.call(func, args, kwargs or {})
+        finally:
+            worker.lock.release()
+
+    def acquire(self, username):
+        """Get a helper process of the user, which is locked for the caller."""
+        with self.lock:
+            workers, _ = self.users.pop(username, ([], None))
+            workers[:] = [worker for worker in workers if worker.alive]
+            self.users[username] = (workers, time.monotonic())
+            self.evict()
+            worker = next((w for w in workers if w.lock.acquire(blocking=False)), None)
+            if worker is None and len(workers) < self.processes:
+                # as the server, whichever user the caller impersonates: the
+                # forkserver, if started now, serves every later helper
+                with auth.user_ctx(None):
+                    worker = UserWorker(username, self.context, self.config)
+                worker.lock.acquire()
+                workers.append(worker)
+        if worker is None:  # every helper is busy, so wait for one
+            worker = workers[threading.get_ident() % len(workers)]
+            worker.lock.acquire()
+        return worker
+
+    def evict(self):
+        """Stop the helpers of users that are least recently used or idle."""
+        now = time.monotonic()
+        for username, (workers, last_used) in list(self.users.items())[:-1]:
+            if len(self.users) <= self.max_users and now - last_used < self.idle:
+                break
+            locked = [worker for worker in workers if worker.lock.acquire(False)]
+            if len(locked) == len(workers):
+                del self.users[username]
+                for worker in workers:
+                    worker.stop()
+            else:  # still in use
+                for worker in locked:
+                    worker.lock.release()
+
+    def close(self):
+        with self.lock:
+            for workers, _ in self.users.values():
+                for worker in workers:
+                    worker.stop()
+            self.users.clear()
+
+
+def configure(app):
+    """Start running calls in helper processes, if the app says so."""
+    if app.config["WORKER_POOL"]:
+        auth.pool = UserPool(
+            max_users=app.config["WORKER_POOL_USERS"],
+            processes=app.config["WORKER_POOL_PROCESSES"],
+            idle=app.config["WORKER_POOL_IDLE"],
+            config=dict(app.config),
+        )
+        atexit.register(auth.pool.close)
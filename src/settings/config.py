@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import os
 
 from src.settings.env import env
 
@@ -16,6 +17,99 @@ class BaseConfig:
     # OPENAPI supported version
     OPENAPI = env.str("OPENAPI", "3.0.3")
 
+    # stream archives as they are built rather than building them in memory
+    ARCHIVE_STREAMING = env.bool("ARCHIVE_STREAMING", True)
+    ARCHIVE_BUFFER_SIZE = env.int("ARCHIVE_BUFFER_SIZE", 1024 * 1024)
+
+    # archive format when clients leave it to the server: tar.gz, tar.zst, tar,
+    # zip or 'auto' to pick the cheapest one for the content
+    ARCHIVE_FORMAT = env.str("ARCHIVE_FORMAT", "tar.gz")
+
+    # gzip level of archives and threads compressing them (one per cpu if unset)
+    ARCHIVE_COMPRESSION_LEVEL = env.int("ARCHIVE_COMPRESSION_LEVEL", 6)
+    ARCHIVE_COMPRESSION_THREADS = env.int("ARCHIVE_COMPRESSION_THREADS", None)
+
+    # cache of archives (disabled without a directory) and its size in bytes
+    ARCHIVE_CACHE_DIR = env.str("ARCHIVE_CACHE_DIR", None)
+    ARCHIVE_CACHE_SIZE = env.int("ARCHIVE_CACHE_SIZE", 10 * 1024**3)
+
+    # threads copying the files of a directory
+    COPY_WORKERS = env.int("COPY_WORKERS", 8)
+
+    # threads writing the files of an upload at once
+    UPLOAD_WORKERS = env.int("UPLOAD_WORKERS", 8)
+
+    # how uploads are synced before they show: none, data (fdatasync) or full
+    # (fsync of the file and its directory), and bytes copied at once
+    UPLOAD_DURABILITY = env.str("UPLOAD_DURABILITY", "none")
+    UPLOAD_BUFFER_SIZE = env.int("UPLOAD_BUFFER_SIZE", 1024 * 1024)
+
+    # seconds a chunked upload can be resumed, or found done, since its last chunk
+    UPLOAD_TTL = env.int("UPLOAD_TTL", 24 * 3600)
+
+    # threads writing the files of an uploaded archive at once
+    EXTRACT_WORKERS = env.int("EXTRACT_WORKERS", 4)
+
+    # searches: threads scanning directories, levels searched (all if unset)
+    # and files found at most
+    SEARCH_WORKERS = env.int("SEARCH_WORKERS", 8)
+    SEARCH_MAX_DEPTH = env.int("SEARCH_MAX_DEPTH", None)
+    SEARCH_MAX_RESULTS = env.int("SEARCH_MAX_RESULTS", 1000)
+
+    # threads stat'ing the paths of a request at once (for network filesystems)
+    STAT_WORKERS = env.int("STAT_WORKERS", 16)
+
+    # threads running the independent actions of a batch at once
+    BATCH_WORKERS = env.int("BATCH_WORKERS", 8)
+
+    # size of directories shown in details: threads summing it, seconds spent
+    # at most (a partial size is shown past them) and directories cached
+    DIR_SIZE_WORKERS = env.int("DIR_SIZE_WORKERS", 8)
+    DIR_SIZE_BUDGET = env.float("DIR_SIZE_BUDGET", 2.0)
+    DIR_SIZE_CACHE_ENTRIES = env.int("DIR_SIZE_CACHE_ENTRIES", 100_000)
+
+    # index of files searched instead of walking directories (disabled without
+    # a database), its roots and seconds between full rescans
+    INDEX_DATABASE = env.str("INDEX_DATABASE", None)
+    INDEX_ROOTS = env.list("INDEX_ROOTS", [])
+    INDEX_RESCAN = env.int("INDEX_RESCAN", 3600)
+
+    # how directories are checked for subdirectories: scan, nlink or lazy (which
+    # claims every directory has some, a false positive until the listing of
+    # the directory is cached, and for good without DIR_CACHE)
+    HAS_CHILD_STRATEGY = env.str("HAS_CHILD_STRATEGY", "scan")
+    HAS_CHILD_MOUNTS = env.dict("HAS_CHILD_MOUNTS", {})
+
+    # how users are impersonated: 'process' (sync workers) or 'thread' (Linux)
+    IMPERSONATION_BACKEND = env.str("IMPERSONATION_BACKEND", "process")
+
+    # run filesystem operations in helper processes, each running as a user
+    WORKER_POOL = env.bool("WORKER_POOL", False)
+    WORKER_POOL_USERS = env.int("WORKER_POOL_USERS", 32)
+    WORKER_POOL_PROCESSES = env.int("WORKER_POOL_PROCESSES", os.cpu_count())
+    WORKER_POOL_IDLE = env.int("WORKER_POOL_IDLE", 600)
+
+    # cache of directory listings, bounded by entries, dropped on inotify events
+    # or after given seconds (the fallback for remote filesystems)
+    DIR_CACHE = env.bool("DIR_CACHE", False)
+    DIR_CACHE_ENTRIES = env.int("DIR_CACHE_ENTRIES", 100_000)
+    DIR_CACHE_TTL = env.int("DIR_CACHE_TTL", 60)
+    DIR_CACHE_FALLBACK_TTL = env.int("DIR_CACHE_FALLBACK_TTL", 5)
+
+    # cache of user lookups (seconds to live, max entries, users to warm up)
+    NSS_CACHE_TTL = env.int("NSS_CACHE_TTL", 300)
+    NSS_CACHE_NEGATIVE_TTL = env.int("NSS_CACHE_NEGATIVE_TTL", 30)
+    NSS_CACHE_SIZE = env.int("NSS_CACHE_SIZE", 1024)
+    NSS_CACHE_WARM = env.list("NSS_CACHE_WARM", [])
+
+    # background jobs: threads, jobs per user, seconds results are kept for
+    # (jobs need the 'thread' impersonation backend and are only known to the
+    # worker process that runs them)
+    JOB_WORKERS = env.int("JOB_WORKERS", 4)
+    JOB_USER_LIMIT = env.int("JOB_USER_LIMIT", 2)
+    JOB_RETENTION = env.int("JOB_RETENTION", 3600)
+    JOB_SPOOL_DIR = env.str("JOB_SPOOL_DIR", None)
+
 
 @dataclass
 class ProductionConfig(BaseConfig):
@@ -1,11 +1,15 @@
+import contextlib
+import json
 import os
 import pwd
 
+from flask import Response
 from flask_restful import abort
 from werkzeug.http import HTTP_STATUS_CODES
 
 from src.schemas.serializers.http import HttpResponseSchema
 from src.settings import oas
+from src.utils.cache import TTLCache
 
 
 def convert_bytes(num, suffix="B"):
@@ -33,9 +37,72 @@ def abort_with(code: int, message="", **kwargs):
     abort(code, **http_response(code, message=message, **kwargs))
 
 
+def stream_attachment(chunks, download_name, mimetype="application/octet-stream"):
+    """Send an iterable of bytes to the client as a file attachment."""
+    response = Response(chunks, mimetype=mimetype)
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
+
+
+def stream_json(
+    items, mimetype="application/json", bufsize=64 * 1024, envelope=None, key=None
+):
+    """Send an iterable of items encoded one at a time, either as a JSON array
+    or as newline delimited JSON ('application/x-ndjson'). With an envelope,
+    the array is sent as the value of key, last in the envelope object."""
+
+    def encode():
+        ndjson = mimetype == "application/x-ndjson"
+        opening, closing = "[", "]"
+        if envelope is not None:
+            members = json.dumps(envelope)[:-1]  # without the closing brace
+            separator = ", " if envelope else ""
+            opening = f"{members}{separator}{json.dumps(key)}: ["
+            closing = "]}"
+        buffer = [] if ndjson else [opening]
+        size = 0
+        for index, item in enumerate(items):
+            data = json.dumps(item)
+            if ndjson:
+                buffer.append(f"{data}\n")
+            else:
+                buffer.append(f",{data}" if index else data)
+            size += len(data) + 1
+            if size >= bufsize:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+        if not ndjson:
+            buffer.append(f"{closing}\n")
+        yield "".join(buffer)
+
+    return Response(encode(), mimetype=mimetype)
+
+
+def user_entry(username):
+    return nss_cache.get_or_set(("passwd", username), lambda: pwd.getpwnam(username))
+
+
 def user_uid(username):
-    return pwd.getpwnam(username).pw_uid
+    return user_entry(username).pw_uid
 
 
 def user_gid(username):
-    return pwd.getpwnam(username).pw_gid
+    return user_entry(username).pw_gid
+
+
+def user_groups(username):
+    return nss_cache.get_or_set(
+        ("groups", username), lambda: os.getgrouplist(username, user_gid(username))
+    )
+
+
+def warm_nss_cache(usernames=()):
+    """Resolve given users ahead of their first request."""
+    for username in usernames:
+        with contextlib.suppress(KeyError):  # unknown users are cached too
+            user_groups(username)
+
+
+# cache of user lookups, which may go all the way to LDAP
+nss_cache = TTLCache(negative=(KeyError,))
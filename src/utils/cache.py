@@ -0,0 +1,84 @@
+import collections
+import threading
+import time
+
+__all__ = ("TTLCache",)
+
+_missing = object()
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after a time to live.
+
+    Exceptions listed in ``negative`` are cached as well (with their own time
+    to live) so that repeated lookups of missing keys do not hit the backend.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, negative_ttl=30, negative=()):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative = tuple(negative)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Get a cached value, or default when missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                self.entries.move_to_end(key)
+                value, error = entry[1:]
+                if error:
+                    # a new exception each time, as raising one grows its traceback
+                    raise type(error)(*error.args)
+                return value
+            self.misses += 1
+            return default
+
+    def get_or_set(self, key, func):
+        """Get a cached value, or compute and cache it with func()."""
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+        try:
+            value = func()
+        except self.negative as ex:
+            self.set(key, error=ex, ttl=self.negative_ttl)
+            raise
+        self.set(key, value)
+        return value
+
+    def set(self, key, value=None, error=None, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires, value, error)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop a single key or, when no key is given, every key."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def info(self):
+        """Usage metrics of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
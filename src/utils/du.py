@@ -0,0 +1,83 @@
+import collections
+import concurrent.futures
+import contextlib
+import os
+import stat
+import time
+
+from src.utils import threads
+from src.utils.cache import TTLCache
+
+__all__ = ("disk_usage",)
+
+
+def disk_usage(top, workers=8, budget=None, user=None, context=contextlib.nullcontext):
+    """Total size of the files under top, and whether it is complete.
+
+    Directories are scanned by a pool of threads (by the calling thread
+    without workers), each scan within a new context from the given factory
+    (see 'fastcopy.copytree'). The size of the files of each directory is
+    cached with its subdirectories, by the user, inode and time of the
+    directory, which change as entries are added or removed. Once the budget
+    in seconds is spent, what is summed so far is returned once the scans
+    under way are done, as they may run with the credentials of the caller:
+    directories done are cached, so the next call goes further. Directories
+    that cannot be scanned are skipped, except top.
+    """
+    deadline = None if budget is None else time.monotonic() + budget
+
+    def scan(path):
+        with context():
+            st = os.lstat(path)
+            key = (user, st.st_dev, st.st_ino, st.st_mtime_ns)
+            entry = cache.get(key)
+            if entry is None:
+                size = 0
+                subdirs = []
+                with os.scandir(path) as it:
+                    for file in it:
+                        try:
+                            if file.is_dir(follow_symlinks=False):
+                                subdirs.append(file.name)
+                            else:
+                                size += file.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue  # removed meanwhile
+                entry = (size, tuple(subdirs))
+                cache.set(key, entry)
+        size, subdirs = entry
+        return size, [os.path.join(path, name) for name in subdirs]
+
+    with context():
+        st = os.lstat(top)
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size, True
+    total, subdirs = scan(top)  # errors of top itself are raised
+    pending = collections.deque(subdirs)  # directories to scan
+    running = set()
+    executor = threads.executor(workers)
+    try:
+        while pending or running:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return total, False
+            # bound the directories queued at once
+            while pending and len(running) < 2 * max(workers, 1):
+                running.add(executor.submit(scan, pending.popleft()))
+            done, running = concurrent.futures.wait(
+                running, timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    size, subdirs = future.result()
+                except OSError:
+                    continue
+                total += size
+                pending.extend(subdirs)
+        return total, True
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# sizes of the files of directories, with their subdirectories
+cache = TTLCache(maxsize=100_000, ttl=24 * 3600)
@@ -0,0 +1,149 @@
+import contextlib
+import errno
+import fcntl
+import io
+import os
+import shutil
+import stat
+
+from src.utils import threads
+
+__all__ = ("copyfile", "copy2", "copytree")
+
+# ioctl to share the extents of a file (XFS, btrfs, OCFS2, ...)
+FICLONE = 0x40049409
+
+# errors that mean a copy method is not supported for given files
+UNSUPPORTED = (
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EXDEV,
+)
+
+
+def _clone(fsrc, fdst, size):
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    if os.fstat(fdst.fileno()).st_size != size:
+        raise OSError(errno.ENOTSUP, "clone did not share extents")
+
+
+def _copy_file_range(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset)
+        if copied == 0:
+            break  # file was truncated meanwhile
+        offset += copied
+
+
+def _sendfile(fsrc, fdst, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def copyfile(src, dst, bufsize=1024 * 1024):
+    """Copy file content with the cheapest method the kernel supports: cloning
+    extents, then in-kernel copies and last a copy through user space."""
+    if stat.S_ISFIFO(os.stat(src).st_mode):
+        raise shutil.SpecialFileError(f"`{src}` is a named pipe")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        # only real files have the descriptors needed by in-kernel copies
+        if isinstance(fsrc, io.BufferedReader) and isinstance(fdst, io.BufferedWriter):
+            size = os.fstat(fsrc.fileno()).st_size
+            methods = [_clone, _sendfile]
+            if hasattr(os, "copy_file_range"):
+                methods.insert(1, _copy_file_range)
+            for method in methods:
+                try:
+                    return method(fsrc, fdst, size)
+                except OSError as ex:
+                    if ex.errno not in UNSUPPORTED:
+                        raise
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, bufsize)
+
+
+def copy2(src, dst):
+    """Same as 'shutil.copy2', copying file content with 'copyfile'."""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    copyfile(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def copytree(
+    src, dst, workers=8, context=contextlib.nullcontext, progress=None, cancel=None
+):
+    """Same as 'shutil.copytree', with files copied by a pool of threads, or
+    one after the other in the calling thread without workers.
+
+    Every copy runs within a new context from the given factory, which is how
+    threads take up the identity of the caller. Once done with a file, the
+    progress callback, if any, is called with its size. Files not yet copied
+    are skipped once the cancel event, if any, is set. The errors of every
+    file and directory, whatever they are, are raised together as a
+    'shutil.Error'.
+    """
+    errors = []
+    dirs = []
+
+    def copy(srcpath, dstpath):
+        if cancel and cancel.is_set():
+            return
+        with context():
+            copy2(srcpath, dstpath)
+            if progress:
+                progress(os.stat(dstpath).st_size)
+
+    futures = {}
+    with threads.executor(workers) as executor:
+        stack = [(src, dst)]
+        while stack and not (cancel and cancel.is_set()):
+            srcdir, dstdir = stack.pop()
+            try:
+                with os.scandir(srcdir) as it:
+                    entries = list(it)
+                os.makedirs(dstdir)
+                dirs.append((srcdir, dstdir))
+            except OSError as ex:
+                if srcdir == src:
+                    raise
+                errors.append((srcdir, dstdir, str(ex)))
+                continue
+            for entry in entries:
+                srcpath = entry.path
+                dstpath = os.path.join(dstdir, entry.name)
+                try:
+                    isdir = entry.is_dir()
+                except OSError:
+                    isdir = False
+                if isdir:
+                    stack.append((srcpath, dstpath))
+                else:
+                    future = executor.submit(copy, srcpath, dstpath)
+                    futures[future] = (srcpath, dstpath)
+    for future, (srcpath, dstpath) in futures.items():
+        if future.exception() is not None:
+            errors.append((srcpath, dstpath, str(future.exception())))
+
+    # directories last, as copying into them changes their times
+    for srcdir, dstdir in reversed(dirs):
+        try:
+            shutil.copystat(srcdir, dstdir)
+        except OSError as ex:
+            errors.append((srcdir, dstdir, str(ex)))
+    if errors:
+        raise shutil.Error(errors)
+    return dst
@@ -0,0 +1,73 @@
+import base64
+import heapq
+import json
+
+__all__ = ("StaleCursorError", "paginate")
+
+ORDERS = ("asc", "desc")
+
+
+class StaleCursorError(ValueError):
+    """Raised when a cursor was handed out for another version of a listing."""
+
+
+def encode_cursor(version, sort_by, order, key):
+    data = json.dumps([version, sort_by, order, list(key)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, version, sort_by, order):
+    """The sort key of the last item of the previous page."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_version, cursor_sort_by, cursor_order, key = json.loads(data)
+        key = tuple(key)
+    except (TypeError, ValueError):  # incl. binascii and unicode errors
+        raise ValueError("invalid cursor") from None
+    if (cursor_sort_by, cursor_order) != (sort_by, order):
+        raise ValueError("cursor of another sort order")
+    if cursor_version != version:
+        raise StaleCursorError("listing changed since the cursor was handed out")
+    return key
+
+
+def page(items, key, limit=None, after=None, reverse=False):
+    """Select the items that follow the 'after' key in the order of key, as
+    well as the key of the last one when more items follow.
+
+    Only the first items are kept along the way (see 'heapq.nsmallest') rather
+    than sorting every item, so the cost of a page grows with its size.
+    """
+    if after is not None:
+        if reverse:
+            items = (item for item in items if key(item) < after)
+        else:
+            items = (item for item in items if key(item) > after)
+    if limit is None:
+        return sorted(items, key=key, reverse=reverse), None
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    selected = select(limit + 1, items, key=key)
+    if len(selected) > limit:
+        return selected[:limit], key(selected[limit - 1])
+    return selected, None
+
+
+def paginate(items, key, version, sort_by, order="asc", limit=None, cursor=None):
+    """A page of items sorted by key, and the cursor of the next page if any.
+
+    Cursors hold the sort key of the last item of their page (keys must be
+    unique, e.g. by ending with the name of a file), so a page does not depend
+    on the pages before it. They are only valid for the version of the listing
+    they were handed out for.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"unsupported order '{order}'")
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    after = None
+    if cursor:
+        after = decode_cursor(cursor, version, sort_by, order)
+    selected, last = page(items, key, limit=limit, after=after, reverse=order == "desc")
+    if last is None:
+        return selected, None
+    return selected, encode_cursor(version, sort_by, order, last)
@@ -0,0 +1,109 @@
+import collections
+import concurrent.futures
+import os
+import struct
+import zlib
+
+__all__ = ("ParallelGzipWriter",)
+
+# gzip header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+# size of the window of history that deflate looks back into
+WINDOW = 32 * 1024
+
+
+def _deflate(data, level, zdict, finish):
+    """Compress a block as raw deflate, ending on a byte boundary so that
+    blocks can be concatenated (or ending the stream for the last block)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    mode = zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+class ParallelGzipWriter:
+    """Write-only file object compressing into a gzip stream with several
+    threads, the same way 'pigz' does.
+
+    Data is cut into blocks compressed on their own by a pool of threads (zlib
+    releases the GIL), each primed with the end of the previous block so that
+    the ratio is close to the one of a single stream. Blocks are written to
+    the underlying file object in order, as they are done. The level can be
+    changed between writes, e.g. to store data that is already compressed.
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, blocksize=128 * 1024):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads or os.cpu_count()
+        self.blocksize = blocksize
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque()  # blocks being compressed, in order
+        self.buffer = bytearray()
+        self.zdict = b""
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self.fileobj.write(HEADER)
+
+    def tell(self):
+        """Amount of uncompressed data written so far."""
+        return self.size
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.blocksize:
+            block = bytes(self.buffer[: self.blocksize])
+            del self.buffer[: self.blocksize]
+            self.submit(block)
+        return len(data)
+
+    def set_level(self, level):
+        """Compress further data with given level."""
+        if level != self.level:
+            self.flush()
+            self.level = level
+
+    def flush(self):
+        """Hand buffered data over to compression."""
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+
+    def submit(self, block, finish=False):
+        future = self.executor.submit(_deflate, block, self.level, self.zdict, finish)
+        self.pending.append(future)
+        self.zdict = (self.zdict + block[-WINDOW:])[-WINDOW:]
+        # bound the memory in use by waiting for the oldest block
+        self.drain(wait=len(self.pending) > 2 * self.threads)
+
+    def drain(self, wait=False):
+        """Write the blocks that are done, keeping them in order."""
+        while self.pending and (wait or self.pending[0].done()):
+            self.fileobj.write(self.pending.popleft().result())
+            wait = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.submit(bytes(self.buffer), finish=True)
+        self.buffer.clear()
+        while self.pending:
+            self.drain(wait=True)
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        self.executor.shutdown()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:  # the stream is broken anyway
+            self.closed = True
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,98 @@
+import collections
+import concurrent.futures
+import contextlib
+import fnmatch
+import os
+import re
+
+from src.utils import threads
+
+__all__ = ("matcher", "walk")
+
+# characters that make a search string a glob pattern
+GLOB_CHARS = frozenset("*?[")
+
+
+def matcher(pattern, case_sensitive=False):
+    """Compile a search string into a predicate over file names.
+
+    Glob patterns ('*.txt') match whole names, and any other string matches
+    the names that contain it as is.
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    if GLOB_CHARS.intersection(pattern):
+        return re.compile(fnmatch.translate(pattern), flags).match
+    return re.compile(re.escape(pattern), flags).search
+
+
+def walk(
+    top,
+    match,
+    workers=8,
+    max_depth=None,
+    max_results=None,
+    show_hidden=False,
+    context=contextlib.nullcontext,
+    cancel=None,
+):
+    """Yield the entries under top whose name match, as they are found.
+
+    Directories are scanned by a pool of threads (by the calling thread
+    without workers), each scan within a new context from the given factory
+    (see 'fastcopy.copytree'). Entries come with their stats cached.
+    Directories deeper than max_depth (the children of top being at depth 1)
+    are not scanned, and the walk stops once max_results entries are found
+    or the cancel event, if any, is set.
+    Directories that cannot be scanned are skipped, except top.
+    """
+
+    def scan(path, depth):
+        found = []
+        subdirs = []
+        with context():
+            try:
+                it = os.scandir(path)
+            except OSError:
+                if depth == 1:
+                    raise
+                return depth, found, subdirs
+            with it:
+                for entry in it:
+                    if not show_hidden and entry.name.startswith("."):
+                        continue
+                    try:
+                        isdir = entry.is_dir(follow_symlinks=False)
+                        if match(entry.name):
+                            entry.stat(follow_symlinks=False)
+                            found.append(entry)
+                    except OSError:
+                        continue  # removed meanwhile
+                    if isdir and (max_depth is None or depth < max_depth):
+                        subdirs.append(entry.path)
+        return depth, found, subdirs
+
+    count = 0
+    pending = collections.deque([(top, 1)])  # directories to scan
+    running = set()
+    executor = threads.executor(workers)
+    try:
+        while pending or running:
+            if cancel and cancel.is_set():
+                return
+            # bound the directories whose results are held at once
+            while pending and len(running) < 2 * max(workers, 1):
+                running.add(executor.submit(scan, *pending.popleft()))
+            done, running = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                depth, found, subdirs = future.result()
+                pending.extend((subdir, depth + 1) for subdir in subdirs)
+                if max_results is not None:
+                    found = found[: max_results - count]
+                yield from found
+                count += len(found)
+                if max_results is not None and count >= max_results:
+                    return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,22 @@
+import concurrent.futures
+
+__all__ = ("InlineExecutor", "executor")
+
+
+class InlineExecutor(concurrent.futures.Executor):
+    """Executor running every call as it is submitted, in the calling thread."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+
+def executor(workers):
+    """A pool of given threads or, without any, an inline executor."""
+    if workers:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    return InlineExecutor()
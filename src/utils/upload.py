@@ -0,0 +1,161 @@
+import contextlib
+import errno
+import logging
+import os
+import secrets
+import stat
+import threading
+import time
+
+__all__ = ("DURABILITY", "write_file", "commit", "metrics")
+
+logger = logging.getLogger(__name__)
+
+# how uploads are made durable before they show: not at all (up to the
+# kernel), their data synced (fdatasync), or the file and its directory synced
+DURABILITY = ("none", "data", "full")
+
+# errors that mean hard links are not supported by the filesystem
+NO_LINKS = (errno.EPERM, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EXDEV)
+
+local = threading.local()  # buffer of each thread
+
+
+class Throughput:
+    """Files and bytes written by uploads, and the seconds spent writing them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, size, seconds):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def info(self):
+        """Usage metrics of uploads."""
+        with self.lock:
+            return {
+                "files": self.files,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+                "bytes_per_second": self.bytes / self.seconds if self.seconds else 0.0,
+            }
+
+
+def buffer(size):
+    """A buffer of given size, reused by the thread across uploads."""
+    buf = getattr(local, "buffer", None)
+    if buf is None or len(buf) != size:
+        buf = local.buffer = bytearray(size)
+    return memoryview(buf)
+
+
+def copy(stream, fd, bufsize):
+    """Copy a stream into a file descriptor, returning the bytes copied."""
+    view = buffer(bufsize)
+    readinto = getattr(stream, "readinto", None)
+    total = 0
+    while True:
+        if readinto is not None:
+            chunk = view[: readinto(view)]
+        else:
+            chunk = memoryview(stream.read(bufsize))
+        if not chunk:
+            return total
+        total += len(chunk)
+        while chunk:
+            chunk = chunk[os.write(fd, chunk) :]
+
+
+def sync(fd, durability):
+    if durability == "data":
+        os.fdatasync(fd)
+    elif durability == "full":
+        os.fsync(fd)
+
+
+def sync_dir(path, durability):
+    if durability == "full":
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def umask():
+    """The umask of the process, read from the kernel where it tells, as
+    setting it to read it back affects every thread."""
+    with contextlib.suppress(OSError, ValueError), open("/proc/self/status") as fd:
+        for line in fd:
+            if line.startswith("Umask:"):
+                return int(line.split()[1], 8)
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+def commit(src, dst, overwrite=False):
+    """Move a file into place at once. Unless overwriting, this fails when dst
+    exists, even when created meanwhile (through a hard link, if supported)."""
+    if overwrite:
+        os.replace(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except OSError as ex:
+        if ex.errno not in NO_LINKS:
+            raise
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+    else:
+        os.unlink(src)
+
+
+def write_file(path, stream, overwrite=False, durability="none", bufsize=1 << 20):
+    """Write a stream into a file, atomically: readers see either the file as
+    it was or the whole upload. Return the bytes written.
+
+    The stream is written into a temporary file next to the file, synced as
+    the durability policy says (see 'DURABILITY') and moved into place (see
+    'commit'). Overwritten files keep their permissions, and new files get
+    the default ones. A failed upload leaves no temporary file behind.
+    """
+    if durability not in DURABILITY:
+        raise ValueError(f"unsupported durability '{durability}'")
+    directory, name = os.path.split(path)
+    mode = 0o666  # less the umask
+    if overwrite:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    temp = os.path.join(directory, f".{name}.{secrets.token_hex(4)}.upload")
+    start = time.monotonic()
+    fd = os.open(
+        temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600 if overwrite else mode
+    )
+    try:
+        try:
+            size = copy(stream, fd, bufsize)
+            sync(fd, durability)
+        finally:
+            os.close(fd)
+        if overwrite:
+            os.chmod(temp, mode)
+        commit(temp, path, overwrite=overwrite)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp)  # unless moved into place
+    sync_dir(directory, durability)
+    seconds = time.monotonic() - start
+    metrics.add(size, seconds)
+    logger.debug(f"uploaded {path}: {size} bytes in {seconds:.3f}s")
+    return size
+
+
+# metrics of the uploads of the process
+metrics = Throughput()
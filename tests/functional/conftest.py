@@ -1,6 +1,7 @@
 import pytest
 
 from src.app import create_app
+from src.services import auth
 
 
 @pytest.fixture(scope="class")
@@ -22,3 +23,10 @@ def app():
 @pytest.fixture(scope="class")
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def backend(mocker):
+    """Requests are made as users that need not exist, so impersonating them
+    is left out."""
+    return mocker.patch.object(auth, "backend", mocker.Mock(per_thread=False))
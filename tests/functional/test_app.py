@@ -1,6 +1,7 @@
 import pytest
 
 from src.app import create_app
+from src.services import dircache, filesystem, jobs
 
 
 @pytest.fixture(scope="function")
@@ -23,6 +24,12 @@ class TestApp:
         """Ensure app is created."""
         assert app is not None
 
+    def test_services_are_configured(self, app):
+        """Ensure services take the settings of the app."""
+        assert filesystem.FilesystemSvc.copy_workers == app.config["COPY_WORKERS"]
+        assert jobs.manager.per_user == app.config["JOB_USER_LIMIT"]
+        assert (dircache.cache is not None) == app.config["DIR_CACHE"]
+
     def test_root_path_returns_200(self, client):
         response = client.get("/")
         assert response.status_code == 200
@@ -1,5 +1,13 @@
 import io
 import json
+import os
+import time
+import zipfile
+
+import pytest
+
+from src.services import archive, auth
+from src.utils import du
 
 
 class TestFileManagerActions:
@@ -21,6 +29,53 @@ class TestFileManagerActions:
         assert data["cwd"]["path"] == "/tmp"
         assert len(data["files"]) == 2
 
+    def test_read_action_with_version(self, client, fs):
+        fs.create_file("/tmp/file.txt")
+        payload = {"action": "read", "path": "/tmp", "showHiddenItems": False}
+        version = client.post("/file-manager/actions", json=payload).json["version"]
+        response = client.post(
+            "/file-manager/actions", json={**payload, "version": version}
+        )
+        assert response.json == {"version": version, "notModified": True}
+        fs.create_file("/tmp/other.txt")
+        os.utime("/tmp", ns=(0, 0))  # pyfakefs leaves directory times as they are
+        response = client.post(
+            "/file-manager/actions", json={**payload, "version": version}
+        )
+        assert response.json["version"] != version
+        assert len(response.json["files"]) == 2
+
+        version = response.json["version"]
+        with open("/tmp/file.txt", "w") as fd:
+            fd.write("text")  # the directory itself is left as it is
+        response = client.post(
+            "/file-manager/actions", json={**payload, "version": version}
+        )
+        assert response.json["version"] != version
+
+    def test_read_action_with_pages(self, client, fs):
+        for name in ("c.txt", "a.txt", "b.txt"):
+            fs.create_file(f"/tmp/{name}")
+        payload = {"action": "read", "path": "/tmp", "showHiddenItems": False}
+        response = client.post(
+            "/file-manager/actions", json={**payload, "limit": 2, "order": "desc"}
+        )
+        assert [file["name"] for file in response.json["files"]] == ["c.txt", "b.txt"]
+        cursor = response.json["cursor"]
+        response = client.post(
+            "/file-manager/actions",
+            json={**payload, "limit": 2, "order": "desc", "cursor": cursor},
+        )
+        assert [file["name"] for file in response.json["files"]] == ["a.txt"]
+        assert response.json["cursor"] is None
+        fs.create_file("/tmp/d.txt")
+        os.utime("/tmp", ns=(0, 0))  # pyfakefs leaves directory times as they are
+        response = client.post(
+            "/file-manager/actions",
+            json={**payload, "limit": 2, "order": "desc", "cursor": cursor},
+        )
+        assert response.json["error"]["code"] == 409
+
     def test_create_action(self, client, fs):
         fs.create_dir("/tmp")
         response = client.post(
@@ -118,6 +173,39 @@ class TestFileManagerActions:
         assert any(file["path"] == "/tmp/file1.txt" for file in data["files"]) is True
         assert any(file["path"] == "/tmp/.file2.txt" for file in data["files"]) is True
 
+    def test_search_action_in_subdirectories(self, client, fs):
+        fs.create_file("/tmp/File1.txt")
+        fs.create_file("/tmp/dir/sub/file2.txt")
+        fs.create_file("/tmp/dir/other.txt")
+        payload = {
+            "action": "search",
+            "path": "/tmp",
+            "showHiddenItems": False,
+            "caseSensitive": False,
+            "searchString": "*file*",
+            "data": [],
+        }
+        response = client.post("/file-manager/actions", json=payload)
+        assert response.status_code == 200
+        assert response.json["cwd"]["path"] == "/tmp"
+        paths = sorted(file["path"] for file in response.json["files"])
+        assert paths == ["/tmp/File1.txt", "/tmp/dir/sub/file2.txt"]
+        response = client.post(
+            "/file-manager/actions",
+            json={**payload, "caseSensitive": True, "maxDepth": 1},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert response.mimetype == "application/x-ndjson"
+        assert response.data.count(b"\n") == 0
+        response = client.post(
+            "/file-manager/actions", json={**payload, "maxResults": 1}
+        )
+        assert len(response.json["files"]) == 1
+        response = client.post(
+            "/file-manager/actions", json={**payload, "path": "/missing"}
+        )
+        assert response.json["error"]["code"] == 404
+
     def test_file_details_action(self, client, fs):
         fs.create_file("/tmp/file.txt")
         response = client.post(
@@ -151,6 +239,19 @@ class TestFileManagerActions:
         assert data["details"]["multipleFiles"] is False
         assert data["details"]["size"] == "0 B"
 
+    def test_dir_details_action_sums_content(self, client, fs):
+        du.cache.invalidate()
+        fs.create_file("/tmp/dir/file.txt", contents="x" * 1024)
+        fs.create_file("/tmp/dir/sub/file.txt", contents="x" * 2048)
+        payload = {"action": "details", "path": "/tmp", "names": ["dir"], "data": []}
+        response = client.post("/file-manager/actions", json=payload)
+        assert response.json["details"]["size"] == "3 KB"
+        assert response.json["details"]["computing"] is False
+        response = client.post(
+            "/file-manager/actions", json={**payload, "names": ["dir", "dir"]}
+        )
+        assert response.json["details"]["size"] == "6 KB"
+
     def test_multiple_files_details_action(self, client, fs):
         fs.create_dir("/tmp/dir")
         fs.create_dir("/tmp/file.txt")
@@ -281,6 +382,80 @@ class TestFileManagerActions:
         assert data["error"]["message"] == "Permission Denied"
 
 
+class TestFileManagerStats:
+    def test_bulk_stats(self, client, fs):
+        fs.create_file("/tmp/file.txt", contents="text")
+        fs.create_dir("/tmp/dir")
+        paths = ["/tmp/file.txt", "/tmp/missing", "/tmp/dir"]
+        response = client.post("/file-manager/stats", json={"paths": paths})
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert [result["path"] for result in results] == paths
+        assert results[0]["stats"]["size"] == 4
+        assert results[1]["error"]["code"] == 404
+        assert "stats" not in results[1]
+        assert results[2]["stats"]["isFile"] is False
+
+    def test_bulk_stats_without_paths_returns_400(self, client):
+        response = client.post("/file-manager/stats", json={"paths": []})
+        assert response.status_code == 400
+
+
+class TestFileManagerBatch:
+    def test_batch_runs_actions_in_order(self, client, fs):
+        actions = [
+            {"action": "create", "path": "/tmp", "name": "dir"},
+            {"action": "rename", "path": "/tmp", "name": "dir", "newName": "new"},
+        ]
+        response = client.post("/file-manager/batch", json={"actions": actions})
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert results[0]["files"][0]["name"] == "dir"
+        assert results[1]["files"][0]["name"] == "new"
+        assert os.path.isdir("/tmp/new")
+
+    def test_batch_stops_on_error(self, client, fs):
+        actions = [
+            {"action": "delete", "path": "/tmp", "names": ["missing"]},
+            {"action": "create", "path": "/tmp", "name": "dir"},
+        ]
+        response = client.post("/file-manager/batch", json={"actions": actions})
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert results[0]["error"]["code"] == 404
+        assert results[1]["error"]["code"] == 424
+        assert not os.path.exists("/tmp/dir")
+
+    @pytest.mark.parametrize("per_thread", (False, True))
+    def test_batch_continues_on_error(self, client, fs, mocker, per_thread):
+        mocker.patch.object(auth, "backend", mocker.Mock(per_thread=per_thread))
+        actions = [
+            {"action": "delete", "path": "/tmp", "names": ["missing"]},
+            {"action": "create", "path": "/tmp", "name": "dir1"},
+            {"action": "create", "path": "/tmp", "name": "dir2"},
+            {"action": "rename", "path": "/tmp", "name": "dir1", "newName": "dir3"},
+            {"action": "read", "path": "/tmp"},
+        ]
+        response = client.post(
+            "/file-manager/batch", json={"actions": actions, "mode": "continue"}
+        )
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert results[0]["error"]["code"] == 404
+        assert results[3]["files"][0]["name"] == "dir3"
+        assert results[4]["error"]["code"] == 400  # not a batch action
+        assert sorted(os.listdir("/tmp")) == ["dir2", "dir3"]
+
+    def test_batch_without_actions_returns_400(self, client):
+        response = client.post("/file-manager/batch", json={"actions": []})
+        assert response.status_code == 400
+        response = client.post(
+            "/file-manager/batch",
+            json={"actions": [{"action": "create"}], "mode": "whatever"},
+        )
+        assert response.status_code == 400
+
+
 class TestFileManagerDownload:
     def test_single_file_download_action(self, client, fs):
         fs.create_file("/tmp/file.txt")
@@ -325,6 +500,49 @@ class TestFileManagerDownload:
         assert headers["Content-Disposition"] == "attachment; filename=files.tar.gz"
         assert headers["Content-Type"] == "application/gzip"
 
+    def test_zip_download_action(self, client, fs):
+        fs.create_file("/tmp/file1.txt", contents="text")
+        fs.create_file("/tmp/file2.jpg")
+        response = client.post(
+            "/file-manager/download",
+            data={
+                "downloadInput": json.dumps(
+                    {
+                        "action": "download",
+                        "path": "/tmp",
+                        "names": ["file1.txt", "file2.jpg"],
+                        "data": [],
+                    }
+                ),
+                "format": "zip",
+            },
+        )
+        headers = response.headers
+        assert response.status_code == 200
+        assert headers["Content-Disposition"] == "attachment; filename=files.zip"
+        assert headers["Content-Type"] == "application/zip"
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip:
+            assert zip.namelist() == ["file1.txt", "file2.jpg"]
+
+    def test_cached_download_action(self, client, fs, mocker):
+        mocker.patch.object(archive, "cache", archive.ArchiveCache("/cache"))
+        fs.create_file("/tmp/dir/file.txt", contents="text")
+        data = {
+            "downloadInput": json.dumps(
+                {"action": "download", "path": "/tmp", "names": ["dir"], "data": []}
+            ),
+        }
+        response = client.post("/file-manager/download", data=data)
+        content = response.data
+        etag = response.headers["ETag"]
+        assert response.status_code == 200
+        assert len(os.listdir("/cache")) == 1
+
+        response = client.post("/file-manager/download", data=data)
+        assert response.status_code == 200
+        assert response.headers["ETag"] == etag
+        assert response.data == content
+
     def test_missing_path_raises_404(self, client, fs):
         fs.create_dir("/tmp")
         response = client.post(
@@ -362,6 +580,135 @@ class TestFileManagerUpload:
         with open("/tmp/file.txt") as fd:
             assert fd.read() == "text"
 
+    def test_chunked_file_upload_action(self, client, fs):
+        fs.create_dir("/data")
+        for index, chunk in enumerate((b"abc", b"def", b"g")):
+            response = client.post(
+                "/file-manager/upload",
+                data={
+                    "action": "save",
+                    "path": "/data",
+                    "chunk-index": index,
+                    "total-chunk": 3,
+                    "uploadFiles": (io.BytesIO(chunk), "file.txt"),
+                },
+                content_type="multipart/form-data",
+            )
+            assert response.status_code == 200
+            assert response.json["offset"] == 3 * index + len(chunk)
+            if index < 2:
+                assert fs.exists("/data/file.txt") is False
+        with open("/data/file.txt") as fd:
+            assert fd.read() == "abcdefg"
+        assert fs.exists("/data/.file.txt.part") is False
+        umask = os.umask(0o022)
+        os.umask(umask)
+        assert os.stat("/data/file.txt").st_mode & 0o777 == 0o666 & ~umask
+
+        # the reply to the last chunk got lost, so it is sent again
+        response = client.post(
+            "/file-manager/upload",
+            data={
+                "action": "save",
+                "path": "/data",
+                "chunk-index": 2,
+                "total-chunk": 3,
+                "uploadFiles": (io.BytesIO(b"g"), "file.txt"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 200
+        assert response.json["offset"] == 7
+        with open("/data/file.txt") as fd:
+            assert fd.read() == "abcdefg"
+
+        # and the upload shows as done until it expires
+        response = client.post(
+            "/file-manager/upload",
+            data={"action": "status", "path": "/data", "filename": "file.txt"},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 200
+        assert response.json["offset"] == 7
+
+    def test_chunk_sent_again_is_not_written_twice(self, client, fs):
+        fs.create_dir("/data")
+        for index, chunk in ((0, b"abc"), (1, b"def"), (1, b"def"), (2, b"g")):
+            response = client.post(
+                "/file-manager/upload",
+                data={
+                    "action": "save",
+                    "path": "/data",
+                    "chunk-index": index,
+                    "total-chunk": 3,
+                    "uploadFiles": (io.BytesIO(chunk), "file.txt"),
+                },
+                content_type="multipart/form-data",
+            )
+            assert response.status_code == 200
+        with open("/data/file.txt") as fd:
+            assert fd.read() == "abcdefg"
+
+    def test_chunk_out_of_place_raises_400(self, client, fs):
+        fs.create_file("/data/.file.txt.part", contents="abcdef")
+        fs.create_file("/data/.file.txt.upload", contents='{"chunkSize": 3}')
+        response = client.post(
+            "/file-manager/upload",
+            data={
+                "action": "save",
+                "path": "/data",
+                "chunk-index": 1,
+                "total-chunk": 3,
+                "uploadFiles": (io.BytesIO(b"xy"), "file.txt"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 400
+        with open("/data/.file.txt.part") as fd:
+            assert fd.read() == "abcdef"
+
+    @pytest.mark.parametrize("index", (-1, 3))
+    def test_chunk_index_out_of_range_raises_400(self, client, fs, index):
+        fs.create_dir("/data")
+        response = client.post(
+            "/file-manager/upload",
+            data={
+                "action": "save",
+                "path": "/data",
+                "chunk-index": index,
+                "total-chunk": 3,
+                "uploadFiles": (io.BytesIO(b"abc"), "file.txt"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 400
+        assert fs.exists("/data/.file.txt.part") is False
+
+    def test_resume_chunked_file_upload_action(self, client, fs):
+        fs.create_file("/data/.file.txt.part", contents="abc")
+        response = client.post(
+            "/file-manager/upload",
+            data={"action": "status", "path": "/data", "filename": "file.txt"},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 200
+        assert response.json["offset"] == 3
+
+        response = client.post(
+            "/file-manager/upload",
+            data={
+                "action": "save",
+                "path": "/data",
+                "chunk-index": 2,
+                "total-chunk": 3,
+                "chunk-size": 3,
+                "uploadFiles": (io.BytesIO(b"g"), "file.txt"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 400
+        assert "missing chunks" in response.json["message"]
+
     def test_missing_path_raises_404(self, client, fs):
         fs.create_dir("/tmp")
         response = client.post(
@@ -378,6 +725,99 @@ class TestFileManagerUpload:
         assert response.json == {"code": 404, "reason": "Not Found", "message": ""}
 
 
+class TestFileManagerJobs:
+    @pytest.fixture(autouse=True)
+    def thread_credentials(self, mocker):
+        mocker.patch.object(auth, "backend", mocker.Mock(per_thread=True))
+
+    @staticmethod
+    def wait(client, job_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = client.get(f"/file-manager/jobs/{job_id}").json
+            if data["status"] not in ("pending", "running"):
+                return data
+            time.sleep(0.01)
+
+    def test_copy_job(self, client, fs):
+        fs.create_file("/tmp/dir/file.txt", contents="text")
+        fs.create_dir("/dst")
+        response = client.post(
+            "/file-manager/jobs",
+            json={
+                "action": "copy",
+                "path": "/tmp",
+                "names": ["dir"],
+                "targetPath": "/dst",
+            },
+        )
+        assert response.status_code == 202
+        data = self.wait(client, response.json["id"])
+        assert data["status"] == "done"
+        assert (data["filesDone"], data["bytesDone"]) == (1, 4)
+        response = client.get(f"/file-manager/jobs/{data['id']}/result")
+        assert response.status_code == 200
+        assert response.json["files"][0]["path"] == "/dst/dir"
+        assert fs.exists("/dst/dir/file.txt")
+
+    def test_copy_job_with_fixed_credentials(self, client, fs, mocker):
+        mocker.patch.object(auth, "backend", auth.FixedCredentials(None))
+        fs.create_file("/tmp/dir/file.txt", contents="text")
+        fs.create_dir("/dst")
+        response = client.post(
+            "/file-manager/jobs",
+            json={
+                "action": "copy",
+                "path": "/tmp",
+                "names": ["dir"],
+                "targetPath": "/dst",
+            },
+        )
+        data = self.wait(client, response.json["id"])
+        assert data["status"] == "done", data["error"]
+
+    def test_archive_job(self, client, fs):
+        fs.create_file("/tmp/dir/file.txt", contents="text")
+        response = client.post(
+            "/file-manager/jobs",
+            json={"action": "archive", "path": "/tmp", "names": ["dir"]},
+        )
+        data = self.wait(client, response.json["id"])
+        assert data["status"] == "done"
+        response = client.get(f"/file-manager/jobs/{data['id']}/result")
+        headers = response.headers
+        assert response.status_code == 200
+        assert headers["Content-Disposition"] == "attachment; filename=dir.tar.gz"
+        assert headers["Content-Type"] == "application/gzip"
+
+    def test_missing_target_path_raises_400(self, client, fs):
+        response = client.post(
+            "/file-manager/jobs",
+            json={"action": "move", "path": "/tmp", "names": ["dir"]},
+        )
+        assert response.status_code == 400
+
+    def test_jobs_need_thread_credentials(self, client, fs, mocker):
+        mocker.patch.object(auth, "backend", auth.ProcessCredentials())
+        response = client.post(
+            "/file-manager/jobs",
+            json={"action": "delete", "path": "/tmp", "names": ["dir"]},
+        )
+        assert response.status_code == 501
+
+    def test_unknown_job_raises_404(self, client, fs):
+        assert client.get("/file-manager/jobs/unknown").status_code == 404
+        assert client.delete("/file-manager/jobs/unknown").status_code == 404
+
+
+class TestFileManagerMetrics:
+    def test_metrics(self, client):
+        response = client.get("/file-manager/metrics")
+        assert response.status_code == 200
+        assert "bytes_per_second" in response.json["uploads"]
+        assert {"users", "sizes"} <= set(response.json["caches"])
+
+
 class TestFileManagerImages:
     def test_get_image(self, client, fs):
         fs.create_file("/tmp/img.jpeg")
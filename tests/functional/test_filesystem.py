@@ -1,8 +1,13 @@
+import gzip
 import io
+import json
+import os
+import tarfile
 from base64 import b64encode
 
 import pytest
 
+from src.services import archive
 from src.services.auth import AuthSvc
 
 
@@ -17,12 +22,83 @@ class TestFilesystemGET:
         response = client.get("/tmp", headers={})
         assert response.status_code == 401
 
+    def test_unknown_user_throws_401(self, client, auth, backend):
+        backend.assume.side_effect = KeyError("user")
+        response = client.get("/tmp", headers=auth)
+        assert response.status_code == 401
+
     def test_valid_path_returns_200(self, client, auth, fs):
         fs.create_file("/tmp/file.txt")
         response = client.get("/tmp/", headers=auth)
         assert response.status_code == 200
         assert response.json == ["file.txt"]
 
+    def test_ndjson_listing_returns_200(self, client, auth, fs):
+        fs.create_file("/tmp/file.txt", contents="text")
+        fs.create_dir("/tmp/dir")
+        headers = {**auth, "accept": "application/x-ndjson"}
+        response = client.get("/tmp/?stat=true", headers=headers)
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        records = sorted(
+            (json.loads(line) for line in response.data.splitlines()),
+            key=lambda record: record["name"],
+        )
+        assert [(r["name"], r["size"], r["isDir"]) for r in records] == [
+            ("dir", records[0]["size"], True),
+            ("file.txt", 4, False),
+        ]
+
+    def test_unchanged_listing_returns_304(self, client, auth, fs):
+        fs.create_file("/tmp/file.txt")
+        etag = client.get("/tmp/", headers=auth).headers["ETag"]
+        response = client.get("/tmp/", headers={**auth, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.data == b""
+        fs.create_file("/tmp/other.txt")
+        os.utime("/tmp", ns=(0, 0))  # pyfakefs leaves directory times as they are
+        response = client.get("/tmp/", headers={**auth, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_changed_stats_listing_returns_200(self, client, auth, fs):
+        fs.create_file("/tmp/file.txt")
+        etag = client.get("/tmp/?stat=true", headers=auth).headers["ETag"]
+        with open("/tmp/file.txt", "w") as fd:
+            fd.write("text")  # the directory itself is left as it is
+        headers = {**auth, "If-None-Match": etag}
+        response = client.get("/tmp/?stat=true", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_paginated_listing_returns_200(self, client, auth, fs):
+        for size, name in enumerate(("c.txt", "a.txt", "b.txt")):
+            fs.create_file(f"/tmp/{name}", contents="x" * size)
+        response = client.get("/tmp/?limit=2", headers=auth)
+        assert response.status_code == 200
+        assert response.json == ["a.txt", "b.txt"]
+        url = response.headers["Link"].partition(">")[0].lstrip("<")
+        response = client.get(url, headers=auth)
+        assert response.json == ["c.txt"]
+        assert "Link" not in response.headers
+        response = client.get("/tmp/?sortBy=size&order=desc", headers=auth)
+        assert response.json == ["b.txt", "a.txt", "c.txt"]
+        response = client.get("/tmp/?limit=0", headers=auth)
+        assert response.status_code == 400
+        response = client.get("/tmp/?sortBy=mode", headers=auth)
+        assert response.status_code == 400
+
+    def test_stale_cursor_returns_409(self, client, auth, fs):
+        fs.create_file("/tmp/a.txt")
+        fs.create_file("/tmp/b.txt")
+        response = client.get("/tmp/?limit=1", headers=auth)
+        url = response.headers["Link"].partition(">")[0].lstrip("<")
+        fs.create_file("/tmp/c.txt")
+        os.utime("/tmp", ns=(0, 0))  # pyfakefs leaves directory times as they are
+        response = client.get(url, headers=auth)
+        assert response.status_code == 409
+
     def test_permission_denied_returns_403(self, client, auth, fs):
         fs.create_dir("/tmp/root", perm_bits=000)
         response = client.get("/tmp/root/", headers=auth)
@@ -61,6 +137,30 @@ class TestFilesystemGET:
         )
         assert response.headers["Content-Type"] == "application/gzip"
 
+    def test_directory_attachment_in_accepted_format_returns_200(
+        self, client, auth, fs
+    ):
+        fs.create_file("/tmp/dir/file.txt")
+        headers = {**auth, "accept": "application/zip, application/gzip;q=0.5"}
+        response = client.get("/tmp/dir/", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["Content-Disposition"] == "attachment; filename=dir.zip"
+        assert response.headers["Content-Type"] == "application/zip"
+
+    def test_cached_directory_attachment_returns_206(self, client, auth, fs, mocker):
+        mocker.patch.object(archive, "cache", archive.ArchiveCache("/cache"))
+        fs.create_file("/tmp/dir/file.txt", contents="text")
+        headers = {**auth, "accept": "application/octet-stream"}
+        response = client.get("/tmp/dir/", headers=headers)
+        content = response.data
+        etag = response.headers["ETag"]
+
+        response = client.get("/tmp/dir/", headers={**headers, "Range": "bytes=0-9"})
+        assert response.status_code == 206
+        assert response.data == content[:10]
+        response = client.get("/tmp/dir/", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+
     def test_unsupported_accept_header_path_returns_400(self, client, auth):
         headers = {**auth, "accept": "text/html"}
         response = client.get("/tmp/", headers=headers)
@@ -86,6 +186,75 @@ class TestFilesystemPOST:
         with open("/tmp/file.txt") as fd:
             assert fd.read() == "text"
 
+    def test_many_files_returns_201(self, client, auth, fs):
+        files = [(io.BytesIO(f"text{i}".encode()), f"file{i}.txt") for i in range(20)]
+        response = client.post(
+            "/tmp/",
+            headers=auth,
+            data={"files": files},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 201
+        assert len(os.listdir("/tmp")) == 20
+        with open("/tmp/file7.txt") as fd:
+            assert fd.read() == "text7"
+
+    def test_archive_returns_201(self, client, auth, fs):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            for i in range(20):
+                info = tarfile.TarInfo(f"dir/file{i}.txt")
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"text"))
+        response = client.post(
+            "/tmp/",
+            headers=auth,
+            data=buffer.getvalue(),
+            content_type="application/gzip",
+        )
+        assert response.status_code == 201
+        assert len(os.listdir("/tmp/dir")) == 20
+        with open("/tmp/dir/file7.txt") as fd:
+            assert fd.read() == "text"
+
+    def test_archive_outside_path_returns_400(self, client, auth, fs):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            info = tarfile.TarInfo("../evil.txt")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+        fs.create_dir("/tmp/dir")
+        response = client.post(
+            "/tmp/dir/",
+            headers=auth,
+            data=buffer.getvalue(),
+            content_type="application/x-tar",
+        )
+        assert response.status_code == 400
+        assert not os.path.exists("/tmp/evil.txt")
+
+    @pytest.mark.parametrize("fmt", ("tar.gz", "tar.zst"))
+    def test_truncated_archive_returns_400(self, client, auth, fs, fmt):
+        if fmt == "tar.zst":
+            zstandard = pytest.importorskip("zstandard")
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            info = tarfile.TarInfo("file.txt")
+            info.size = 4096
+            tar.addfile(info, io.BytesIO(os.urandom(4096)))
+        if fmt == "tar.zst":
+            data = zstandard.ZstdCompressor().compress(buffer.getvalue())
+        else:
+            data = gzip.compress(buffer.getvalue())
+        response = client.post(
+            "/tmp/",
+            headers=auth,
+            data=data[: len(data) // 2],
+            content_type=archive.FORMATS[fmt],
+        )
+        assert response.status_code == 400
+        assert "invalid archive" in response.json["message"]
+
     def test_missing_path_returns_400(self, client, auth, fs):
         fs.create_dir("/tmp")
         response = client.post(
@@ -0,0 +1,18 @@
+import os
+import pathlib
+import shutil
+import tempfile
+
+import pytest
+
+
+@pytest.fixture()
+def nobody_dir():
+    """A directory any user reaches, where services run as 'nobody', which
+    takes root."""
+    if os.geteuid() != 0:
+        pytest.skip("requires root")
+    path = pathlib.Path(tempfile.mkdtemp())
+    path.chmod(0o777)
+    yield path
+    shutil.rmtree(path)
@@ -0,0 +1,186 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+from src.services import archive
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    root = tmp_path / "dir"
+    (root / "sub").mkdir(parents=True)
+    (root / "file.txt").write_bytes(b"text" * 1000)
+    (root / "sub" / "image.jpg").write_bytes(os.urandom(4096))
+    return root
+
+
+NAMES = ["dir", "dir/file.txt", "dir/sub", "dir/sub/image.jpg"]
+
+
+@pytest.mark.parametrize("fmt", ("tar", "tar.gz"))
+def test_tar_chunks(tree, fmt):
+    data = b"".join(archive.chunks([str(tree)], fmt, bufsize=1024))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == NAMES
+        assert tar.extractfile("dir/file.txt").read() == b"text" * 1000
+
+
+def test_tar_zst_chunks(tree):
+    zstandard = pytest.importorskip("zstandard")
+    data = b"".join(archive.chunks([str(tree)], "tar.zst", bufsize=1024))
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        assert [member.name for member in tar] == NAMES
+
+
+def test_zip_chunks_store_compressed_files(tree):
+    data = b"".join(archive.chunks([str(tree)], "zip", bufsize=1024))
+    with zipfile.ZipFile(io.BytesIO(data)) as zip:
+        assert zip.namelist() == [
+            "dir/",
+            "dir/file.txt",
+            "dir/sub/",
+            "dir/sub/image.jpg",
+        ]
+        assert zip.getinfo("dir/file.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zip.getinfo("dir/sub/image.jpg").compress_type == zipfile.ZIP_STORED
+        assert zip.read("dir/file.txt") == b"text" * 1000
+
+
+def test_unsupported_format_raises_exception(tree):
+    with pytest.raises(ValueError):
+        list(archive.chunks([str(tree)], "rar"))
+
+
+def write(path, fileobj):
+    with open(path, "xb") as file:
+        file.write(fileobj.read())
+
+
+def tar_of(*members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("workers", (0, 4))
+@pytest.mark.parametrize("fmt", ("tar", "tar.gz"))
+def test_extract(tree, tmp_path, mocker, fmt, workers):
+    mocker.patch.object(archive, "SMALL_MEMBER", 4050)  # image.jpg is large
+    data = b"".join(archive.chunks([str(tree)], fmt))
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    count = archive.extract(
+        io.BytesIO(data), str(dst), write=write, fmt=fmt, workers=workers
+    )
+    assert count == 2
+    assert (dst / "dir" / "file.txt").read_bytes() == b"text" * 1000
+    assert (dst / "dir" / "sub" / "image.jpg").read_bytes() == (
+        tree / "sub" / "image.jpg"
+    ).read_bytes()
+
+
+@pytest.mark.parametrize("name", ("../evil.txt", "/tmp/evil.txt", "dir/../../x"))
+def test_extract_refuses_paths_outside(tmp_path, name):
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    with pytest.raises(ValueError):
+        archive.extract(tar_of((name, b"evil")), str(dst), write=write)
+    assert not (tmp_path / "evil.txt").exists()
+
+
+def test_extract_refuses_symbolic_links_outside(tmp_path):
+    dst = tmp_path / "dst"
+    dst.mkdir()
+    (tmp_path / "outside").mkdir()
+    (dst / "link").symlink_to(tmp_path / "outside")
+    with pytest.raises(ValueError):
+        archive.extract(tar_of(("link/evil.txt", b"evil")), str(dst), write=write)
+    assert os.listdir(tmp_path / "outside") == []
+
+
+def test_extract_skips_links(tmp_path):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        info = tarfile.TarInfo("link")
+        info.type = tarfile.SYMTYPE
+        info.linkname = "/etc/passwd"
+        tar.addfile(info)
+    buffer.seek(0)
+    assert archive.extract(buffer, str(tmp_path), write=write) == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_extract_invalid_archive_raises_exception(tmp_path):
+    with pytest.raises(ValueError):
+        archive.extract(io.BytesIO(b"garbage" * 100), str(tmp_path), write=write)
+
+
+def test_extract_stops_at_first_error(tmp_path):
+    (tmp_path / "b.txt").write_bytes(b"old")
+    members = [(f"{name}.txt", b"new") for name in "abc"]
+    with pytest.raises(FileExistsError):
+        archive.extract(tar_of(*members), str(tmp_path), write=write, workers=1)
+    assert (tmp_path / "b.txt").read_bytes() == b"old"
+
+
+def test_accepted_formats():
+    accept = MIMEAccept([("application/gzip", 0.5), ("application/zip", 1)])
+    assert archive.accepted_formats(accept) == ["zip", "tar.gz"]
+    assert archive.accepted_formats(MIMEAccept([("*/*", 1)])) == []
+
+
+def test_choose_format(tree, mocker):
+    mocker.patch.object(archive, "zstandard", None)
+    paths = [str(tree)]
+    assert archive.choose_format(paths, ["zip"]) == "zip"
+    assert archive.choose_format(paths, [], policy="tar") == "tar"
+    assert archive.choose_format(paths, ["zip", "tar"], policy="tar.gz") == "zip"
+    assert archive.choose_format(paths, ["tar.zst"], policy="tar") == "tar"
+    assert archive.choose_format(paths, [], policy="auto") == "tar.gz"
+    (tree / "file.txt").unlink()  # mostly compressed content then
+    assert archive.choose_format(paths, [], policy="auto") == "zip"
+    assert archive.choose_format(paths, ["tar.gz", "tar"], policy="auto") == "tar"
+
+
+def test_fingerprint_changes_with_content(tree):
+    key = archive.fingerprint([str(tree)], "user", "zip")
+    assert key == archive.fingerprint([str(tree)], "user", "zip")
+    assert key != archive.fingerprint([str(tree)], "other", "zip")
+    (tree / "sub" / "new.txt").touch()
+    assert key != archive.fingerprint([str(tree)], "user", "zip")
+
+
+def test_archive_cache(tmp_path):
+    cache = archive.ArchiveCache(str(tmp_path / "cache"), maxsize=10)
+    assert cache.lookup("key") is None
+    assert list(cache.tee("key", (b"abc", b"def"))) == [b"abc", b"def"]
+    with open(cache.lookup("key"), "rb") as file:
+        assert file.read() == b"abcdef"
+
+
+def test_archive_cache_skips_incomplete_archives(tmp_path):
+    cache = archive.ArchiveCache(str(tmp_path / "cache"))
+    chunks = cache.tee("key", (b"abc", b"def"))
+    next(chunks)
+    chunks.close()
+    assert cache.lookup("key") is None
+    assert os.listdir(tmp_path / "cache") == []
+
+
+def test_archive_cache_evicts_least_recently_used(tmp_path):
+    cache = archive.ArchiveCache(str(tmp_path / "cache"), maxsize=10)
+    cache.store("old", b"x" * 6)
+    os.utime(cache.path("old"), (0, 0))
+    cache.store("new", b"x" * 6)
+    assert cache.lookup("old") is None
+    assert cache.lookup("new") is not None
@@ -1,23 +1,136 @@
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import threading
+
 import pytest
 
-from src.services.auth import impersonate
+from src.services.auth import (
+    FixedCredentials,
+    ThreadCredentials,
+    impersonate,
+    thread_ctx,
+    user_ctx,
+)
 
 
 def test_impersonate(mocker):
 
-    mocker.patch("os.setuid")
-    mocker.patch("os.setgid")
+    mocker.patch("os.seteuid")
+    mocker.patch("os.setegid")
 
     @impersonate(username="test")
     def decorated_test():
         pass
 
     mocker.patch("src.utils.user_uid", side_effect=KeyError)
-    decorated_test()  # KeyError was suppressed
-    mocker.patch("src.utils.user_uid", side_effect=TypeError)
-    decorated_test()  # TypeError was suppressed
-    mocker.patch("src.utils.user_uid", side_effect=PermissionError)
-    decorated_test()  # PermissionError was suppressed
-    mocker.patch("src.utils.user_uid", side_effect=Exception)
-    with pytest.raises(Exception):
-        decorated_test()  # no other exception is suppressed
+    with pytest.raises(KeyError):
+        decorated_test()  # the user is unknown
+    mocker.patch("src.utils.user_uid", return_value=1000)
+    mocker.patch("src.utils.user_gid", return_value=1000)
+    mocker.patch("os.seteuid", side_effect=PermissionError)
+    with pytest.raises(PermissionError):
+        decorated_test()  # the privileges are missing
+
+
+def test_impersonate_generator(mocker):
+    ctx = mocker.patch("src.utils.user_uid", return_value=0)
+    mocker.patch("src.utils.user_gid", return_value=0)
+    mocker.patch("os.seteuid")
+    mocker.patch("os.setegid")
+
+    @impersonate(username="test")
+    def decorated_test():
+        yield 1
+        yield 2
+
+    gen = decorated_test()
+    assert ctx.call_count == 0  # nothing runs until iterated
+    assert list(gen) == [1, 2]
+    assert ctx.call_count == 4  # one context per step, plus closing
+
+
+def test_user_ctx_is_reentrant(mocker):
+    lookup = mocker.patch("src.utils.user_uid", return_value=1000)
+    mocker.patch("src.utils.user_gid", return_value=1000)
+    seteuid = mocker.patch("os.seteuid")
+    mocker.patch("os.setegid")
+    mocker.patch("os.geteuid", return_value=0)
+    mocker.patch("os.getegid", return_value=0)
+
+    @impersonate(username="test")
+    def decorated_test():
+        pass
+
+    with user_ctx("test"):
+        decorated_test()
+        decorated_test()
+    assert lookup.call_count == 1  # nested calls reuse the outer context
+    seteuid.assert_called_once_with(1000)
+
+    with user_ctx("test"), user_ctx("other"):
+        pass
+    assert lookup.call_count == 4  # switched to 'other' and back to 'test'
+
+
+def test_thread_ctx_shares_process_credentials(mocker):
+    mocker.patch("src.utils.user_uid", return_value=1000)
+    mocker.patch("src.utils.user_gid", return_value=1000)
+    seteuid = mocker.patch("os.seteuid")
+    mocker.patch("os.setegid")
+
+    @impersonate(username="test")
+    def decorated_test():
+        pass
+
+    def work():
+        with thread_ctx("test"):
+            decorated_test()  # as the caller, already
+
+    with user_ctx("test"):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    seteuid.assert_called_once_with(1000)  # by the caller only
+
+
+@pytest.mark.skipif(
+    sys.platform != "linux" or os.geteuid() != 0, reason="requires root on Linux"
+)
+def test_thread_credentials():
+    credentials = ThreadCredentials()
+    tmp_path = pathlib.Path(tempfile.mkdtemp())  # reachable by any user
+    owners = {}
+
+    def create_file(name, uid):
+        try:
+            credentials.set_ids(uid, uid, [uid])
+            (tmp_path / name).touch()
+        finally:
+            credentials.restore()
+        owners[name] = os.stat(tmp_path / name).st_uid
+
+    tmp_path.chmod(0o777)
+    thread = threading.Thread(target=create_file, args=("user.txt", 65534))
+    thread.start()
+    thread.join()
+    (tmp_path / "root.txt").touch()  # the main thread is not affected
+    assert owners["user.txt"] == 65534
+    assert os.stat(tmp_path / "root.txt").st_uid == 0
+    shutil.rmtree(tmp_path)
+
+
+def test_thread_credentials_on_unknown_machine(mocker):
+    mocker.patch("platform.machine", return_value="unknown")
+    with pytest.raises(OSError):
+        ThreadCredentials()
+
+
+def test_fixed_credentials():
+    credentials = FixedCredentials("user")
+    credentials.restore()
+    credentials.assume("user")
+    with pytest.raises(PermissionError):
+        credentials.assume("other")
@@ -0,0 +1,74 @@
+import pytest
+
+from src.utils.cache import TTLCache
+
+
+def test_get_or_set(mocker):
+    cache = TTLCache(maxsize=2)
+    func = mocker.Mock(return_value="value")
+    assert cache.get_or_set("key", func) == "value"
+    assert cache.get_or_set("key", func) == "value"
+    assert func.call_count == 1
+    assert cache.info()["hits"] == 1
+    assert cache.info()["misses"] == 1
+    assert cache.info()["hit_rate"] == 0.5
+
+
+def test_get():
+    cache = TTLCache()
+    assert cache.get("key") is None
+    assert cache.get("key", default=0) == 0
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    cache.set("missing", error=KeyError("missing"))
+    with pytest.raises(KeyError):
+        cache.get("missing")
+
+
+def test_entries_expire(mocker):
+    cache = TTLCache(ttl=10)
+    clock = mocker.patch("time.monotonic", return_value=0)
+    func = mocker.Mock(return_value="value")
+    cache.get_or_set("key", func)
+    clock.return_value = 11
+    cache.get_or_set("key", func)
+    assert func.call_count == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get_or_set("a", lambda: None)  # refresh 'a'
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get_or_set("b", lambda: "new") == "new"
+    assert cache.info()["evictions"] == 2
+
+
+def test_negative_caching(mocker):
+    cache = TTLCache(negative=(KeyError,))
+    func = mocker.Mock(side_effect=KeyError("missing"))
+    errors = []
+    for _ in range(2):
+        with pytest.raises(KeyError, match="missing") as ex:
+            cache.get_or_set("key", func)
+        errors.append(ex.value)
+    assert func.call_count == 1
+    assert errors[0] is not errors[1]
+
+    func = mocker.Mock(side_effect=ValueError)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get_or_set("other", func)
+    assert func.call_count == 2  # only listed errors are cached
+
+
+def test_invalidate():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
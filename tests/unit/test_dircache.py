@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from src.services import dircache
+
+
+@pytest.fixture()
+def cache():
+    return dircache.DirectoryCache(max_entries=4, ttl=60, fallback_ttl=60)
+
+
+def wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_get_or_set(cache, tmp_path):
+    calls = []
+
+    def func():
+        calls.append(1)
+        return ["a", "b"]
+
+    assert cache.get_or_set("key", str(tmp_path), func) == ["a", "b"]
+    assert cache.get_or_set("key", str(tmp_path), func) == ["a", "b"]
+    assert len(calls) == 1
+    assert cache.info()["hits"] == 1
+
+
+def test_cache_is_bounded_by_entries(cache, tmp_path):
+    cache.get_or_set("old", str(tmp_path), lambda: ["a", "b", "c"])
+    cache.get_or_set("new", str(tmp_path), lambda: ["a", "b"])
+    assert cache.get("old") is None
+    assert cache.get("new") == ["a", "b"]
+    assert cache.info()["entries"] == 2
+
+
+def test_changes_invalidate_listings(cache, tmp_path):
+    if cache.inotify is None:
+        pytest.skip("inotify is not supported")
+    cache.get_or_set("key", str(tmp_path), lambda: [])
+    assert cache.info()["watches"] == 1
+    (tmp_path / "file.txt").touch()
+    assert wait(lambda: cache.get("key") is None)
+    assert wait(lambda: cache.info()["watches"] == 0)
+
+
+def test_listings_expire_without_inotify(tmp_path):
+    cache = dircache.DirectoryCache(ttl=60, fallback_ttl=0, watch=False)
+    cache.get_or_set("key", str(tmp_path), lambda: [])
+    assert cache.get("key") is None
+
+
+def test_listing_changed_while_listed_is_not_cached(cache, tmp_path):
+    def func():
+        cache.invalidate(str(tmp_path))
+        return []
+
+    cache.get_or_set("key", str(tmp_path), func)
+    assert cache.get("key") is None
+
+
+def test_failed_listing_is_not_watched(cache, tmp_path):
+    if cache.inotify is None:
+        pytest.skip("inotify is not supported")
+
+    def func():
+        raise PermissionError
+
+    with pytest.raises(PermissionError):
+        cache.get_or_set("key", str(tmp_path), func)
+    assert cache.info()["watches"] == 0
+
+
+def test_remote_mounts(tmp_path):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "server:/export /mnt/my\\040data nfs4 rw 0 0\n/dev/sda1 / ext4 rw 0 0\n"
+    )
+    assert dircache.remote_mounts(str(mounts)) == ["/mnt/my data"]
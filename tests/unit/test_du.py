@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from src.utils import du
+from src.utils.cache import TTLCache
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = TTLCache()
+    monkeypatch.setattr(du, "cache", cache)
+    return cache
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "file.txt").write_bytes(b"x" * 10)
+    (tmp_path / "a" / "file.txt").write_bytes(b"x" * 100)
+    (tmp_path / "a" / "b" / "file.txt").write_bytes(b"x" * 1000)
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+def test_disk_usage(tree, workers):
+    assert du.disk_usage(str(tree), workers=workers) == (1110, True)
+    assert du.disk_usage(str(tree / "a")) == (1100, True)
+    assert du.disk_usage(str(tree / "file.txt")) == (10, True)
+    with pytest.raises(FileNotFoundError):
+        du.disk_usage(str(tree / "missing"))
+
+
+def test_disk_usage_is_cached_per_directory(tree, cache):
+    du.disk_usage(str(tree))
+    assert len(cache) == 3
+    (tree / "a" / "b" / "file.txt").write_bytes(b"x")  # directory left as is
+    assert du.disk_usage(str(tree)) == (1110, True)
+    (tree / "a" / "b" / "other.txt").write_bytes(b"x")
+    assert du.disk_usage(str(tree)) == (112, True)
+    assert du.disk_usage(str(tree), user="other") == (112, True)
+    assert len(cache) == 7
+
+
+def test_disk_usage_within_budget(tree, cache):
+    assert du.disk_usage(str(tree), budget=0) == (10, False)
+    assert len(cache) == 1  # the top directory, scanned before the budget applies
+    assert du.disk_usage(str(tree), budget=None) == (1110, True)
+
+
+def test_disk_usage_skips_unreadable_directories(tree, monkeypatch):
+    scandir = os.scandir
+
+    def restricted(path):
+        if path.endswith("b"):
+            raise PermissionError(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", restricted)
+    assert du.disk_usage(str(tree)) == (110, True)
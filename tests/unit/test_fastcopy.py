@@ -0,0 +1,84 @@
+import errno
+import os
+import shutil
+
+import pytest
+
+from src.utils import fastcopy
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    src = tmp_path / "src"
+    (src / "dir").mkdir(parents=True)
+    (src / "file.txt").write_bytes(b"text")
+    (src / "dir" / "nested.txt").write_bytes(os.urandom(1024 * 1024))
+    os.utime(src / "file.txt", (0, 0))
+    return src
+
+
+def test_copyfile(tree, tmp_path):
+    fastcopy.copyfile(tree / "file.txt", tmp_path / "copy.txt")
+    assert (tmp_path / "copy.txt").read_bytes() == b"text"
+
+
+@pytest.mark.parametrize("method", ("_clone", "_copy_file_range", "_sendfile"))
+def test_copyfile_falls_back_when_unsupported(tree, tmp_path, mocker, method):
+    mocker.patch.object(fastcopy, method, side_effect=OSError(errno.EXDEV, ""))
+    src = tree / "dir" / "nested.txt"
+    fastcopy.copyfile(src, tmp_path / "copy.txt")
+    assert (tmp_path / "copy.txt").read_bytes() == src.read_bytes()
+
+
+def test_copy2_keeps_metadata(tree, tmp_path):
+    (tree / "file.txt").chmod(0o640)
+    dst = fastcopy.copy2(tree / "file.txt", tmp_path)
+    assert dst == str(tmp_path / "file.txt")
+    assert os.stat(dst).st_mtime == 0
+    assert os.stat(dst).st_mode == os.stat(tree / "file.txt").st_mode
+
+
+def test_copytree(tree, tmp_path):
+    sizes = []
+    fastcopy.copytree(tree, tmp_path / "dst", workers=2, progress=sizes.append)
+    assert (tmp_path / "dst" / "file.txt").read_bytes() == b"text"
+    assert (tmp_path / "dst" / "dir" / "nested.txt").read_bytes() == (
+        tree / "dir" / "nested.txt"
+    ).read_bytes()
+    assert sorted(sizes) == [4, 1024 * 1024]
+
+
+def test_copytree_without_workers(tree, tmp_path, mocker):
+    pool = mocker.spy(fastcopy.threads.concurrent.futures, "ThreadPoolExecutor")
+    fastcopy.copytree(tree, tmp_path / "dst", workers=0)
+    assert (tmp_path / "dst" / "dir" / "nested.txt").exists()
+    assert pool.call_count == 0  # copied in the calling thread
+
+
+def test_copytree_reports_errors_per_file(tree, tmp_path):
+    os.mkfifo(tree / "pipe")
+    with pytest.raises(shutil.Error) as ex:
+        fastcopy.copytree(tree, tmp_path / "dst")
+    ((src, _, message),) = ex.value.args[0]
+    assert src == str(tree / "pipe")
+    assert "named pipe" in message
+    assert (tmp_path / "dst" / "file.txt").exists()
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+def test_copytree_reports_any_error(tree, tmp_path, workers):
+    def progress(size):
+        raise RuntimeError(f"progress of {size}")
+
+    with pytest.raises(shutil.Error) as ex:
+        fastcopy.copytree(tree, tmp_path / "dst", workers=workers, progress=progress)
+    assert sorted(message for _, _, message in ex.value.args[0]) == [
+        "progress of 1048576",
+        "progress of 4",
+    ]
+
+
+def test_copytree_on_missing_path_raises_exception(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        fastcopy.copytree(tmp_path / "missing", tmp_path / "dst")
+    assert not (tmp_path / "dst").exists()
@@ -0,0 +1,117 @@
+import os
+import pwd
+
+import pytest
+
+from src.services import fileindex, filemgr
+from src.services.filemgr import FileManagerSvc
+
+# the services run as the user running the tests, who needs no privileges
+USER = pwd.getpwuid(os.getuid()).pw_name
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    root = tmp_path / "root"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / ".hidden").mkdir()
+    (root / "Report.txt").write_text("text")
+    (root / "a" / "report_1.csv").write_text("a,b")
+    (root / "a" / "b" / "notes.txt").write_text("notes")
+    (root / ".hidden" / "report.txt").write_text("text")
+    return root
+
+
+@pytest.fixture()
+def index(tmp_path, tree):
+    index = fileindex.FileIndex(str(tmp_path / "index.db"))
+    index.scan(str(tree))
+    return index
+
+
+def candidates(index, path, pattern):
+    return sorted(
+        os.path.basename(path)
+        for batch in index.candidates(str(path), pattern)
+        for path in batch
+    )
+
+
+def test_scan(index, tree):
+    assert index.root(str(tree / "a")) == str(tree)
+    assert index.root(str(tree.parent)) is None
+    assert candidates(index, tree, "port") == [
+        "Report.txt",
+        "report.txt",
+        "report_1.csv",
+    ]
+    assert candidates(index, tree / "a", "*.csv") == ["report_1.csv"]
+    assert candidates(index, tree, "t_1") == ["report_1.csv"]  # '_' taken as is
+    assert index.usage(str(tree / "a")) == (8, 2)
+
+
+def test_rescan_drops_removed_files(index, tree):
+    (tree / "a" / "report_1.csv").unlink()
+    (tree / "a" / "b" / "new.txt").write_text("new")
+    index.scan(str(tree))
+    assert candidates(index, tree, "*.csv") == []
+    assert candidates(index, tree, "new") == ["new.txt"]
+
+
+def test_update(index, tree):
+    (tree / "c").mkdir()
+    (tree / "c" / "report.md").write_text("text")
+    index.update(str(tree / "c"))
+    assert candidates(index, tree, "report.md") == ["report.md"]
+    (tree / "c" / "report.md").unlink()
+    (tree / "c").rmdir()
+    index.update(str(tree / "c"))
+    assert candidates(index, tree, "report.md") == []
+
+
+def test_search_with_index(index, tree, monkeypatch):
+    monkeypatch.setattr(fileindex, "index", index)
+    svc = FileManagerSvc(username=USER)
+    files = svc.search_stats(path=str(tree), pattern="REPORT")
+    assert sorted(file["name"] for file in files) == ["Report.txt", "report_1.csv"]
+    files = svc.search_stats(path=str(tree), pattern="*.txt", max_depth=1)
+    assert [file["name"] for file in files] == ["Report.txt"]
+    files = svc.search_stats(path=str(tree), pattern="report", show_hidden=True)
+    assert len(list(files)) == 3
+    (tree / "Report.txt").unlink()  # not indexed yet, but gone
+    files = svc.search_stats(path=str(tree), pattern="*.txt", case_sensitive=True)
+    assert sorted(file["name"] for file in files) == ["notes.txt"]
+
+
+def test_disk_usage(index, tree, monkeypatch):
+    svc = FileManagerSvc(username=USER)
+    (tree / "a" / "late.txt").write_text("not indexed yet")
+    assert svc.disk_usage(str(tree / "a")) == (23, True)
+    monkeypatch.setattr(fileindex, "index", index)
+    assert svc.disk_usage(str(tree / "a")) == (8, True)
+
+
+def test_disk_usage_with_unreadable_directory(index, tree, monkeypatch):
+    monkeypatch.setattr(fileindex, "index", index)
+    listable = filemgr._listable
+    unreadable = str(tree / "a" / "b")
+    monkeypatch.setattr(
+        filemgr,
+        "_listable",
+        lambda path, known: path != unreadable and listable(path, known),
+    )
+    svc = FileManagerSvc(username=USER)
+    (tree / "a" / "late.txt").write_text("not indexed yet")
+    assert svc.disk_usage(str(tree / "a")) == (23, True)  # summed by walking
+
+
+def test_listen(tmp_path, tree):
+    index = fileindex.FileIndex(str(tmp_path / "index.db"))
+    try:
+        index.inotify = fileindex.inotify.Inotify()
+    except OSError:
+        pytest.skip("inotify is not available")
+    index.scan(str(tree))
+    (tree / "a" / "b" / "later.txt").write_text("text")
+    index.listen(timeout=0.2)
+    assert candidates(index, tree, "later") == ["later.txt"]
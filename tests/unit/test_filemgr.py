@@ -1,11 +1,20 @@
+import os
+import pwd
+import stat
+
 import pytest
 
+from src.services import dircache
+from src.services.auth import user_ctx
 from src.services.filemgr import FileManagerSvc
 
+# the services run as the user running the tests, who needs no privileges
+USER = pwd.getpwuid(os.getuid()).pw_name
+
 
 @pytest.fixture(scope="class")
 def svc():
-    return FileManagerSvc(username="test")
+    return FileManagerSvc(username=USER)
 
 
 class TestFilesystemSvc:
@@ -28,6 +37,116 @@ class TestFilesystemSvc:
             svc.list_files(path="/tmp/root")
         assert "Permission denied" in str(ex.value)
 
+    def test_list_stats(self, svc, fs):
+        fs.create_file("/tmp/file.txt")
+        fs.create_file("/tmp/dir/file.txt")
+        stats = {s["name"]: s for s in svc.list_stats(path="/tmp")}
+        assert stats["file.txt"]["path"] == "/tmp/file.txt"
+        assert stats["file.txt"]["isFile"] is True
+        assert stats["dir"]["isFile"] is False
+        assert stats["dir"]["hasChild"] is False
+        assert svc.list_stats(path="/tmp", substr="dir")[0]["name"] == "dir"
+
+    def test_cached_list_stats(self, svc, fs, monkeypatch):
+        cache = dircache.DirectoryCache(watch=False)
+        monkeypatch.setattr(dircache, "cache", cache)
+        fs.create_file("/tmp/file.txt")
+        fs.create_file("/tmp/.hidden.txt")
+        assert [s["name"] for s in svc.list_stats(path="/tmp")] == ["file.txt"]
+        fs.create_file("/tmp/other.txt")  # not noticed, as not watched
+        names = {s["name"] for s in svc.list_stats(path="/tmp", show_hidden=True)}
+        assert names == {"file.txt", ".hidden.txt"}
+        cached = {s["name"]: s for s in cache.get((USER, "/tmp"))}
+        assert svc.stats("/tmp/file.txt") is cached["file.txt"]
+        svc.make_dir("/tmp", "dir")  # changes through the service drop listings
+        assert len(svc.list_stats(path="/tmp")) == 3
+
+    def test_lazy_has_child_from_cached_listings(self, svc, fs, monkeypatch):
+        monkeypatch.setattr(dircache, "cache", dircache.DirectoryCache(watch=False))
+        monkeypatch.setattr(FileManagerSvc, "has_child_strategy", "lazy")
+        fs.create_file("/tmp/leaf/file.txt")
+        fs.create_dir("/tmp/tree/dir")
+        stats = {s["name"]: s for s in svc.list_stats(path="/tmp")}
+        assert stats["leaf"]["hasChild"] is stats["tree"]["hasChild"] is True
+        svc.list_stats(path="/tmp/leaf")  # the client reads the directories
+        svc.list_stats(path="/tmp/tree")
+        stats = {s["name"]: s for s in svc.list_stats(path="/tmp")}
+        assert stats["leaf"]["hasChild"] is False
+        assert stats["tree"]["hasChild"] is True
+        assert svc.stats("/tmp/leaf")["hasChild"] is False
+
+    def test_version_of_stat_listings(self, svc, fs, monkeypatch, mocker):
+        fs.create_file("/tmp/a.txt")
+        fs.create_file("/tmp/b.txt")
+        version = svc.version("/tmp", children=True)
+        with open("/tmp/a.txt", "w") as fd:
+            fd.write("text")
+        assert svc.version("/tmp", children=True) != version
+        version = svc.version("/tmp", children=True)
+        monkeypatch.setattr(dircache, "cache", dircache.DirectoryCache(watch=False))
+        svc.list_stats("/tmp")
+        scandir = mocker.spy(os, "scandir")
+        assert svc.version("/tmp", children=True) == version  # from the listing
+        assert scandir.call_count == 0
+
+    def test_page_stats(self, svc, fs):
+        for size, name in enumerate(("c.txt", "a.txt", "b.txt")):
+            fs.create_file(f"/tmp/{name}", contents="x" * size)
+        stats, cursor = svc.page_stats(path="/tmp", limit=2)
+        assert [s["name"] for s in stats] == ["a.txt", "b.txt"]
+        stats, cursor = svc.page_stats(path="/tmp", limit=2, cursor=cursor)
+        assert [s["name"] for s in stats] == ["c.txt"]
+        assert cursor is None
+        stats, _ = svc.page_stats(path="/tmp", sort_by="size", order="desc")
+        assert [s["name"] for s in stats] == ["b.txt", "a.txt", "c.txt"]
+        with pytest.raises(ValueError):
+            svc.page_stats(path="/tmp", sort_by="mode")
+
+    def test_bulk_stats(self, svc, fs, monkeypatch):
+        monkeypatch.setattr(svc, "stat_workers", 2)
+        for index in range(5):
+            fs.create_file(f"/tmp/file{index}.txt")
+        paths = [f"/tmp/file{index}.txt" for index in range(5)] + ["/tmp/missing"]
+        stats = svc.bulk_stats(paths)
+        assert [s["path"] for s in stats[:-1]] == paths[:-1]
+        assert isinstance(stats[-1], FileNotFoundError)
+        assert svc.bulk_stats([]) == []
+
+    def test_bulk_stats_as_user(self, nobody_dir):
+        (nobody_dir / "private").mkdir(mode=0o700)
+        paths = [nobody_dir / "private" / f"{index}.txt" for index in range(20)]
+        for path in paths:
+            path.touch()
+        with user_ctx("nobody"):
+            svc = FileManagerSvc(username="nobody")
+            stats = svc.bulk_stats([str(path) for path in paths])
+            assert os.geteuid() == 65534
+        assert all(isinstance(s, PermissionError) for s in stats)
+
+    def test_search_stats_as_user(self, nobody_dir):
+        for index in range(10):
+            (nobody_dir / f"dir{index}").mkdir()
+            (nobody_dir / f"dir{index}" / "report.txt").touch()
+        (nobody_dir / "private").mkdir(mode=0o700)
+        (nobody_dir / "private" / "report.txt").touch()
+        with user_ctx("nobody"):
+            svc = FileManagerSvc(username="nobody")
+            files = list(svc.search_stats(path=str(nobody_dir), pattern="report"))
+            assert os.geteuid() == 65534
+        assert len(files) == 10
+
+    def test_disk_usage_as_user(self, nobody_dir):
+        for index in range(10):
+            (nobody_dir / f"dir{index}").mkdir()
+            (nobody_dir / f"dir{index}" / "file.txt").write_bytes(b"x" * 10)
+        (nobody_dir / "private").mkdir(mode=0o700)
+        (nobody_dir / "private" / "file.txt").write_bytes(b"x" * 1000)
+        with user_ctx("nobody"):
+            svc = FileManagerSvc(username="nobody")
+            size, complete = svc.disk_usage(str(nobody_dir))
+            assert os.geteuid() == 65534
+        assert (size, complete) == (100, True)
+
     def test_stats(self, svc, fs):
         fs.create_file("/tmp/file.txt")
         stats = svc.stats(path="/tmp/file.txt")
@@ -36,3 +155,31 @@ class TestFilesystemSvc:
         assert stats["type"] == ".txt"
         assert stats["isFile"] is True
         assert stats["hasChild"] is False
+
+    def test_has_child(self, svc, fs):
+        fs.create_dir("/tmp/parent/child")
+        fs.create_file("/tmp/leaf/file.txt")
+        assert svc.has_child("/tmp/parent") is True
+        assert svc.has_child("/tmp/leaf") is False
+        assert svc.has_child("/tmp/missing") is False
+
+    def test_has_child_strategy_per_mount(self, svc, monkeypatch):
+        monkeypatch.setattr(FileManagerSvc, "has_child_strategy", "scan")
+        monkeypatch.setattr(
+            FileManagerSvc, "has_child_mounts", {"/data": "nlink", "/data/big": "lazy"}
+        )
+        assert svc.has_child_strategy_for("/tmp/dir") == "scan"
+        assert svc.has_child_strategy_for("/data") == "nlink"
+        assert svc.has_child_strategy_for("/data/dir") == "nlink"
+        assert svc.has_child_strategy_for("/data/bigger") == "nlink"
+        assert svc.has_child_strategy_for("/data/big/dir") == "lazy"
+
+    def test_has_child_nlink_and_lazy_strategies(self, svc, fs, monkeypatch):
+        fs.create_file("/tmp/leaf/file.txt")
+        stats = os.stat_result((stat.S_IFDIR, 0, 0, 3, 0, 0, 0, 0, 0, 0))
+        monkeypatch.setattr(FileManagerSvc, "has_child_strategy", "nlink")
+        assert svc.has_child("/tmp/leaf", stats=stats) is True  # trusts st_nlink
+        stats = os.stat_result((stat.S_IFDIR, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+        assert svc.has_child("/tmp/leaf", stats=stats) is False  # falls back to scan
+        monkeypatch.setattr(FileManagerSvc, "has_child_strategy", "lazy")
+        assert svc.has_child("/tmp/leaf") is True
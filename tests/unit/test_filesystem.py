@@ -1,16 +1,23 @@
+import io
 import os
+import pathlib
+import pwd
 import stat
 import tarfile
 
 import pytest
 from werkzeug.datastructures import FileStorage
 
+from src.services.auth import user_ctx
 from src.services.filesystem import FilesystemSvc
 
+# the services run as the user running the tests, who needs no privileges
+USER = pwd.getpwuid(os.getuid()).pw_name
+
 
 @pytest.fixture(scope="class")
 def svc():
-    return FilesystemSvc(username="test")
+    return FilesystemSvc(username=USER)
 
 
 class TestFilesystemSvc:
@@ -19,6 +26,17 @@ class TestFilesystemSvc:
         file = next(iter(svc.list_files(path="/tmp/")))
         assert file.name == "file.txt"
 
+    def test_iter_files(self, svc, fs):
+        fs.create_file("/tmp/file.txt", contents="text")
+        fs.create_file("/tmp/.hidden.txt")
+        files = svc.iter_files(path="/tmp/", stat=True)
+        assert [(f.name, f.stat().st_size) for f in files] == [("file.txt", 4)]
+        assert len(list(svc.iter_files(path="/tmp/", show_hidden=True))) == 2
+
+    def test_iter_files_on_missing_file_raises_exception(self, svc):
+        with pytest.raises(FileNotFoundError):
+            svc.iter_files(path="/tmp/missing.txt")
+
     def test_list_files_on_missing_file_raises_exception(self, svc):
         with pytest.raises(FileNotFoundError) as ex:
             svc.list_files(path="/tmp/missing.txt")
@@ -46,12 +64,74 @@ class TestFilesystemSvc:
             svc.stats(path="/tmp/root")
         assert "Permission denied" in str(ex.value)
 
-    def test_save_file(self, svc, fs, mocker):
-        file = FileStorage(filename="file.txt")
-        mocker.patch.object(file, "save")
+    def test_save_file(self, svc, fs):
+        file = FileStorage(io.BytesIO(b"text"), filename="file.txt")
         svc.save_file(dst="/tmp", file=file)
-        assert file.filename == "file.txt"
-        assert fs.exists("/tmp/file.txt") is False
+        with open("/tmp/file.txt") as fd:
+            assert fd.read() == "text"
+        assert os.listdir("/tmp") == ["file.txt"]  # no temporary file left
+
+    def test_save_files(self, svc, fs):
+        fs.create_file("/tmp/file1.txt", contents="old")
+        files = [
+            FileStorage(io.BytesIO(f"text{i}".encode()), filename=f"file{i}.txt")
+            for i in range(2, 5)
+        ]
+        svc.save_files(dst="/tmp", files=files)
+        with open("/tmp/file3.txt") as fd:
+            assert fd.read() == "text3"
+        with pytest.raises(FileExistsError):
+            svc.save_files(dst="/tmp", files=[FileStorage(filename="file1.txt")])
+
+    def test_save_files_keeps_the_user_of_the_process(self, nobody_dir):
+        files = [
+            FileStorage(io.BytesIO(b"text"), filename=f"{i}.txt") for i in range(20)
+        ]
+        with user_ctx("nobody"):
+            svc = FilesystemSvc(username="nobody")
+            svc.save_files(dst=str(nobody_dir), files=files)
+            assert os.geteuid() == 65534
+        assert {path.stat().st_uid for path in nobody_dir.iterdir()} == {65534}
+
+    def test_copy_path_keeps_the_user_of_the_process(self, nobody_dir):
+        (nobody_dir / "src").mkdir()
+        for i in range(20):
+            (nobody_dir / "src" / f"{i}.txt").write_bytes(b"text")
+        with user_ctx("nobody"):
+            svc = FilesystemSvc(username="nobody")
+            dst = svc.copy_path(src=str(nobody_dir / "src"), dst=str(nobody_dir))
+            assert os.geteuid() == 65534
+        copies = pathlib.Path(dst).iterdir()
+        assert {path.stat().st_uid for path in copies} == {65534}
+
+    def test_extract_archive_keeps_the_user_of_the_process(self, nobody_dir):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for i in range(20):
+                info = tarfile.TarInfo(f"{i}.txt")
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"text"))
+        buffer.seek(0)
+        with user_ctx("nobody"):
+            svc = FilesystemSvc(username="nobody")
+            assert svc.extract_archive(dst=str(nobody_dir), fileobj=buffer) == 20
+            assert os.geteuid() == 65534
+        assert {path.stat().st_uid for path in nobody_dir.iterdir()} == {65534}
+
+    def test_save_files_overwrites_existing_files(self, svc, fs):
+        fs.create_file("/tmp/file.txt", contents="old")
+        file = FileStorage(io.BytesIO(b"new"), filename="file.txt")
+        svc.save_files(dst="/tmp", files=[file], overwrite=True)
+        with open("/tmp/file.txt") as fd:
+            assert fd.read() == "new"
+        with pytest.raises(FileNotFoundError):
+            svc.save_files(
+                dst="/tmp", files=[FileStorage(filename="other.txt")], overwrite=True
+            )
+        with pytest.raises(FileNotFoundError):
+            svc.save_files(
+                dst="/tmp/missing", files=[FileStorage(filename="x")], overwrite=True
+            )
 
     def test_make_dir(self, svc, fs):
         fs.create_dir("/tmp/")
@@ -143,6 +223,22 @@ class TestFilesystemSvc:
         assert os.path.basename(filepath) in names
         assert os.path.basename(dirpath) in names
 
+    def test_stream_attachment(self, svc, fs, monkeypatch):
+        # blocks are then written as they go
+        monkeypatch.setattr(svc, "compression_threads", 1)
+        data = os.urandom(1024 * 1024)  # incompressible
+        fs.create_file("/tmp/dir/file.txt", contents=data)
+        fs.create_file("/tmp/dir/sub/other.txt", contents="y" * 100)
+        chunks = list(svc.stream_attachment(paths=("/tmp/dir",), bufsize=16384))
+        assert len(chunks) > 1
+        tar = tarfile.open(fileobj=io.BytesIO(b"".join(chunks)))
+        assert tar.getnames() == ["dir", "dir/file.txt", "dir/sub", "dir/sub/other.txt"]
+        assert tar.extractfile("dir/file.txt").read() == data
+
+    def test_stream_attachment_on_missing_path_raises_exception(self, svc):
+        with pytest.raises(FileNotFoundError):
+            svc.stream_attachment(paths=("/tmp/missing",))
+
     def test_isfile(self, svc, fs):
         filepath = "/tmp/file.txt"
         dirpath = "/tmp/dir"
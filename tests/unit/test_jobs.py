@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from src.services import auth, jobs
+from src.services.filemgr import FileManagerSvc
+
+
+def wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture()
+def manager(tmp_path, mocker):
+    mocker.patch.object(auth, "backend", mocker.Mock(per_thread=True))
+    manager = jobs.JobManager(workers=2, per_user=1, spool=str(tmp_path))
+    yield manager
+    manager.shutdown()
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    src = tmp_path / "src"
+    (src / "dir" / "sub").mkdir(parents=True)
+    (src / "dir" / "file.txt").write_bytes(b"text")
+    (src / "dir" / "sub" / "nested.txt").write_bytes(b"x" * 1024)
+    (tmp_path / "dst").mkdir()
+    return tmp_path
+
+
+def test_copy_job_counts_progress(manager, tree):
+    svc = FileManagerSvc()
+    job = manager.submit(
+        None, "copy", jobs.copy_job, svc, str(tree / "src"), ["dir"], str(tree / "dst")
+    )
+    assert wait(job).status == "done"
+    assert (job.files, job.bytes) == (2, 1028)
+    assert job.result == {"paths": [str(tree / "dst" / "dir")]}
+    assert (tree / "dst" / "dir" / "sub" / "nested.txt").read_bytes() == b"x" * 1024
+
+
+def test_delete_job(manager, tree):
+    job = manager.submit(
+        None, "delete", jobs.delete_job, FileManagerSvc(), str(tree / "src"), ["dir"]
+    )
+    assert wait(job).status == "done"
+    assert job.files == 2
+    assert not (tree / "src" / "dir").exists()
+
+
+def test_archive_job_spools_archive(manager, tree):
+    job = manager.submit(
+        None,
+        "archive",
+        jobs.archive_job,
+        FileManagerSvc(),
+        paths=[str(tree / "src" / "dir")],
+        filename="dir.tar.gz",
+        bufsize=1024,
+        spool=manager.spool,
+    )
+    assert wait(job).status == "done"
+    assert job.result["filename"] == "dir.tar.gz"
+    with open(job.result["archive"], "rb") as file:
+        assert file.read(2) == b"\x1f\x8b"
+
+
+def test_failed_job_keeps_error(manager, tree):
+    svc = FileManagerSvc()
+    job = manager.submit(None, "delete", jobs.delete_job, svc, str(tree), ["missing"])
+    assert wait(job).status == "failed"
+    assert "missing" in job.error
+
+
+def test_cancel_job(manager):
+    started = threading.Event()
+
+    def func(job):
+        started.set()
+        while True:
+            job.check()
+            time.sleep(0.01)
+
+    job = manager.submit(None, "copy", func)
+    started.wait(5)
+    manager.cancel(job.id, None)
+    assert wait(job).status == "cancelled"
+
+
+def test_user_limit(manager):
+    release = threading.Event()
+    job = manager.submit("user", "copy", lambda job: release.wait(5))
+    with pytest.raises(jobs.JobLimitError):
+        manager.submit("user", "copy", lambda job: None)
+    manager.submit("other", "copy", lambda job: None)  # others are not limited
+    release.set()
+    wait(job)
+
+
+def test_jobs_of_other_users_are_hidden(manager):
+    job = manager.submit("user", "copy", lambda job: None)
+    assert manager.get(job.id, "user") is job
+    with pytest.raises(KeyError):
+        manager.get(job.id, "other")
+
+
+def test_finished_jobs_are_purged(manager, tree):
+    manager.retention = 0
+    job = wait(manager.submit(None, "copy", lambda job: None))
+    time.sleep(0.01)
+    manager.purge()
+    assert job.id not in manager.jobs
+
+
+def test_archives_of_finished_jobs_are_purged_as_the_process(manager, tmp_path, mocker):
+    archive = tmp_path / "job-1.tar.gz"
+    archive.touch()
+    job = wait(manager.submit("user", "archive", lambda job: {"archive": str(archive)}))
+    user_ctx = mocker.spy(jobs, "user_ctx")
+    manager.retention = 0
+    time.sleep(0.01)
+    manager.submit("other", "copy", lambda job: None)  # purges as it submits
+    assert job.id not in manager.jobs
+    assert not archive.exists()
+    user_ctx.assert_any_call(None)
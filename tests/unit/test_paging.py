@@ -0,0 +1,61 @@
+import pytest
+
+from src.utils import paging
+
+
+def key(item):
+    return (item,)
+
+
+def test_page_selects_first_items():
+    items = [5, 3, 9, 1, 7]
+    assert paging.page(items, key, limit=2) == ([1, 3], (3,))
+    assert paging.page(items, key, limit=2, after=(3,)) == ([5, 7], (7,))
+    assert paging.page(items, key, limit=2, after=(7,)) == ([9], None)
+    assert paging.page(items, key, limit=5) == ([1, 3, 5, 7, 9], None)
+
+
+def test_page_in_reverse_order():
+    items = [5, 3, 9, 1, 7]
+    assert paging.page(items, key, limit=2, reverse=True) == ([9, 7], (7,))
+    assert paging.page(items, key, limit=2, after=(7,), reverse=True) == (
+        [5, 3],
+        (3,),
+    )
+
+
+def test_page_without_limit_sorts_every_item():
+    assert paging.page(iter([2, 1, 3]), key) == ([1, 2, 3], None)
+
+
+def test_paginate_follows_cursors():
+    items = list(range(10))
+    pages = []
+    cursor = None
+    while True:
+        selected, cursor = paging.paginate(
+            items, key, "v1", "name", limit=3, cursor=cursor
+        )
+        pages.append(selected)
+        if cursor is None:
+            break
+    assert pages == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_paginate_rejects_stale_cursor():
+    _, cursor = paging.paginate(["a", "b"], key, "v1", "name", limit=1)
+    assert paging.paginate(["a", "b"], key, "v1", "name", limit=1, cursor=cursor)
+    with pytest.raises(paging.StaleCursorError):
+        paging.paginate(["a", "b"], key, "v2", "name", limit=1, cursor=cursor)
+
+
+def test_paginate_rejects_invalid_cursor():
+    _, cursor = paging.paginate(["a", "b"], key, "v1", "name", limit=1)
+    with pytest.raises(ValueError):
+        paging.paginate(["a"], key, "v1", "size", limit=1, cursor=cursor)
+    with pytest.raises(ValueError):
+        paging.paginate(["a"], key, "v1", "name", order="desc", cursor=cursor)
+    with pytest.raises(ValueError):
+        paging.paginate(["a"], key, "v1", "name", cursor="garbage")
+    with pytest.raises(ValueError):
+        paging.paginate(["a"], key, "v1", "name", limit=0)
@@ -0,0 +1,43 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from src.utils.pgzip import ParallelGzipWriter
+
+
+@pytest.mark.parametrize("threads", (1, 4))
+def test_output_is_valid_gzip(threads):
+    data = os.urandom(300 * 1024) + b"text" * 100_000
+    output = io.BytesIO()
+    with ParallelGzipWriter(output, threads=threads, blocksize=64 * 1024) as writer:
+        for offset in range(0, len(data), 10_000):
+            writer.write(data[offset : offset + 10_000])
+        assert writer.tell() == len(data)
+    assert gzip.decompress(output.getvalue()) == data
+
+
+def test_empty_output_is_valid_gzip():
+    output = io.BytesIO()
+    ParallelGzipWriter(output).close()
+    assert gzip.decompress(output.getvalue()) == b""
+
+
+def test_set_level_stores_data():
+    data = b"text" * 100_000
+    stored, compressed = io.BytesIO(), io.BytesIO()
+    with ParallelGzipWriter(stored) as writer:
+        writer.set_level(0)
+        writer.write(data)
+    with ParallelGzipWriter(compressed) as writer:
+        writer.write(data)
+    assert len(stored.getvalue()) > len(data) > len(compressed.getvalue())
+    assert gzip.decompress(stored.getvalue()) == data
+
+
+def test_write_after_close_raises_exception():
+    writer = ParallelGzipWriter(io.BytesIO())
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(b"data")
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from src.utils import search
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / ".hidden").mkdir()
+    for path in ("Report.txt", "a/report.csv", "a/b/notes.txt", "a/b/c/report.txt"):
+        (tmp_path / path).write_text("text")
+    (tmp_path / ".hidden" / "report.txt").write_text("text")
+    return tmp_path
+
+
+def names(entries):
+    return sorted(entry.name for entry in entries)
+
+
+def test_matcher():
+    assert search.matcher("port")("Report.txt")
+    assert not search.matcher("port", case_sensitive=True)("REPORT.txt")
+    assert search.matcher("*.TXT")("notes.txt")
+    assert not search.matcher("*.txt")("notes.txt.bak")
+    assert search.matcher("a+b")("a+b.txt")  # no regular expressions
+    assert not search.matcher("a+b")("aab.txt")
+    assert search.matcher("")("anything")
+
+
+@pytest.mark.parametrize("workers", (0, 2))
+def test_walk(tree, workers):
+    entries = list(search.walk(str(tree), search.matcher("report"), workers=workers))
+    assert names(entries) == ["Report.txt", "report.csv", "report.txt"]
+    assert all(entry.stat().st_size == 4 for entry in entries)
+    entries = search.walk(str(tree), search.matcher("report"), show_hidden=True)
+    assert len(list(entries)) == 4
+
+
+def test_walk_with_limits(tree):
+    match = search.matcher("*.txt")
+    assert names(search.walk(str(tree), match, max_depth=1)) == ["Report.txt"]
+    assert names(search.walk(str(tree), match, max_depth=3)) == [
+        "Report.txt",
+        "notes.txt",
+    ]
+    assert len(list(search.walk(str(tree), match, max_results=2))) == 2
+    cancel = threading.Event()
+    cancel.set()
+    assert list(search.walk(str(tree), match, cancel=cancel)) == []
+
+
+def test_walk_directories(tree):
+    entries = search.walk(str(tree), search.matcher("b"))
+    assert [entry.is_dir() for entry in entries] == [True]
+
+
+def test_walk_missing_directory(tree):
+    with pytest.raises(FileNotFoundError):
+        list(search.walk(str(tree / "missing"), search.matcher("")))
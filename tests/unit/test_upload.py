@@ -0,0 +1,66 @@
+import io
+import os
+import stat
+
+import pytest
+
+from src.utils import upload
+
+
+class FailingStream(io.BytesIO):
+    def readinto(self, buffer):
+        raise OSError("connection lost")
+
+
+@pytest.mark.parametrize("durability", upload.DURABILITY)
+def test_write_file(fs, durability):
+    size = upload.write_file(
+        "/tmp/file.txt", io.BytesIO(b"text" * 100), durability=durability, bufsize=7
+    )
+    assert size == 400
+    with open("/tmp/file.txt") as fd:
+        assert fd.read() == "text" * 100
+    assert os.listdir("/tmp") == ["file.txt"]
+
+
+def test_write_file_does_not_replace_existing_file(fs):
+    fs.create_file("/tmp/file.txt", contents="old")
+    with pytest.raises(FileExistsError):
+        upload.write_file("/tmp/file.txt", io.BytesIO(b"new"))
+    with open("/tmp/file.txt") as fd:
+        assert fd.read() == "old"
+    assert os.listdir("/tmp") == ["file.txt"]
+
+
+def test_write_file_overwrites_keeping_permissions(fs):
+    fs.create_file("/tmp/file.txt", contents="old", st_mode=stat.S_IFREG | 0o640)
+    upload.write_file("/tmp/file.txt", io.BytesIO(b"new"), overwrite=True)
+    with open("/tmp/file.txt") as fd:
+        assert fd.read() == "new"
+    assert stat.S_IMODE(os.stat("/tmp/file.txt").st_mode) == 0o640
+
+
+def test_failed_write_leaves_nothing_behind(fs):
+    fs.create_file("/tmp/file.txt", contents="old")
+    with pytest.raises(OSError):
+        upload.write_file("/tmp/file.txt", FailingStream(), overwrite=True)
+    with open("/tmp/file.txt") as fd:
+        assert fd.read() == "old"
+    assert os.listdir("/tmp") == ["file.txt"]
+
+
+def test_write_file_rejects_unknown_durability(fs):
+    with pytest.raises(ValueError):
+        upload.write_file("/tmp/file.txt", io.BytesIO(), durability="always")
+
+
+def test_metrics():
+    metrics = upload.Throughput()
+    metrics.add(100, 0.5)
+    metrics.add(300, 1.5)
+    assert metrics.info() == {
+        "files": 2,
+        "bytes": 400,
+        "seconds": 2.0,
+        "bytes_per_second": 200.0,
+    }
@@ -1,14 +1,18 @@
 from dataclasses import asdict
+import json
+import pwd
 
 import pytest
 import werkzeug.exceptions
 
+from src import utils
 from src.utils import (
     convert_bytes,
     normpath,
     http_response,
     abort_with,
 )
+from src.utils.cache import TTLCache
 
 
 def test_convert_bytes():
@@ -73,3 +77,35 @@ def test_abort_with():
         "reason": "Forbidden",
         "message": "custom message",
     }
+
+
+def test_user_lookups_are_cached(mocker):
+    mocker.patch.object(utils, "nss_cache", TTLCache(negative=(KeyError,)))
+    entry = pwd.struct_passwd(("test", "x", 1000, 1000, "", "/home/test", "/bin/sh"))
+    getpwnam = mocker.patch("pwd.getpwnam", return_value=entry)
+    assert utils.user_uid("test") == 1000
+    assert utils.user_gid("test") == 1000
+    assert getpwnam.call_count == 1
+
+    getpwnam.side_effect = KeyError("missing")
+    utils.warm_nss_cache(["missing"])
+    with pytest.raises(KeyError):
+        utils.user_uid("missing")
+    assert getpwnam.call_count == 2
+
+
+@pytest.mark.parametrize("bufsize", (1, 1024))
+def test_stream_json(bufsize):
+    items = ["a", {"b": 1}, None]
+    response = utils.stream_json(iter(items), bufsize=bufsize)
+    assert response.mimetype == "application/json"
+    assert json.loads(response.get_data()) == items
+    response = utils.stream_json(iter(items), "application/x-ndjson", bufsize)
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == items
+    response = utils.stream_json(iter(()), bufsize=bufsize)
+    assert json.loads(response.get_data()) == []
+    response = utils.stream_json(iter(items), envelope={"a": 1}, key="items")
+    assert json.loads(response.get_data()) == {"a": 1, "items": items}
+    response = utils.stream_json(iter(()), envelope={}, key="items")
+    assert json.loads(response.get_data()) == {"items": []}
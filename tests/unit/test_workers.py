@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import pwd
+import threading
+
+import flask
+import pytest
+
+from src.services import auth, dircache
+from src.services.auth import user_ctx
+from src.services.filemgr import FileManagerSvc
+from src.services.filesystem import FilesystemSvc
+from src.services.workers import UserPool, serve
+
+# the helpers of the user running the tests need no privileges
+USER = pwd.getpwuid(os.getuid()).pw_name
+
+
+@pytest.fixture()
+def pool(monkeypatch):
+    pool = UserPool(max_users=1, processes=2)
+    monkeypatch.setattr(auth, "pool", pool)
+    yield pool
+    pool.close()
+
+
+def test_remote_calls(pool, tmp_path):
+    (tmp_path / "file.txt").touch()
+    svc = FilesystemSvc(username=USER)
+    assert svc.exists_path(str(tmp_path / "file.txt")) is True
+    assert svc.stats(str(tmp_path / "file.txt")).st_size == 0
+    assert list(pool.users) == [USER]
+
+    stats = FileManagerSvc(username=USER).stats(str(tmp_path / "file.txt"))
+    assert stats["name"] == "file.txt"
+
+
+def test_remote_calls_raise_exceptions(pool, tmp_path):
+    svc = FilesystemSvc(username=USER)
+    with pytest.raises(FileNotFoundError):
+        svc.stats(str(tmp_path / "missing.txt"))
+
+
+def test_remote_calls_invalidate_listings(pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(dircache, "cache", dircache.DirectoryCache(watch=False))
+    svc = FileManagerSvc(username=USER)
+    assert svc.list_stats(str(tmp_path)) == []
+    svc.make_dir(str(tmp_path), "dir")
+    assert list(pool.users) == [USER]
+    assert [file["name"] for file in svc.list_stats(str(tmp_path))] == ["dir"]
+
+
+def test_helpers_get_the_settings(tmp_path, monkeypatch):
+    config = flask.Config(".")
+    config.from_object("src.settings.config.TestingConfig")
+    config["HAS_CHILD_STRATEGY"] = "lazy"
+    (tmp_path / "leaf").mkdir()
+    pool = UserPool(max_users=1, processes=1, config=dict(config))
+    monkeypatch.setattr(auth, "pool", pool)
+    try:
+        stats = FileManagerSvc(username=USER).scan_stats(str(tmp_path))
+    finally:
+        pool.close()
+    assert stats[0]["hasChild"] is True  # although scanning finds no child
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="requires root")
+def test_helpers_start_as_the_server(pool, mocker):
+    euids = []
+
+    def start(username, context, config):
+        euids.append(os.geteuid())
+        return mocker.Mock(lock=threading.Lock())
+
+    mocker.patch("src.services.workers.UserWorker", side_effect=start)
+    with user_ctx("nobody"):
+        pool.acquire("nobody").lock.release()
+        assert os.geteuid() == 65534
+    assert euids == [0]
+
+
+def test_local_calls_skip_pool(pool, tmp_path):
+    (tmp_path / "file.txt").touch()
+    svc = FilesystemSvc(username=USER)
+    assert [file.name for file in svc.list_files(str(tmp_path))] == ["file.txt"]
+    assert not pool.users
+
+
+def test_least_recently_used_user_is_evicted(pool):
+    worker = pool.acquire("user1")
+    worker.lock.release()
+    pool.acquire("user2").lock.release()
+    assert list(pool.users) == ["user2"]
+    assert worker.alive is False
+
+
+def test_unknown_user_calls_fail(pool, tmp_path):
+    svc = FilesystemSvc(username="missing-user")
+    with pytest.raises(PermissionError):
+        svc.exists_path(str(tmp_path))
+
+
+def test_helper_refuses_calls_without_privileges(mocker, monkeypatch):
+    monkeypatch.setattr(auth, "pool", None)
+    monkeypatch.setattr(auth, "backend", auth.backend)
+    mocker.patch("os.setgroups")
+    mocker.patch("os.setgid")
+    mocker.patch("os.setuid", side_effect=PermissionError("not permitted"))
+    conn, child = multiprocessing.Pipe()
+    thread = threading.Thread(target=serve, args=("nobody", child))
+    thread.start()
+    conn.send((os.getpid, (), {}))
+    result, error = conn.recv()
+    conn.close()
+    thread.join()
+    assert result is None
+    assert isinstance(error, PermissionError)
+
+
+def test_busy_user_gets_more_processes(pool):
+    worker1 = pool.acquire("test")
+    worker2 = pool.acquire("test")
+    assert worker1 is not worker2
+    assert worker1.process.pid != os.getpid()
+    worker1.lock.release()
+    worker2.lock.release()
+    assert pool.acquire("test") is worker1